@@ -0,0 +1,340 @@
+"""
+Batch Mode
+Headless command-line conversion of CSV or JSON Lines rows to note durations
+and beat positions:
+
+    python bpm_calculator.py batch [INPUT] [--format csv|jsonl] [--output FILE] [--workers N]
+
+Each row has bpm, note, modifier, time_signature (or numerator and
+denominator), bar and beat; everything but bpm is optional. Rows are echoed
+with duration_ms and position_ms appended (empty/null when invalid). Input
+is processed in fixed-size chunks, so memory use does not grow with the
+input size.
+"""
+
+import argparse
+import csv
+import gc
+import itertools
+import json
+import sys
+
+import instrumentation
+import note_registry
+import timing_engine
+
+DEFAULT_CHUNK_SIZE = 65536
+
+# Inputs this small are converted row by row so NumPy never has to be imported
+SCALAR_ROW_LIMIT = 1000
+
+# Same defaults as empty fields in the GUI
+DEFAULTS = {
+    "bpm": "",
+    "note": "Quarter Note (1/4)",
+    "modifier": "Normal",
+    "numerator": "4",
+    "denominator": "4",
+    "bar": "1",
+    "beat": "1",
+}
+
+OUTPUT_COLUMNS = ("duration_ms", "position_ms")
+
+NEWLINE = "\r\n"
+
+
+def _note_aliases():
+    """Accepted spellings for each note value: "1/8", "eighth", "quaver" or the GUI name"""
+    british = ["semibreve", "minim", "crotchet", "quaver", "semiquaver", "demisemiquaver",
+               "hemidemisemiquaver", "semihemidemisemiquaver"]
+    aliases = {}
+    for name, british_name in zip(timing_engine.NOTE_VALUES, british):
+        american = name.split(" Note")[0].lower()
+        fraction = name[name.index("(") + 1:name.index(")")]
+        for alias in (name.lower(), american, f"{american} note", fraction, british_name):
+            aliases[alias] = name
+    return aliases
+
+
+NOTE_ALIASES = _note_aliases()
+
+
+def note_id(note, modifier):
+    """note_registry ID for a note/modifier spelling, or INVALID_ID if either is unknown"""
+    note = "" if note is None else str(note).strip()
+    modifier = "" if modifier is None else str(modifier).strip()
+    name = NOTE_ALIASES.get(note.lower() or DEFAULTS["note"].lower())
+    if name is None:
+        return note_registry.INVALID_ID
+    try:
+        return note_registry.rhythm_id(name, modifier or DEFAULTS["modifier"])
+    except ValueError:
+        return note_registry.INVALID_ID
+
+
+def note_multiplier(note, modifier):
+    """Multiplier for a note/modifier spelling, or None if either is unknown"""
+    rid = note_id(note, modifier)
+    return None if rid == note_registry.INVALID_ID else note_registry.multiplier(rid)
+
+
+def parse_time_signature(text):
+    """Parse "7/8" into (7, 8), or (None, None) if it is not a time signature"""
+    try:
+        numerator, denominator = str(text).split("/")
+        return int(numerator), int(denominator)
+    except ValueError:
+        return None, None
+
+
+def _parse_float(value, default):
+    """float() with the GUI's empty-field default; invalid values become NaN"""
+    try:
+        text = "" if value is None else str(value).strip()
+        return float(text or default)
+    except ValueError:
+        return float("nan")
+
+
+# === READERS ===
+
+class CSVRows:
+    """Column access to chunks of CSV lines (one row per line, header first)"""
+
+    def __init__(self, header_line):
+        self.header = next(csv.reader([header_line]))
+        self.index = {name.strip().lower(): i for i, name in enumerate(self.header)}
+        if "bpm" not in self.index:
+            raise ValueError("CSV input needs a 'bpm' column")
+
+    def columns(self, lines):
+        """Split lines into {column: list of strings}"""
+        width = len(self.header)
+        text = "".join(lines)
+        # Every line must have width fields: a short row next to a long one still adds up
+        if '"' not in text and set(map(str.count, lines, itertools.repeat(","))) == {width - 1}:
+            # Unquoted CSV: one split over the whole chunk, then stride out each column
+            fields = text.replace("\r", "").replace("\n", ",").split(",")
+            if len(fields) == len(lines) * width + 1:
+                return {name: fields[i::width][:len(lines)] for name, i in self.index.items()}
+
+        # Quoted fields or ragged rows: let the csv module handle them, padding short rows
+        fields = list(itertools.zip_longest(*csv.reader(lines), fillvalue=""))
+        fields += [("",) * len(lines)] * (width - len(fields))
+        return {name: list(fields[i]) for name, i in self.index.items()}
+
+    def output_header(self, header_line):
+        return header_line.rstrip(NEWLINE) + "," + ",".join(OUTPUT_COLUMNS) + "\n"
+
+    def format_chunk(self, lines, durations, positions):
+        """Input lines with the result columns appended (empty when invalid)"""
+        stripped = [line.rstrip(NEWLINE) for line in lines]
+        return "".join(map("{},{},{}\n".format, stripped, _texts(durations, ""), _texts(positions, "")))
+
+
+class JSONLRows:
+    """Column access to chunks of JSON Lines objects"""
+
+    def columns(self, lines):
+        """Parse lines into {column: list of values}"""
+        objects = [json.loads(line) for line in lines]
+        keys = set().union(*objects) if objects else set()
+        return {key: [obj.get(key, "") for obj in objects] for key in keys}
+
+    def format_chunk(self, lines, durations, positions):
+        """Input objects with the result keys added (null when invalid)"""
+        # Splice the results into the original text instead of re-serializing each object
+        bodies = [line.rstrip()[:-1].rstrip() for line in lines]
+        separators = [", " if body != "{" else "" for body in bodies]
+        return "".join(map('{}{}"duration_ms": {}, "position_ms": {}}}\n'.format, bodies, separators,
+                           _texts(durations, "null"), _texts(positions, "null")))
+
+
+def _texts(values, missing):
+    """Shortest round-trip text for each value, with missing for None"""
+    return [missing if value is None else repr(value) for value in values]
+
+
+# === CONVERSION ===
+
+def _time_signature_columns(columns, count):
+    """Numerator and denominator columns from either time_signature or separate fields"""
+    if "time_signature" in columns:
+        pairs = [parse_time_signature(text or "4/4") for text in columns["time_signature"]]
+        return [_or_nan(p[0]) for p in pairs], [_or_nan(p[1]) for p in pairs]
+    return (columns.get("numerator", [DEFAULTS["numerator"]] * count),
+            columns.get("denominator", [DEFAULTS["denominator"]] * count))
+
+
+def convert_rows_scalar(columns, count):
+    """Row-by-row conversion with the scalar engine functions"""
+    notes = columns.get("note", [DEFAULTS["note"]] * count)
+    modifiers = columns.get("modifier", [DEFAULTS["modifier"]] * count)
+    bars = columns.get("bar", [DEFAULTS["bar"]] * count)
+    beats = columns.get("beat", [DEFAULTS["beat"]] * count)
+    numerators, denominators = _time_signature_columns(columns, count)
+
+    durations = []
+    positions = []
+    for i in range(count):
+        bpm = _parse_float(columns["bpm"][i], DEFAULTS["bpm"])
+        multiplier = _or_nan(note_multiplier(notes[i], modifiers[i]))
+        durations.append(timing_engine.note_duration_ms(bpm, multiplier))
+
+        numerator = _parse_float(numerators[i], DEFAULTS["numerator"])
+        denominator = _parse_float(denominators[i], DEFAULTS["denominator"])
+        bar = _parse_float(bars[i], DEFAULTS["bar"])
+        beat = _parse_float(beats[i], DEFAULTS["beat"])
+        # NaN fields fall through the range checks and give a NaN position
+        result = timing_engine.position(bpm, numerator, denominator, bar, beat) if bar.is_integer() else None
+        positions.append(result.ms if result else None)
+    return _nan_to_none(durations), _nan_to_none(positions)
+
+
+def convert_rows_vectorized(columns, count):
+    """Chunk conversion with the NumPy batch engine functions"""
+    np = timing_engine.require_numpy()
+
+    def floats(name, values=None):
+        values = columns.get(name, [DEFAULTS[name]] * count) if values is None else values
+        try:
+            return np.array(values, dtype=np.float64)
+        except (ValueError, TypeError):
+            # Empty or malformed fields: fall back to per-value parsing with defaults
+            return np.array([_parse_float(v, DEFAULTS[name]) for v in values])
+
+    def categorical(values, convert, dtype=np.float64):
+        # Convert each distinct spelling once, then gather by code
+        distinct = list(dict.fromkeys(values))
+        codes = dict(zip(distinct, range(len(distinct))))
+        indices = np.fromiter(map(codes.__getitem__, values), dtype=np.intp, count=count)
+        return np.array([convert(value) for value in distinct], dtype=dtype)[indices]
+
+    bpms = floats("bpm")
+    notes = columns.get("note", [DEFAULTS["note"]] * count)
+    modifiers = columns.get("modifier", [DEFAULTS["modifier"]] * count)
+    # Rhythm IDs per row, then one gather from the registry's multiplier table (unknown -> NaN)
+    rhythm_ids = categorical(list(zip(notes, modifiers)), lambda pair: note_id(*pair), dtype=np.intp)
+    multipliers = timing_engine.rhythm_multipliers(rhythm_ids)
+
+    if "time_signature" in columns:
+        signatures = categorical(columns["time_signature"], lambda text: _time_signature_code(text or "4/4"))
+        # Encoded as numerator * 1024 + denominator so one lookup gives both
+        numerators, denominators = np.divmod(signatures, 1024)
+    else:
+        numerators = floats("numerator")
+        denominators = floats("denominator")
+    bars = floats("bar")
+    beats = floats("beat")
+
+    durations = timing_engine.note_durations_ms(bpms, multipliers)
+    positions, _ = timing_engine.calculate_positions(bpms, numerators, denominators, bars, beats)
+    # The GUI reads bars as integers
+    positions[bars != np.floor(bars)] = np.nan
+
+    return _nan_to_none(durations.tolist()), _nan_to_none(positions.tolist())
+
+
+def _time_signature_code(text):
+    numerator, denominator = parse_time_signature(text)
+    if numerator is None or not 0 < denominator < 1024:
+        return float("nan")
+    return numerator * 1024 + denominator
+
+
+def _or_nan(value):
+    return float("nan") if value is None else value
+
+
+def _nan_to_none(values):
+    return [None if value is None or value != value else value for value in values]
+
+
+instrumentation.instrument(sys.modules[__name__], "convert_rows_scalar", "convert_rows_vectorized", prefix="batch")
+
+
+def process_stream(stream, out, input_format=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Convert every row of a text stream and write results to out
+
+    Returns the number of data rows processed.
+    """
+    first_line = stream.readline()
+    while first_line and not first_line.strip():
+        first_line = stream.readline()
+    if not first_line:
+        return 0
+
+    if input_format is None:
+        input_format = "jsonl" if first_line.lstrip().startswith("{") else "csv"
+    if input_format == "csv":
+        rows = CSVRows(first_line)
+        out.write(rows.output_header(first_line))
+        lines = stream
+    else:
+        rows = JSONLRows()
+        lines = itertools.chain([first_line], stream)
+
+    total = 0
+    vectorized = None
+    # Chunks allocate millions of short-lived strings and no reference cycles,
+    # so cyclic garbage collection passes would only slow parsing down
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while True:
+            chunk = [line for line in itertools.islice(lines, chunk_size) if line.strip()]
+            if not chunk:
+                break
+            count = len(chunk)
+            columns = rows.columns(chunk)
+            if vectorized is None:
+                # Small one-off inputs skip the NumPy import entirely
+                vectorized = not (total == 0 and count < SCALAR_ROW_LIMIT)
+            convert = convert_rows_vectorized if vectorized else convert_rows_scalar
+            durations, positions = convert(columns, count)
+
+            out.write(rows.format_chunk(chunk, durations, positions))
+            total += count
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return total
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py batch`"""
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py batch",
+                                     description="Convert CSV or JSON Lines rows to note durations and beat positions")
+    parser.add_argument("input", nargs="?", default="-", help="input file (default: stdin)")
+    parser.add_argument("-f", "--format", choices=["csv", "jsonl"], help="input format (default: detect)")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per chunk")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="worker processes for file input (0 = one per core)")
+    args = parser.parse_args(argv)
+
+    input_format = args.format
+    if input_format is None and args.input.lower().endswith((".jsonl", ".ndjson")):
+        input_format = "jsonl"
+
+    if args.workers != 1 and args.input == "-":
+        parser.error("--workers needs an input file (stdin cannot be split into shards)")
+
+    stream = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", newline="")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    try:
+        if args.workers != 1:
+            import parallel_batch
+            parallel_batch.convert_file_parallel(args.input, out, input_format, args.workers or None)
+        else:
+            process_stream(stream, out, input_format, args.chunk_size)
+    except (ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if out is not sys.stdout:
+            out.close()
+    return 0
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Sample Grid Check
+Compares the sorted fast path of SampleGrid.samples_at_ticks with
+sample_at_tick on random multi-segment tempo maps.
+
+    python benchmarks/check_sample_grid.py [--maps 300]
+
+Tiny sample rates and PPQs put exact half-sample ties after segment starts
+with odd whole samples, where ties to even must look at the final sample,
+not the in-segment one. Exits with status 1 on the first mismatch.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timing_engine
+from sample_grid import SampleGrid
+from tempo_map import TempoMap
+
+
+def random_segments(rng):
+    """A 4/4 tempo map of 2-5 segments starting on random bars and beats"""
+    segments = [(1, 1, rng.choice([60, 75, 90, 100.5, 120]), 4, 4)]
+    for _ in range(rng.randint(1, 4)):
+        segments.append((segments[-1][0] + rng.randint(1, 3), rng.randint(1, 4),
+                         rng.choice([60, 75, 90, 100.5, 120, 133]), 4, 4))
+    return segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--maps", type=int, default=300, help="random tempo maps to check")
+    args = parser.parse_args()
+
+    np = timing_engine.require_numpy()
+    rng = random.Random(1)
+    ticks = np.arange(0, 1200, dtype=np.int64)
+    for _ in range(args.maps):
+        segments = random_segments(rng)
+        grid = SampleGrid(TempoMap(segments), rng.choice([2, 3, 44100, 48000]), rng.choice([8, 960]))
+        expected = [grid.sample_at_tick(tick) for tick in ticks.tolist()]
+        if grid.samples_at_ticks(ticks).tolist() != expected:
+            print(f"samples_at_ticks disagrees with sample_at_tick for {segments} at "
+                  f"{grid.sample_rate} Hz, PPQ {grid.ppq}", file=sys.stderr)
+            return 1
+    print(f"{args.maps} tempo maps agree")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Parallel Scaling Benchmark
+Times the shared-memory position calculation and the sharded file
+conversion with 1, 2, 4, ... up to N worker processes.
+
+    python benchmarks/parallel_scaling.py [--positions 50000000] [--rows 2000000] [--max-workers N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel_batch
+import timing_engine
+
+
+def worker_counts(max_workers):
+    """1, 2, 4, ... up to and including max_workers"""
+    counts = []
+    count = 1
+    while count < max_workers:
+        counts.append(count)
+        count *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def make_csv(path, rows):
+    """Write a synthetic batch input file"""
+    notes = ["1/4", "1/8", "1/16", "1/2"]
+    modifiers = ["Normal", "Dotted", "Triplet"]
+    signatures = ["4/4", "3/4", "7/8", "6/8"]
+    rng = random.Random(1)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("bpm,note,modifier,time_signature,bar,beat\n")
+        for _ in range(rows):
+            f.write(f"{rng.uniform(40, 240):.2f},{rng.choice(notes)},{rng.choice(modifiers)},"
+                    f"{rng.choice(signatures)},{rng.randint(1, 2000)},{rng.randint(1, 3)}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--positions", type=int, default=50_000_000, help="array elements")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="CSV rows")
+    parser.add_argument("--max-workers", type=int, default=parallel_batch.default_workers())
+    args = parser.parse_args()
+
+    np = timing_engine.require_numpy()
+    rng = np.random.default_rng(1)
+    bpms = rng.uniform(40, 240, args.positions)
+    bars = rng.integers(1, 100_000, args.positions).astype(np.float64)
+    beats = rng.integers(1, 5, args.positions).astype(np.float64)
+
+    print(f"Positions: {args.positions:,} elements")
+    baseline = None
+    for workers in worker_counts(args.max_workers):
+        start = time.perf_counter()
+        parallel_batch.parallel_calculate_positions(bpms, 4, 4, bars, beats, workers=workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"  {workers:3d} workers: {elapsed:7.3f} s  {args.positions / elapsed / 1e6:8.1f} M/s  "
+              f"speedup {baseline / elapsed:5.2f}x")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "input.csv")
+        make_csv(path, args.rows)
+        print(f"CSV file: {args.rows:,} rows, {os.path.getsize(path) / 1e6:.0f} MB")
+        baseline = None
+        for workers in worker_counts(args.max_workers):
+            with open(os.devnull, "w") as out:
+                start = time.perf_counter()
+                parallel_batch.convert_file_parallel(path, out, workers=workers)
+                elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"  {workers:3d} workers: {elapsed:7.3f} s  {args.rows / elapsed / 1e6:8.2f} M rows/s  "
+                  f"speedup {baseline / elapsed:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite
+Engine throughput, per-keystroke GUI latency and startup time, written to a
+JSON results file that can be compared against a stored baseline.
+
+    python benchmarks/suite.py run [-o results.json] [--only engine gui startup]
+    python benchmarks/suite.py compare results.json [--baseline benchmarks/baseline.json] [--threshold 10]
+
+The GUI and startup groups need a display; on a headless machine run them
+under Xvfb (`xvfb-run python benchmarks/suite.py run`). Groups that cannot
+run are skipped with a message. Store a baseline with
+`run -o benchmarks/baseline.json`; compare exits with status 1 when any
+metric is worse than the baseline by more than the threshold.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import timing_engine
+from sample_grid import SampleGrid
+from tempo_map import TempoMap
+
+RESULTS_VERSION = 1
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Percentage by which a metric may be worse than the baseline before it is flagged
+DEFAULT_THRESHOLD = 10.0
+
+GROUPS = ("engine", "gui", "startup")
+
+
+class Skipped(Exception):
+    """A benchmark group cannot run on this machine"""
+
+
+def metric(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def best_rate(func, count, repeat):
+    """Items per second of func() processing count items, best of repeat runs"""
+    best = min(_elapsed(func) for _ in range(repeat))
+    return count / best
+
+
+def _elapsed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def latency_metrics(prefix, samples_ns):
+    """Median, 95th percentile and worst latency in microseconds"""
+    samples = sorted(samples_ns)
+    return {
+        f"{prefix}.p50_us": metric(statistics.median(samples) / 1000.0, "us", False),
+        f"{prefix}.p95_us": metric(samples[int(0.95 * (len(samples) - 1))] / 1000.0, "us", False),
+        f"{prefix}.max_us": metric(samples[-1] / 1000.0, "us", False),
+    }
+
+
+# === ENGINE ===
+
+def bench_engine(repeat, scale):
+    """Scalar calls per second and batch elements per second"""
+    results = {}
+    calls = 100_000 * scale
+    bpms = [40.0 + (i % 2000) * 0.1 for i in range(calls)]
+    bars = [1.0 + i % 500 for i in range(calls)]
+
+    def scalar_durations():
+        for bpm in bpms:
+            timing_engine.note_duration_ms(bpm, 0.75)
+
+    def scalar_positions():
+        for bpm, bar in zip(bpms, bars):
+            timing_engine.calculate_position(bpm, 7, 8, bar, 3)
+
+    def scalar_records():
+        for bpm, bar in zip(bpms, bars):
+            timing_engine.position(bpm, 7, 8, bar, 3)
+
+    results["engine.scalar_duration.calls_per_s"] = metric(best_rate(scalar_durations, calls, repeat), "calls/s", True)
+    results["engine.scalar_position.calls_per_s"] = metric(best_rate(scalar_positions, calls, repeat), "calls/s", True)
+    results["engine.scalar_position_record.calls_per_s"] = metric(best_rate(scalar_records, calls, repeat),
+                                                                  "calls/s", True)
+
+    try:
+        np = timing_engine.require_numpy()
+    except ImportError as e:
+        print(f"  batch engine skipped: {e}", file=sys.stderr)
+        return results
+
+    elements = 1_000_000 * scale
+    rng = np.random.default_rng(1)
+    bpm_array = rng.uniform(40, 240, elements)
+    bar_array = rng.integers(1, 100_000, elements).astype(np.float64)
+    beat_array = rng.integers(1, 8, elements).astype(np.float64)
+
+    results["engine.batch_duration.elements_per_s"] = metric(
+        best_rate(lambda: timing_engine.note_durations_ms(bpm_array, 0.75), elements, repeat), "elements/s", True)
+    results["engine.batch_position.elements_per_s"] = metric(
+        best_rate(lambda: timing_engine.calculate_positions(bpm_array, 7, 8, bar_array, beat_array), elements, repeat),
+        "elements/s", True)
+    results["engine.batch_position_records.elements_per_s"] = metric(
+        best_rate(lambda: timing_engine.position_records(bpm_array, 7, 8, bar_array, beat_array), elements, repeat),
+        "elements/s", True)
+
+    grid = SampleGrid(TempoMap([(1, 1, 120, 4, 4), (17, 3, 97.5, 4, 4), (33, 1, 141, 7, 8)]), 48000)
+    ticks = np.sort(rng.integers(0, 200 * 4 * 960, elements))
+    results["engine.batch_samples_sorted.elements_per_s"] = metric(
+        best_rate(lambda: grid.samples_at_ticks(ticks), elements, repeat), "elements/s", True)
+    return results
+
+
+# === GUI ===
+
+def bench_gui(repeat, scale):
+    """Latency from StringVar.set() to the result label showing the new value"""
+    import bpm_calculator
+
+    bpm_calculator.load_tk()
+    try:
+        root = bpm_calculator.tk.Tk()
+    except bpm_calculator.tk.TclError as e:
+        raise Skipped(f"no display ({e}); run under xvfb-run")
+
+    try:
+        app = bpm_calculator.BPMCalculator(root)
+        root.update()
+        samples = 200 * scale * repeat
+        return {
+            **latency_metrics("gui.bpm_keystroke", _keystroke_samples(root, app.bpm_var, app.ms_result, samples,
+                                                                     [f"{60 + i * 0.5:g}" for i in range(200)])),
+            **latency_metrics("gui.bar_keystroke", _keystroke_samples(root, app.bar_var, app.ts_result, samples,
+                                                                     [str(i) for i in range(1, 201)])),
+        }
+    finally:
+        root.destroy()
+
+
+def _keystroke_samples(root, variable, label, count, values):
+    """Time set() through the idle-time recompute that updates the label"""
+    samples = []
+    for i in range(count):
+        before = label.cget("text")
+        value = values[i % len(values)]
+        if value == variable.get():
+            value = values[(i + 1) % len(values)]
+        start = time.perf_counter_ns()
+        variable.set(value)
+        root.update_idletasks()
+        samples.append(time.perf_counter_ns() - start)
+        if label.cget("text") == before:
+            raise RuntimeError(f"Label did not change after setting {value!r}")
+    return samples
+
+
+# === STARTUP ===
+
+# Runs in a fresh interpreter: first window draw ends the main loop and
+# prints the in-process time; the font cache lives in a given directory
+STARTUP_DRIVER = """
+import os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import tkinter
+import font_cache
+font_cache.cache_path = lambda: os.path.join({cache_dir!r}, "fonts.json")
+
+def mainloop(self, n=0):
+    self.update()
+    print("ready_ms", (time.perf_counter() - start) * 1000.0)
+    self.destroy()
+
+tkinter.Misc.mainloop = mainloop
+import {module}
+{module}.main()
+"""
+
+
+def bench_startup(repeat, scale):
+    """Cold (no font cache) and warm (cached) startup of both programs"""
+    results = {}
+    for module in ("bpm_calculator", "font_helper"):
+        cold, warm = [], []
+        for _ in range(max(repeat, 3)):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cold.append(_startup_ms(module, cache_dir))
+                warm.append(_startup_ms(module, cache_dir))
+        results[f"startup.{module}.cold_ms"] = metric(statistics.median(cold), "ms", False)
+        results[f"startup.{module}.warm_ms"] = metric(statistics.median(warm), "ms", False)
+    return results
+
+
+def _startup_ms(module, cache_dir):
+    """Wall time of one process from launch to its first drawn window"""
+    code = STARTUP_DRIVER.format(root=ROOT, cache_dir=cache_dir, module=module)
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT)
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    if process.returncode != 0 or "ready_ms" not in process.stdout:
+        last_line = (process.stderr.strip().splitlines() or ["no output"])[-1]
+        raise Skipped(f"{module} did not start ({last_line}); run under xvfb-run")
+    return elapsed_ms
+
+
+BENCHMARKS = {"engine": bench_engine, "gui": bench_gui, "startup": bench_startup}
+
+
+# === RESULTS ===
+
+def run(groups, repeat, scale):
+    """Run the chosen groups and return a results document"""
+    results = {}
+    for group in groups:
+        print(f"Running {group} benchmarks...", file=sys.stderr)
+        try:
+            results.update(BENCHMARKS[group](repeat, scale))
+        except Skipped as e:
+            print(f"  {group} skipped: {e}", file=sys.stderr)
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != RESULTS_VERSION:
+        raise ValueError(f"{path} is not a version {RESULTS_VERSION} results file")
+    return data
+
+
+def compare(current, baseline, threshold):
+    """Rows of (name, baseline, current, change %, regressed) for metrics in both files
+
+    change is positive when the metric got better.
+    """
+    rows = []
+    for name, now in sorted(current["results"].items()):
+        before = baseline["results"].get(name)
+        if before is None or not before["value"]:
+            continue
+        change = (now["value"] - before["value"]) / before["value"] * 100.0
+        if not now["higher_is_better"]:
+            change = -change
+        rows.append((name, before, now, change, change < -threshold))
+    return rows
+
+
+def print_results(data):
+    for name, result in sorted(data["results"].items()):
+        print(f"{name:45s} {result['value']:14.2f} {result['unit']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and write a results file")
+    run_parser.add_argument("-o", "--output", default="benchmark-results.json")
+    run_parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    run_parser.add_argument("--repeat", type=int, default=5, help="runs per measurement (best or median kept)")
+    run_parser.add_argument("--scale", type=int, default=1, help="multiply workload sizes")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions against a baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="allowed slowdown in percent")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        data = run(args.only, args.repeat, args.scale)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        print_results(data)
+        print(f"Results written to {args.output}", file=sys.stderr)
+        return 0
+
+    try:
+        rows = compare(load_results(args.results), load_results(args.baseline), args.threshold)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    regressions = 0
+    for name, before, now, change, regressed in rows:
+        regressions += regressed
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:45s} {before['value']:14.2f} -> {now['value']:14.2f} {now['unit']:10s} "
+              f"{change:+7.1f}% {flag}")
+    print(f"{regressions} regression(s) beyond {args.threshold:g}% in {len(rows)} metrics")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,20 +2,64 @@
 """
 BPM to Milliseconds Calculator
 A simple tkinter application to convert beats per minute to milliseconds
+
+Run without arguments for the GUI, `bpm_calculator.py batch` for headless
+batch conversion (see batch_mode.py), `bpm_calculator.py grid` to export a
+click grid (see click_grid.py), `bpm_calculator.py midi` to read a MIDI
+file's tempo map and note timings (see midi_file.py), `bpm_calculator.py
+tempo` to estimate the BPM of WAV files (see tempo_detect.py),
+`bpm_calculator.py delays` to export a delay table over a BPM range (see
+delay_table.py), `bpm_calculator.py quantize` to quantize event timestamps
+with swing and groove (see quantize.py), `bpm_calculator.py metronome` to
+render a click track to WAV (see metronome.py), `bpm_calculator.py search`
+to find BPMs whose durations are whole ms, samples or frames (see
+tempo_search.py) or `bpm_calculator.py serve` for the local timing query
+server (see timing_server.py).
 """
 
-import tkinter as tk
-from tkinter import ttk, messagebox, font
-import math
+import os
+import sys
+import time
+
+import instrumentation
+import note_registry
+import timing_engine
+
+# tkinter and the GUI-only modules are imported by load_tk() only when the GUI
+# is launched, so batch mode works on machines without a display and starts faster
+tk = ttk = messagebox = filedialog = None
+compute_executor = font_cache = tap_tempo = None
+
+
+def load_tk():
+    """Import tkinter and the GUI-only modules into this module's namespace"""
+    global tk, ttk, messagebox, filedialog, compute_executor, font_cache, tap_tempo
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as tk_ttk, messagebox as tk_messagebox, filedialog as tk_filedialog
+        import compute_executor as executor_module, font_cache as font_cache_module, tap_tempo as tap_module
+        tk, ttk, messagebox, filedialog = tkinter, tk_ttk, tk_messagebox, tk_filedialog
+        compute_executor, font_cache, tap_tempo = executor_module, font_cache_module, tap_module
 
 
 class BPMCalculator:
     def __init__(self, root):
+        load_tk()
         self.root = root
         self.root.title("BPM to Milliseconds Calculator")
         self.root.geometry("500x500")
         self.root.resizable(True, True)
         
+        # Pending recompute state: sections are merged until the next idle cycle
+        self._pending_sections = set()
+        self._update_job = None
+        self._last_inputs = {}
+        self._widget_options = {}
+        self.startup_timings = {}
+        
+        # Slow work (file analysis, large exports) runs here; per-keystroke results stay synchronous
+        self.executor = compute_executor.ComputeExecutor(root)
+        
         # Configure style
         style = ttk.Style()
         style.theme_use('clam')
@@ -23,70 +67,25 @@ class BPMCalculator:
         # Set up musical font
         self.setup_musical_font()
         
+        ui_start = time.perf_counter()
         self.setup_ui()
+        self.startup_timings["ui_ms"] = (time.perf_counter() - ui_start) * 1000.0
         
     def setup_musical_font(self):
         """Set up the best available font for musical symbols"""
-        # List of fonts that support musical symbols, in order of preference
-        # Prioritizing fonts with proper musical notation over basic Unicode fonts
-        musical_fonts = [
-            "Bravura",             # Professional music engraving font
-            "Noto Music",          # Google's dedicated musical notation font
-            "Petaluma",            # Steinberg's handwritten music font
-            "MuseJazz",            # MuseScore's jazz font
-            "Leland",              # Steinberg's music font
-            "Sebastian",           # Legacy Sibelius font
-            "Opus",                # Legacy Finale font
-            "Maestro",             # Legacy music font
-            "Musical Symbols",     # Generic musical font name
-            "Segoe UI Symbol",     # Windows - actually works well for basic musical symbols
-            "Symbola",             # Cross-platform Unicode font with better musical symbols
-            "DejaVu Sans",         # Linux/cross-platform
-            "Apple Symbols",       # macOS
-            "Arial Unicode MS",    # Has issues with some musical symbols
-            "Arial",               # Final fallback
-        ]
-        
-        # Get list of available fonts
-        available_fonts = list(font.families())
-        
-        # Find the first available musical font
-        self.musical_font = None
-        for music_font in musical_fonts:
-            if music_font in available_fonts:
-                self.musical_font = music_font
-                print(f"Using font: {music_font}")
-                break
-        
-        # If no specific font found, use default
-        if not self.musical_font:
-            self.musical_font = "Arial"
+        # Font discovery is cached on disk and only redone when installed fonts change;
+        # Unicode symbols are used only if the font file really has the note glyphs
+        entry, info = font_cache.resolve_musical_font(self.root, self.executor)
+        self.musical_font = entry["musical_font"]
+        self.use_unicode_symbols = entry["use_unicode_symbols"]
+        self.startup_timings["fonts_ms"] = info["elapsed_ms"]
+        self.startup_timings["font_source"] = info["source"]
+        
+        if self.musical_font in entry["installed"]:
+            print(f"Using font: {self.musical_font}")
+        else:
             print(f"Using fallback font: {self.musical_font}")
         
-        # Test if the font can display musical symbols
-        self.use_unicode_symbols = self.test_musical_symbols()
-        
-    def test_musical_symbols(self):
-        """Test if the current font can display Unicode musical symbols properly"""
-        try:
-            # Test multiple musical symbols to ensure proper support
-            test_symbols = ["𝅝", "𝅗𝅥", "♩", "♪", "♬", "♫"]
-            
-            # Create a temporary label to test symbol rendering
-            for symbol in test_symbols:
-                test_label = tk.Label(self.root, text=symbol, font=(self.musical_font, 16))
-                test_label.destroy()  # Clean up immediately
-            
-            # If we can create all symbols without error, assume good support
-            # Additional check: prioritize fonts with "Music" in the name
-            if "music" in self.musical_font.lower() or "bravura" in self.musical_font.lower() or "noto" in self.musical_font.lower():
-                return True
-            
-            # For other fonts, be more conservative
-            return True
-        except:
-            return False
-        
     def setup_ui(self):
         """Set up the user interface"""
         # Main frame
@@ -116,8 +115,26 @@ class BPMCalculator:
         self.bpm_entry = ttk.Entry(bpm_center_frame, textvariable=self.bpm_var, width=5, font=("Arial", 12), justify='center')
         self.bpm_entry.grid(row=0, column=1, pady=5)
         
-        # Bind automatic calculation to BPM changes
-        self.bpm_var.trace_add('write', lambda name, index, mode: self.auto_calculate_all())
+        # Tap tempo: taps are timed on press (mouse button, Space on the button, or T anywhere
+        # outside a text field) rather than on release, which is less regular
+        self.taps = tap_tempo.TapTempo()
+        self.tap_button = ttk.Button(bpm_center_frame, text="Tap")
+        self.tap_button.grid(row=0, column=2, padx=(10, 0), pady=5)
+        self.tap_button.bind("<ButtonPress-1>", lambda event: self.on_tap())
+        self.tap_button.bind("<KeyPress-space>", lambda event: self.on_tap())
+        for key in ("<KeyPress-t>", "<KeyPress-T>"):
+            self.root.bind(key, lambda event: self.on_tap_key(event))
+        
+        # Tempo detection from an audio file (runs in the background, fills the BPM field)
+        self.detect_button = ttk.Button(bpm_center_frame, text="From WAV...", command=self.detect_tempo_from_file)
+        self.detect_button.grid(row=0, column=3, padx=(10, 0), pady=5)
+        self.bpm_status = ttk.Label(bpm_center_frame, text="", font=("Arial", 8), foreground="gray")
+        self.bpm_status.grid(row=1, column=0, columnspan=4)
+        
+        # Bind automatic calculation to BPM changes (BPM feeds both calculators)
+        self.bpm_var.trace_add('write', lambda name, index, mode: self.schedule_update("note", "position"))
+        # Setting the BPM any other way (typing, pasting, tapping) drops a running detection
+        self.bpm_var.trace_add('write', lambda name, index, mode: self.cancel_tempo_detection())
         
         # === TIME SIGNATURE CALCULATOR SECTION ===
         ts_frame = ttk.LabelFrame(main_frame, text="Beat Position Calculator", padding="10")
@@ -158,10 +175,10 @@ class BPMCalculator:
         self.ts_result.grid(row=1, column=1, columnspan=5, sticky=tk.W, pady=(10, 5), padx=(10, 0))
         
         # Bind time signature calculator events
-        self.numerator_var.trace_add('write', lambda *args: self.auto_calculate_all())
-        self.denominator_var.trace_add('write', lambda *args: self.auto_calculate_all())
-        self.bar_var.trace_add('write', lambda *args: self.auto_calculate_all())
-        self.beat_var.trace_add('write', lambda *args: self.auto_calculate_all())
+        self.numerator_var.trace_add('write', lambda *args: self.schedule_update("position"))
+        self.denominator_var.trace_add('write', lambda *args: self.schedule_update("position"))
+        self.bar_var.trace_add('write', lambda *args: self.schedule_update("position"))
+        self.beat_var.trace_add('write', lambda *args: self.schedule_update("position"))
         
         # === BPM CALCULATOR SECTION ===
         bpm_frame = ttk.LabelFrame(main_frame, text="Note Value Calculator", padding="10")
@@ -251,6 +268,7 @@ class BPMCalculator:
             note_frame.columnconfigure(i, weight=1)
         
         # Initially select quarter note button and normal modifier
+        self.update_rhythm()
         self.update_button_selection()
         self.update_modifier_selection()
         
@@ -259,6 +277,11 @@ class BPMCalculator:
         self.ms_result = ttk.Label(bpm_frame, text="--", font=("Arial", 10, "bold"), foreground="blue")
         self.ms_result.grid(row=2, column=1, sticky=tk.W, pady=(10, 5), padx=(10, 0))
         
+        # Every note value and modifier over a BPM range, in a separate window
+        self.delay_table_window = None
+        ttk.Button(bpm_frame, text="Delay Table...", command=self.open_delay_table).grid(
+            row=2, column=1, sticky=tk.E, pady=(10, 5))
+        
         # Display font information
         font_info = f"Using font: {self.musical_font}"
         if self.use_unicode_symbols:
@@ -278,71 +301,111 @@ class BPMCalculator:
     def select_note(self, note_value):
         """Select a note value and update button appearance"""
         self.note_var.set(note_value)
+        self.update_rhythm()
         self.update_button_selection()
-        self.auto_calculate_all()  # Automatically calculate when note changes
+        self.schedule_update("note")  # Automatically calculate when note changes
         
     def select_modifier(self, modifier_value):
         """Select a modifier and update button appearance"""
         self.modifier_var.set(modifier_value)
+        self.update_rhythm()
         self.update_modifier_selection()
-        self.auto_calculate_all()  # Automatically calculate when modifier changes
+        self.schedule_update("note")  # Automatically calculate when modifier changes
+        
+    def update_rhythm(self):
+        """Resolve the selected note value and modifier names to a rhythm ID
+        
+        Only selections go through the names; recalculation while typing a
+        BPM reads the multiplier by ID.
+        """
+        self.rhythm_id = timing_engine.note_id(self.note_var.get(), self.modifier_var.get())
         
     def update_modifier_selection(self):
         """Update the visual appearance of modifier buttons to show selection"""
-        current_modifier = self.modifier_var.get()
-        modifier_values = ["Normal", "Dotted", "Triplet"]
-        
-        for i, btn in enumerate(self.modifier_buttons):
-            if i < len(modifier_values) and modifier_values[i] == current_modifier:
-                # Selected button - make it look pressed
-                btn.config(relief="sunken", bg="#4CAF50", fg="white")
-            else:
-                # Unselected button - normal appearance
-                btn.config(relief="raised", bg="SystemButtonFace", fg="black")
+        self.update_selection_styles(self.modifier_buttons, timing_engine.MODIFIERS, self.modifier_var.get())
         
     def update_button_selection(self):
         """Update the visual appearance of note buttons to show selection"""
-        current_note = self.note_var.get()
-        note_values = [
-            "Whole Note (1/1)",
-            "Half Note (1/2)",
-            "Quarter Note (1/4)",
-            "Eighth Note (1/8)",
-            "Sixteenth Note (1/16)",
-            "Thirty-second Note (1/32)"
-        ]
+        self.update_selection_styles(self.note_buttons, timing_engine.NOTE_VALUES, self.note_var.get())
         
-        for i, btn in enumerate(self.note_buttons):
-            if i < len(note_values) and note_values[i] == current_note:
+    def update_selection_styles(self, buttons, values, current_value):
+        """Style the button matching current_value as selected, touching only buttons that change"""
+        for i, btn in enumerate(buttons):
+            if i < len(values) and values[i] == current_value:
                 # Selected button - make it look pressed
-                btn.config(relief="sunken", bg="#4CAF50", fg="white")
+                self.set_widget_options(btn, relief="sunken", bg="#4CAF50", fg="white")
             else:
                 # Unselected button - normal appearance
-                btn.config(relief="raised", bg="SystemButtonFace", fg="black")
+                self.set_widget_options(btn, relief="raised", bg="SystemButtonFace", fg="black")
+        
+    def set_widget_options(self, widget, **options):
+        """Configure a widget with only the options that differ from what it already shows"""
+        current = self._widget_options.setdefault(widget, {})
+        changed = {key: value for key, value in options.items() if current.get(key) != value}
+        if changed:
+            widget.config(**changed)
+            current.update(changed)
+        
+    def open_delay_table(self):
+        """Show the delay table window, or raise it if it is already open"""
+        if self.delay_table_window is not None and self.delay_table_window.top.winfo_exists():
+            self.delay_table_window.top.lift()
+            return
+        self.delay_table_window = DelayTableWindow(self.root, self.executor)
+        
+    def on_tap(self):
+        """Record a tap and show the tap tempo estimate in the BPM field"""
+        bpm = self.taps.tap(time.perf_counter_ns())
+        self.cancel_tempo_detection()
+        if bpm is None:
+            self.set_widget_options(self.bpm_status, text="Tap tempo: keep tapping")
+            return
+        # The BPM trace only queues a recompute, so the field updates before the results do
+        self.bpm_var.set(timing_engine.format_bpm(bpm))
+        self.set_widget_options(self.bpm_status, text=f"Tap tempo: {self.taps.count} taps")
+        
+    def on_tap_key(self, event):
+        """T taps unless the keyboard focus is in a text field"""
+        if not isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            self.on_tap()
+        
+    def detect_tempo_from_file(self):
+        """Estimate the BPM of a WAV file chosen by the user and put it in the BPM field"""
+        path = filedialog.askopenfilename(title="Detect tempo from audio",
+                                          filetypes=[("WAV audio", "*.wav"), ("All files", "*.*")])
+        if not path:
+            return
+        import tempo_detect
+        self.set_widget_options(self.bpm_status, text=f"Analyzing {os.path.basename(path)}...")
+        # Analysis takes a while on long files; picking another file supersedes this one
+        self.executor.submit("tempo", tempo_detect.detect_tempo, path,
+                             on_result=self.show_detected_tempo,
+                             on_error=lambda e: self.show_detection_error(path, e))
+        
+    def show_detected_tempo(self, result):
+        """Put a finished tempo detection into the BPM field"""
+        name = os.path.basename(result["path"])
+        if result["bpm"] is None:
+            self.set_widget_options(self.bpm_status, text=f"{name} is too short to detect a tempo")
+        else:
+            self.bpm_var.set(timing_engine.format_bpm(result["bpm"]))
+            self.set_widget_options(self.bpm_status,
+                                    text=f"Detected from {name} (confidence {result['confidence']:.2f})")
+        
+    def show_detection_error(self, path, error):
+        """Report a tempo detection that failed"""
+        self.set_widget_options(self.bpm_status, text="")
+        messagebox.showerror("Error", f"Could not analyze {os.path.basename(path)}: {error}")
+        
+    def cancel_tempo_detection(self):
+        """Drop a running detection when the user sets the BPM some other way"""
+        if self.executor.busy("tempo"):
+            self.executor.cancel("tempo")
+            self.set_widget_options(self.bpm_status, text="")
         
     def get_note_multiplier(self):
         """Get the multiplier for the selected note value and modifier"""
-        note_multipliers = {
-            "Whole Note (1/1)": 4.0,
-            "Half Note (1/2)": 2.0,
-            "Quarter Note (1/4)": 1.0,
-            "Eighth Note (1/8)": 0.5,
-            "Sixteenth Note (1/16)": 0.25,
-            "Thirty-second Note (1/32)": 0.125
-        }
-        
-        base_multiplier = note_multipliers.get(self.note_var.get(), 1.0)
-        
-        # Apply modifier
-        modifier = self.modifier_var.get()
-        if modifier == "Dotted":
-            # Dotted notes are 1.5 times the base duration (adds 50%)
-            return base_multiplier * 1.5
-        elif modifier == "Triplet":
-            # Triplet notes are 2/3 of the base duration
-            return base_multiplier * (2.0/3.0)
-        else:  # Normal
-            return base_multiplier
+        return note_registry.multiplier(self.rhythm_id)
         
     def calculate(self):
         """Calculate milliseconds from BPM"""
@@ -351,15 +414,10 @@ class BPMCalculator:
             if bpm <= 0:
                 raise ValueError("BPM must be positive")
                 
-            # Get note multiplier
-            note_multiplier = self.get_note_multiplier()
-            
-            # Calculate milliseconds per beat (quarter note = 1 beat)
-            # Formula: (60 seconds / BPM) * 1000 ms/second * note_multiplier
-            milliseconds = (60.0 / bpm) * 1000.0 * note_multiplier
+            milliseconds = timing_engine.note_duration_ms(bpm, self.get_note_multiplier())
             
             # Update result
-            self.ms_result.config(text=f"{milliseconds:.2f} ms")
+            self.set_widget_options(self.ms_result, text=f"{milliseconds:.2f} ms")
             
         except ValueError as e:
             if "could not convert" in str(e):
@@ -367,40 +425,34 @@ class BPMCalculator:
             else:
                 messagebox.showerror("Error", str(e))
             # Clear result on error
-            self.ms_result.config(text="--")
+            self.set_widget_options(self.ms_result, text="--")
 
     def auto_calculate(self):
         """Automatically calculate without showing error dialogs for invalid input"""
+        inputs = (self.bpm_var.get().strip(), self.rhythm_id)
+        if self._last_inputs.get("note") == inputs:
+            return  # Nothing the result depends on has changed
+        self._last_inputs["note"] = inputs
+        
         try:
-            bpm_text = self.bpm_var.get().strip()
+            bpm_text = inputs[0]
             if not bpm_text:
                 # Clear results if BPM field is empty
-                self.ms_result.config(text="--")
-                self.freq_result.config(text="--")
-                self.period_result.config(text="--")
+                self.set_widget_options(self.ms_result, text="--")
                 return
                 
-            bpm = float(bpm_text)
-            if bpm <= 0:
+            milliseconds = timing_engine.note_duration_ms(float(bpm_text), self.get_note_multiplier())
+            if milliseconds is None:
                 # Clear results if BPM is invalid
-                self.ms_result.config(text="--")
-                self.freq_result.config(text="--")
-                self.period_result.config(text="--")
+                self.set_widget_options(self.ms_result, text="--")
                 return
-                
-            # Get note multiplier
-            note_multiplier = self.get_note_multiplier()
-            
-            # Calculate milliseconds per beat (quarter note = 1 beat)
-            # Formula: (60 seconds / BPM) * 1000 ms/second * note_multiplier
-            milliseconds = (60.0 / bpm) * 1000.0 * note_multiplier
             
             # Update result
-            self.ms_result.config(text=f"{milliseconds:.2f} ms")
+            self.set_widget_options(self.ms_result, text=f"{milliseconds:.2f} ms")
             
         except ValueError:
             # Silently clear results on invalid input (no error dialog)
-            self.ms_result.config(text="--")
+            self.set_widget_options(self.ms_result, text="--")
 
     def calculate_time_signature_position(self):
         """Calculate the millisecond position of a specific beat in a time signature"""
@@ -412,57 +464,270 @@ class BPMCalculator:
             beat = float(self.beat_var.get().strip() or "1")
             bpm = float(self.bpm_var.get().strip() or "120")
             
-            if numerator <= 0 or denominator <= 0 or bar <= 0 or beat <= 0 or bpm <= 0:
-                return None
-                
-            if beat > numerator:
-                return None
-                
-            # Calculate milliseconds per quarter note
-            ms_per_quarter = (60.0 / bpm) * 1000.0
-            
-            # Calculate the note value of one beat in this time signature
-            # In 4/4 time, one beat = quarter note
-            # In 2/2 time, one beat = half note, etc.
-            beat_note_value = 4.0 / denominator
-            ms_per_beat = ms_per_quarter * beat_note_value
-            
-            # Calculate position in milliseconds
-            beats_elapsed = (bar - 1) * numerator + (beat - 1)
-            position_ms = beats_elapsed * ms_per_beat
-            
-            return {
-                'milliseconds': position_ms,
-                'bars': bar,
-                'beats': beat,
-                'time_signature': f"{numerator}/{denominator}",
-                'beats_elapsed': beats_elapsed
-            }
+            return timing_engine.calculate_position(bpm, numerator, denominator, bar, beat)
             
         except (ValueError, ZeroDivisionError):
             return None
     
-    def auto_calculate_all(self):
-        """Calculate both BPM conversion and time signature position"""
-        # Calculate BPM conversion
-        self.auto_calculate()
+    def auto_calculate_position(self):
+        """Update the beat position result if any of its inputs changed"""
+        inputs = tuple(var.get() for var in (self.numerator_var, self.denominator_var,
+                                             self.bar_var, self.beat_var, self.bpm_var))
+        if self._last_inputs.get("position") == inputs:
+            return  # Nothing the result depends on has changed
+        self._last_inputs["position"] = inputs
         
-        # Calculate time signature position
         ts_result = self.calculate_time_signature_position()
         if ts_result:
             result_text = (f"Bar {ts_result['bars']}, Beat {ts_result['beats']} "
                           f"= {ts_result['milliseconds']:.2f} ms")
-            self.ts_result.config(text=result_text)
+            self.set_widget_options(self.ts_result, text=result_text)
         else:
-            self.ts_result.config(text="-- (invalid input)")
+            self.set_widget_options(self.ts_result, text="-- (invalid input)")
+    
+    def auto_calculate_all(self):
+        """Calculate both BPM conversion and time signature position"""
+        self.auto_calculate()
+        self.auto_calculate_position()
+    
+    def schedule_update(self, *sections):
+        """Queue sections ("note", "position") for recalculation on the next idle cycle
+        
+        A burst of StringVar writes (typing, pasting, scripted set() calls)
+        is merged into one recompute of just the affected sections.
+        """
+        self._pending_sections.update(sections)
+        if self._update_job is None:
+            self._update_job = self.root.after_idle(self.flush_updates)
+    
+    def flush_updates(self):
+        """Recalculate the sections queued by schedule_update"""
+        self._update_job = None
+        sections, self._pending_sections = self._pending_sections, set()
+        if "note" in sections:
+            self.auto_calculate()
+        if "position" in sections:
+            self.auto_calculate_position()
 
 
-def main():
-    """Main function to run the application"""
+instrumentation.instrument(BPMCalculator, "setup_musical_font", "auto_calculate", "calculate_time_signature_position",
+                           "update_button_selection", "flush_updates", "on_tap", prefix="gui")
+
+
+class DelayTableWindow:
+    """Virtualized table of every note duration over a BPM sweep
+    
+    The Treeview only ever holds as many items as fit on screen. Scrolling
+    moves a row offset and refills those items from DelayTable.rows(), so the
+    cost of a redraw does not depend on the length of the sweep. Scroll and
+    range changes are merged into one redraw per idle cycle.
+    """
+    
+    def __init__(self, parent, executor):
+        import delay_table
+        self.delay_table = delay_table
+        self.executor = executor
+        self.top = tk.Toplevel(parent)
+        self.top.title("Delay Table")
+        self.top.geometry("900x500")
+        self.top.columnconfigure(0, weight=1)
+        self.top.rowconfigure(1, weight=1)
+        
+        self.table = None
+        self.first_row = 0
+        self.visible_rows = 20
+        self._render_job = None
+        self._shown = None
+        
+        # BPM sweep controls
+        controls = ttk.Frame(self.top, padding="10 10 10 5")
+        controls.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        self.start_var = tk.StringVar(value=f"{delay_table.DEFAULT_START_BPM:g}")
+        self.stop_var = tk.StringVar(value=f"{delay_table.DEFAULT_STOP_BPM:g}")
+        self.step_var = tk.StringVar(value=f"{delay_table.DEFAULT_STEP:g}")
+        for col, (text, var) in enumerate((("From BPM:", self.start_var), ("To:", self.stop_var),
+                                           ("Step:", self.step_var))):
+            ttk.Label(controls, text=text).grid(row=0, column=col * 2, padx=(10 if col else 0, 5))
+            ttk.Entry(controls, textvariable=var, width=7, justify='center').grid(row=0, column=col * 2 + 1)
+            var.trace_add('write', lambda name, index, mode: self.rebuild())
+        self.status = ttk.Label(controls, text="", foreground="gray")
+        self.status.grid(row=0, column=6, padx=10)
+        ttk.Button(controls, text="Export CSV...", command=self.export_csv).grid(row=0, column=7)
+        controls.columnconfigure(6, weight=1)
+        
+        # Table: a fixed pool of row items plus scrollbars driven by the row offset
+        columns = ["bpm"] + [delay_table.column_label(*column) for column in delay_table.COLUMNS]
+        self.tree = ttk.Treeview(self.top, columns=columns, show="headings", selectmode="none",
+                                 height=self.visible_rows)
+        for column in columns:
+            self.tree.heading(column, text=column.upper() if column == "bpm" else column)
+            self.tree.column(column, width=80 if column == "bpm" else 72, anchor=tk.E, stretch=False)
+        self.tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar = ttk.Scrollbar(self.top, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
+        xscroll = ttk.Scrollbar(self.top, orient=tk.HORIZONTAL, command=self.tree.xview)
+        xscroll.grid(row=2, column=0, sticky=(tk.W, tk.E))
+        self.tree.configure(xscrollcommand=xscroll.set)
+        
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll_by(-3 if event.delta > 0 else 3))
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(3))
+        self.tree.bind("<Up>", lambda event: self.scroll_by(-1))
+        self.tree.bind("<Down>", lambda event: self.scroll_by(1))
+        self.tree.bind("<Prior>", lambda event: self.scroll_by(-self.visible_rows))
+        self.tree.bind("<Next>", lambda event: self.scroll_by(self.visible_rows))
+        self.tree.focus_set()
+        
+        self.rebuild()
+        
+    def rebuild(self):
+        """Rebuild the table from the BPM range fields (invalid ranges keep the old table)"""
+        try:
+            table = self.delay_table.DelayTable(float(self.start_var.get()), float(self.stop_var.get()),
+                                                float(self.step_var.get()))
+        except ValueError as e:
+            self.status.config(text=str(e) if "sweep" in str(e) else "Enter numbers for the BPM range")
+            return
+        self.table = table
+        self.status.config(text=f"{len(table):,} rows")
+        self.scroll_to(self.first_row)
+        self._shown = None
+        self.schedule_render()
+        
+    def on_resize(self, event):
+        """Size the pool of row items to the height of the table"""
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        rows = max(1, (event.height - row_height) // row_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self._shown = None
+            self.scroll_to(self.first_row)
+            
+    def on_scrollbar(self, action, value, unit=None):
+        """Scrollbar command: "moveto fraction" or "scroll n units|pages" """
+        if action == "moveto":
+            self.scroll_to(int(float(value) * len(self.table)))
+        else:
+            self.scroll_by(int(value) * (self.visible_rows if unit == "pages" else 1))
+            
+    def scroll_by(self, rows):
+        """Scroll by a number of rows (negative is up)"""
+        self.scroll_to(self.first_row + rows)
+        
+    def scroll_to(self, row):
+        """Move the first visible row (clamped) and queue a redraw"""
+        if self.table is None:
+            return
+        last_first = max(0, len(self.table) - self.visible_rows)
+        self.first_row = min(max(0, row), last_first)
+        self.schedule_render()
+        
+    def schedule_render(self):
+        """Redraw on the next idle cycle, once however many scroll events arrive before it"""
+        if self._render_job is None:
+            self._render_job = self.top.after_idle(self.render)
+            
+    def render(self):
+        """Fill the visible row items from the table"""
+        self._render_job = None
+        table, first = self.table, self.first_row
+        view = (id(table), first, self.visible_rows)
+        if view == self._shown:
+            return
+        self._shown = view
+        
+        bpms, durations = table.rows(first, first + self.visible_rows)
+        bpm_format = f"{{:.{table.decimals}f}}"
+        items = self.tree.get_children()
+        for i in range(max(len(items), len(bpms))):
+            iid = str(i)
+            if i >= len(bpms):
+                self.tree.delete(iid)
+                continue
+            values = [bpm_format.format(bpms[i])] + [f"{ms:.2f}" for ms in durations[i].tolist()]
+            if i < len(items):
+                self.tree.item(iid, values=values)
+            else:
+                self.tree.insert("", tk.END, iid=iid, values=values)
+        total = max(1, len(table))
+        self.scrollbar.set(first / total, min(1.0, (first + self.visible_rows) / total))
+        
+    def export_csv(self):
+        """Write the whole BPM range to a CSV file in the background"""
+        if self.table is None:
+            return
+        path = filedialog.asksaveasfilename(parent=self.top, title="Export delay table",
+                                            defaultextension=".csv", filetypes=[("CSV", "*.csv")])
+        if not path:
+            return
+        self.status.config(text=f"Writing {os.path.basename(path)}...")
+        self.executor.submit("delay-export", self.table.save_csv, path,
+                             on_result=lambda count: self.show_export(f"{count:,} rows written to "
+                                                                      f"{os.path.basename(path)}"),
+                             on_error=lambda e: self.show_export(f"Could not write {path}: {e}", error=True))
+        
+    def show_export(self, message, error=False):
+        """Report a finished export, unless the window has been closed since"""
+        if not self.top.winfo_exists():
+            return
+        if error:
+            messagebox.showerror("Error", message, parent=self.top)
+            message = ""
+        self.status.config(text=message)
+
+
+def report_startup(app, start):
+    """Print how long startup took once the window has been drawn"""
+    timings = app.startup_timings
+    total_ms = (time.perf_counter() - start) * 1000.0
+    print(f"Startup: {total_ms:.1f} ms (fonts {timings['fonts_ms']:.1f} ms from {timings['font_source']}, "
+          f"UI {timings['ui_ms']:.1f} ms)")
+
+
+def run_gui():
+    """Launch the calculator window"""
+    start = time.perf_counter()
+    load_tk()
     root = tk.Tk()
     app = BPMCalculator(root)
+    root.after_idle(lambda: report_startup(app, start))
     root.mainloop()
 
 
+def main(argv=None):
+    """Main function to run the application"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "batch":
+        import batch_mode
+        return batch_mode.main(argv[1:])
+    if argv and argv[0] == "grid":
+        import click_grid
+        return click_grid.main(argv[1:])
+    if argv and argv[0] == "midi":
+        import midi_file
+        return midi_file.main(argv[1:])
+    if argv and argv[0] == "delays":
+        import delay_table
+        return delay_table.main(argv[1:])
+    if argv and argv[0] == "quantize":
+        import quantize
+        return quantize.main(argv[1:])
+    if argv and argv[0] == "metronome":
+        import metronome
+        return metronome.main(argv[1:])
+    if argv and argv[0] == "search":
+        import tempo_search
+        return tempo_search.main(argv[1:])
+    if argv and argv[0] == "tempo":
+        import tempo_detect
+        return tempo_detect.main(argv[1:])
+    if argv and argv[0] == "serve":
+        import timing_server
+        return timing_server.main(argv[1:])
+    run_gui()
+    return 0
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
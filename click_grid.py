@@ -0,0 +1,315 @@
+"""
+Click Grid
+Every beat and subdivision timestamp of a bar range, for click tracks and
+grid overlays:
+
+    python bpm_calculator.py grid --bpm 120 --time-signature 7/8 --bars 1-400 \\
+        --note 1/16 --modifier triplet [-o grid.npy|grid.f64|grid.csv] [--samples 48000]
+
+The grid restarts at every bar line: a bar holds each multiple of the note
+length that starts inside it, so a dotted quarter in 4/4 clicks on beats 1,
+2.5 and 4. Milliseconds use the calculator's beat semantics through a
+TempoMap; the calculator stops at beat == numerator, so subdivisions of a
+bar's last beat are timed between that beat and the next bar line (no
+tempo segment can start in between). Sample offsets are exact (see
+sample_grid.py).
+
+Grids are produced a block of bars at a time, so exports of hundreds of
+millions of points never hold more than one block in memory.
+"""
+
+import argparse
+from fractions import Fraction
+import sys
+
+from note_registry import exact_multiplier, multiplier, parse_modifier
+from sample_grid import DEFAULT_PPQ, DEFAULT_SAMPLE_RATE, SampleGrid
+from tempo_map import TempoMap
+from timing_engine import note_id, require_numpy
+
+# Points per block for chunked output (whole bars, so blocks may be slightly larger)
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Accent level of each point
+DOWNBEAT, BEAT, SUBDIVISION = 2, 1, 0
+
+# Column dtypes (little-endian, as exported)
+COLUMNS = {"bar": "<i8", "beat": "<f8", "level": "i1", "ms": "<f8", "sample": "<i8"}
+
+RAW_SUFFIXES = {".f64": "ms", ".i64": "sample"}
+
+
+class ClickGrid:
+    """Grid points of one note value and modifier over a tempo map"""
+
+    def __init__(self, tempo_map=None, note_value="Quarter Note (1/4)", modifier="Normal"):
+        self.tempo_map = tempo_map if tempo_map is not None else TempoMap()
+        self.note_value = note_value
+        self.modifier = modifier
+        # Exact step in quarter notes, so grid points land exactly on beats
+        rhythm = note_id(note_value, modifier)
+        self.step = exact_multiplier(rhythm)
+        self.multiplier = multiplier(rhythm)
+        self._layouts = {}
+        self._sample_grids = {}
+
+    @classmethod
+    def constant(cls, bpm, numerator=4, denominator=4, note_value="Quarter Note (1/4)", modifier="Normal"):
+        """Grid with a single tempo and time signature"""
+        return cls(TempoMap.constant(bpm, numerator, denominator), note_value, modifier)
+
+    # === LAYOUT ===
+
+    def bar_layout(self, numerator, denominator):
+        """(beats, levels, tick offsets) of the points in one bar of a time signature
+
+        Beats are 1-based like the calculator's beat field. Tick offsets are
+        from the bar line at DEFAULT_PPQ, or None if the note value is not a
+        whole number of ticks.
+        """
+        key = (numerator, denominator)
+        if key not in self._layouts:
+            step_beats = self.step * denominator / 4
+            offsets = []
+            offset = Fraction(0)
+            while offset < numerator:
+                offsets.append(offset)
+                offset += step_beats
+            beats = [float(1 + offset) for offset in offsets]
+            levels = [DOWNBEAT if offset == 0 else BEAT if offset.denominator == 1 else SUBDIVISION
+                      for offset in offsets]
+            ticks_per_beat = Fraction(4 * DEFAULT_PPQ, denominator)
+            ticks = [offset * ticks_per_beat for offset in offsets]
+            if any(tick.denominator != 1 for tick in ticks):
+                ticks = None
+            self._layouts[key] = (beats, levels, ticks and [int(tick) for tick in ticks])
+        return self._layouts[key]
+
+    def meter_runs(self, first_bar, last_bar):
+        """(first bar, last bar, numerator, denominator) runs of bars sharing a time signature"""
+        if first_bar < 1 or last_bar < first_bar:
+            raise ValueError(f"Invalid bar range {first_bar}-{last_bar}")
+        # Time signature changes start on beat 1, so a bar's meter is that of the last segment starting in it
+        changes = {}
+        for segment in self.tempo_map:
+            changes[segment.bar] = (segment.numerator, segment.denominator)
+        starts = sorted(changes)
+
+        runs = []
+        for i, start in enumerate(starts):
+            stop = starts[i + 1] - 1 if i + 1 < len(starts) else last_bar
+            if i == 0:
+                start = 1
+            start, stop = max(start, first_bar), min(stop, last_bar)
+            if start > stop:
+                continue
+            meter = changes[starts[i]]
+            if runs and runs[-1][2:] == meter and runs[-1][1] == start - 1:
+                runs[-1] = (runs[-1][0], stop) + meter
+            else:
+                runs.append((start, stop) + meter)
+        return runs
+
+    def count(self, first_bar, last_bar):
+        """Number of grid points in bars first_bar..last_bar"""
+        return sum((stop - start + 1) * len(self.bar_layout(numerator, denominator)[0])
+                   for start, stop, numerator, denominator in self.meter_runs(first_bar, last_bar))
+
+    # === OUTPUT ===
+
+    def points(self, first_bar, last_bar):
+        """Lazily yield (ms, bar, beat, level) for every point, one at a time"""
+        position_ms = self.tempo_map.position_ms
+        constant = self.tempo_map[0] if len(self.tempo_map) == 1 else None
+        for start, stop, numerator, denominator in self.meter_runs(first_bar, last_bar):
+            beats, levels, _ticks = self.bar_layout(numerator, denominator)
+            for bar in range(start, stop + 1):
+                last_beat_ms = next_bar_ms = None
+                for beat, level in zip(beats, levels):
+                    if constant is not None:
+                        yield ((bar - 1) * numerator + (beat - 1)) * constant.ms_per_beat, bar, beat, level
+                        continue
+                    if beat <= numerator:
+                        yield position_ms(bar, beat), bar, beat, level
+                        continue
+                    if last_beat_ms is None:
+                        last_beat_ms, next_bar_ms = position_ms(bar, numerator), position_ms(bar + 1, 1)
+                    yield last_beat_ms + (beat - numerator) * (next_bar_ms - last_beat_ms), bar, beat, level
+
+    def arrays(self, first_bar, last_bar, sample_rate=None, out=None):
+        """All points of a bar range as NumPy columns
+
+        Returns a dict with bar (int64), beat (float64), level (int8), ms
+        (float64) and, with a sample rate, exact sample offsets (int64).
+        Columns given in out (preallocated, of length count()) are filled
+        in place instead of allocated.
+        """
+        np = require_numpy()
+        size = self.count(first_bar, last_bar)
+        columns = dict(out or {})
+        for name in ("bar", "beat", "level", "ms"):
+            if name not in columns:
+                columns[name] = np.empty(size, dtype=COLUMNS[name])
+        ticks = np.empty(size, dtype=np.int64) if sample_rate else None
+        constant = self.tempo_map[0] if len(self.tempo_map) == 1 else None
+
+        # Each meter run is a bars x points-per-bar block, filled by broadcasting
+        position = 0
+        for start, stop, numerator, denominator in self.meter_runs(first_bar, last_bar):
+            beats, levels, tick_offsets = self.bar_layout(numerator, denominator)
+            shape = (stop - start + 1, len(beats))
+            block = slice(position, position + shape[0] * shape[1])
+            bars = np.arange(start, stop + 1, dtype=np.int64)[:, None]
+            columns["bar"][block].reshape(shape)[...] = bars
+            columns["beat"][block].reshape(shape)[...] = beats
+            columns["level"][block].reshape(shape)[...] = levels
+            if constant is not None:
+                # One tempo: the calculator's own formula, broadcast over the block
+                beats_elapsed = (bars - 1) * numerator + (np.array(beats) - 1)
+                np.multiply(beats_elapsed, constant.ms_per_beat, out=columns["ms"][block].reshape(shape))
+            if ticks is not None:
+                if tick_offsets is None:
+                    raise ValueError(f"{self.modifier} {self.note_value} is not a whole number of ticks "
+                                     f"at {DEFAULT_PPQ} PPQ")
+                # Ticks from bar 1 within the run; the sample grid adds the run's start
+                ticks_per_bar = numerator * 4 * DEFAULT_PPQ // denominator
+                ticks[block].reshape(shape)[...] = (bars - start) * ticks_per_bar + np.array(tick_offsets)
+                ticks[block] += self._sample_grid(sample_rate).tick_position(start, 1)
+            position = block.stop
+
+        if constant is None:
+            self._tempo_map_ms(np, columns)
+        if ticks is not None:
+            columns["sample"] = self._sample_grid(sample_rate).samples_at_ticks(ticks, out=columns.get("sample"))
+        return columns
+
+    def _tempo_map_ms(self, np, columns):
+        """Fill columns["ms"] from the tempo map, including points in a bar's last beat"""
+        positions_ms = self.tempo_map.positions_ms
+        milliseconds = columns["ms"]
+        milliseconds[...] = positions_ms(columns["bar"], columns["beat"], assume_sorted=True)
+        last_beat = np.flatnonzero(np.isnan(milliseconds))
+        if len(last_beat):
+            bars, beats = columns["bar"][last_beat], columns["beat"][last_beat]
+            numerators = np.floor(beats)
+            start = positions_ms(bars, numerators, assume_sorted=True)
+            milliseconds[last_beat] = start + (beats - numerators) * (
+                positions_ms(bars + 1, 1, assume_sorted=True) - start)
+
+    def _sample_grid(self, sample_rate):
+        if sample_rate not in self._sample_grids:
+            self._sample_grids[sample_rate] = SampleGrid(self.tempo_map, sample_rate)
+        return self._sample_grids[sample_rate]
+
+    def iter_chunks(self, first_bar, last_bar, sample_rate=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield arrays() for consecutive blocks of whole bars of about chunk_size points"""
+        for start, stop, numerator, denominator in self.meter_runs(first_bar, last_bar):
+            bars_per_chunk = max(chunk_size // len(self.bar_layout(numerator, denominator)[0]), 1)
+            for block_start in range(start, stop + 1, bars_per_chunk):
+                yield self.arrays(block_start, min(block_start + bars_per_chunk - 1, stop), sample_rate)
+
+
+# === EXPORT ===
+
+def write_npy(grid, path, first_bar, last_bar, column="ms", sample_rate=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write one column as a .npy file, streamed a block at a time; returns the point count"""
+    np = require_numpy()
+    dtype = np.dtype(COLUMNS[column])
+    count = grid.count(first_bar, last_bar)
+    with open(path, "wb") as f:
+        np.lib.format.write_array_header_1_0(f, {"descr": dtype.str, "fortran_order": False, "shape": (count,)})
+        _write_blocks(grid, f, first_bar, last_bar, column, dtype, sample_rate, chunk_size)
+    return count
+
+
+def write_raw(grid, path, first_bar, last_bar, column="ms", sample_rate=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write one column as headerless little-endian values (float64 ms, int64 samples); returns the point count"""
+    np = require_numpy()
+    dtype = np.dtype(COLUMNS[column])
+    with open(path, "wb") as f:
+        return _write_blocks(grid, f, first_bar, last_bar, column, dtype, sample_rate, chunk_size)
+
+
+def _write_blocks(grid, f, first_bar, last_bar, column, dtype, sample_rate, chunk_size):
+    count = 0
+    for chunk in grid.iter_chunks(first_bar, last_bar, sample_rate, chunk_size):
+        values = chunk[column].astype(dtype, copy=False)
+        f.write(values.tobytes())
+        count += len(values)
+    return count
+
+
+def write_csv(grid, out, first_bar, last_bar, sample_rate=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write every point as CSV rows (bar, beat, level, ms[, sample]); returns the point count"""
+    columns = [name for name in COLUMNS if sample_rate or name != "sample"]
+    out.write(",".join(columns) + "\n")
+    row = ",".join(["{!r}" if name in ("beat", "ms") else "{}" for name in columns]) + "\n"
+    count = 0
+    for chunk in grid.iter_chunks(first_bar, last_bar, sample_rate, chunk_size):
+        values = [chunk[name].tolist() for name in columns]
+        out.write("".join(map(row.format, *values)))
+        count += len(values[0])
+    return count
+
+
+def parse_bar_range(text):
+    """Parse "1-400" (or "17") into (first, last)"""
+    first, _, last = str(text).partition("-")
+    try:
+        return int(first), int(last or first)
+    except ValueError:
+        raise ValueError(f"Invalid bar range {text!r} (use FIRST-LAST)")
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py grid`"""
+    import batch_mode
+
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py grid",
+                                     description="Write every beat and subdivision timestamp of a bar range")
+    parser.add_argument("--bpm", type=float, required=True)
+    parser.add_argument("--time-signature", default="4/4")
+    parser.add_argument("--bars", default="1-1", help="bar range, e.g. 1-400")
+    parser.add_argument("--note", default="1/4", help="grid note value (1/8, eighth, quaver, ...)")
+    parser.add_argument("--modifier", default="Normal",
+                        help="Normal, Dotted, Triplet, Double dotted, a tuplet like 5:4, or dots and nested "
+                             "tuplets like 'dotted 3:2 5:4'")
+    parser.add_argument("-o", "--output", help=".npy or .f64 (ms as float64), .i64 (samples as int64) "
+                                               "or .csv; CSV to stdout if omitted")
+    parser.add_argument("--samples", type=int, nargs="?", const=DEFAULT_SAMPLE_RATE, metavar="RATE",
+                        help="include exact sample offsets (.npy then holds samples)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    numerator, denominator = batch_mode.parse_time_signature(args.time_signature)
+    note_value = batch_mode.NOTE_ALIASES.get(args.note.strip().lower())
+    modifier = args.modifier.strip()
+    try:
+        if numerator is None or numerator <= 0 or denominator <= 0:
+            raise ValueError(f"Invalid time signature {args.time_signature!r}")
+        if note_value is None:
+            raise ValueError(f"Unknown note value {args.note!r}")
+        parse_modifier(modifier)  # ValueError for unknown spellings
+        first_bar, last_bar = parse_bar_range(args.bars)
+        grid = ClickGrid.constant(args.bpm, numerator, denominator, note_value, modifier)
+
+        output = args.output or ""
+        suffix = output[output.rfind("."):].lower() if "." in output else ""
+        if suffix == ".npy":
+            count = write_npy(grid, output, first_bar, last_bar, "sample" if args.samples else "ms",
+                              args.samples, args.chunk_size)
+        elif suffix in RAW_SUFFIXES:
+            column = RAW_SUFFIXES[suffix]
+            sample_rate = (args.samples or DEFAULT_SAMPLE_RATE) if column == "sample" else None
+            count = write_raw(grid, output, first_bar, last_bar, column, sample_rate, args.chunk_size)
+        elif output:
+            with open(output, "w", encoding="utf-8", newline="") as out:
+                count = write_csv(grid, out, first_bar, last_bar, args.samples, args.chunk_size)
+        else:
+            write_csv(grid, sys.stdout, first_bar, last_bar, args.samples, args.chunk_size)
+            return 0
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{count} grid points written to {output}", file=sys.stderr)
+    return 0
@@ -0,0 +1,176 @@
+"""
+Compute Executor
+Runs slow GUI work (tempo detection, large exports) on worker threads so
+the Tk main loop keeps handling keystrokes.
+
+Jobs are submitted under a key naming what they compute. A newer job for
+the same key supersedes the older one: if the older job has not started
+it is dropped, and if it is already running its result is discarded when
+it finishes. Results are handed back on the main thread through
+root.after, and only for jobs that are still the latest for their key.
+
+    executor = ComputeExecutor(root)
+    executor.submit("tempo", tempo_detect.detect_tempo, path, on_result=show_tempo)
+
+Workers cannot be interrupted, so long jobs call
+compute_executor.raise_if_superseded() between steps to stop early once
+their result would be discarded (outside a job it does nothing). Cheap results should
+not go through the executor at all: a thread hop and a poll cost more
+than a label update.
+"""
+
+import collections
+import queue
+import threading
+
+# How often the main loop checks for finished jobs while any are in flight
+DEFAULT_POLL_MS = 20
+
+DEFAULT_WORKERS = 1
+
+_running = threading.local()
+
+
+class Job:
+    """One submitted call; current while no newer job has been submitted under its key"""
+
+    __slots__ = ("executor", "key", "generation", "fn", "args", "on_result", "on_error")
+
+    def __init__(self, executor, key, generation, fn, args, on_result, on_error):
+        self.executor = executor
+        self.key = key
+        self.generation = generation
+        self.fn = fn
+        self.args = args
+        self.on_result = on_result
+        self.on_error = on_error
+
+    def is_current(self):
+        """True until a newer job is submitted (or the key is cancelled)"""
+        return self.executor._generations.get(self.key) == self.generation
+
+
+class Superseded(Exception):
+    """Raised inside a job that stopped early because a newer job replaced it"""
+
+
+def superseded():
+    """True if the job running on this worker thread is no longer current"""
+    job = getattr(_running, "job", None)
+    return job is not None and not job.is_current()
+
+
+def raise_if_superseded():
+    """Stop the running job with Superseded if it is no longer current"""
+    if superseded():
+        raise Superseded()
+
+
+class ComputeExecutor:
+    """Worker threads for GUI jobs, with stale jobs dropped and results delivered on the main loop"""
+
+    def __init__(self, root, workers=DEFAULT_WORKERS, poll_ms=DEFAULT_POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._generations = {}
+        self._pending = collections.OrderedDict()  # key -> Job waiting for a worker
+        self._condition = threading.Condition()
+        self._done = queue.SimpleQueue()
+        self._active = set()  # Jobs running on a worker
+        self._in_flight = 0
+        self._poll_job = None
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, name=f"compute-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, fn, *args, on_result, on_error=None):
+        """Run fn(*args) on a worker; on_result(result) or on_error(exception) runs on the main loop
+
+        Must be called from the main thread. Returns the Job.
+        """
+        with self._condition:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+            job = Job(self, key, generation, fn, args, on_result, on_error)
+            if self._pending.pop(key, None) is None:
+                self._in_flight += 1
+            self._pending[key] = job
+            self._condition.notify()
+        self._schedule_poll()
+        return job
+
+    def cancel(self, key):
+        """Drop the pending job for key and discard the result of a running one"""
+        with self._condition:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if self._pending.pop(key, None) is not None:
+                self._in_flight -= 1
+
+    def busy(self, key):
+        """True while a current job for key is waiting or running"""
+        with self._condition:
+            return key in self._pending or any(job.key == key and job.is_current() for job in self._active)
+
+    def shutdown(self):
+        """Stop the workers after their current jobs; pending jobs and undelivered results are dropped
+
+        Must be called from the main thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._pending.clear()
+            self._in_flight = 0
+            self._condition.notify_all()
+        if self._poll_job is not None:
+            self.root.after_cancel(self._poll_job)
+            self._poll_job = None
+
+    def _work(self):
+        """Worker thread: run the oldest pending job until shut down"""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                _, job = self._pending.popitem(last=False)
+                self._active.add(job)
+            _running.job = job
+            try:
+                self._done.put((job, job.fn(*job.args), None))
+            except Exception as e:  # Handed to on_error on the main thread
+                self._done.put((job, None, e))
+            finally:
+                _running.job = None
+                with self._condition:
+                    self._active.discard(job)
+
+    def _schedule_poll(self):
+        if self._poll_job is None and not self._closed:
+            self._poll_job = self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        """Main loop: deliver finished jobs that are still current"""
+        self._poll_job = None
+        try:
+            while not self._closed:
+                try:
+                    job, result, error = self._done.get_nowait()
+                except queue.Empty:
+                    break
+                with self._condition:
+                    self._in_flight -= 1
+                if not job.is_current():
+                    continue
+                if error is None:
+                    job.on_result(result)
+                elif job.on_error is not None:
+                    job.on_error(error)
+                else:
+                    raise error
+        finally:
+            # A failing callback is reported by Tk but must not strand later results
+            if self._in_flight > 0:
+                self._schedule_poll()
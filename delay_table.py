@@ -0,0 +1,137 @@
+"""
+Delay Table
+Note durations for every note value and modifier over a sweep of BPMs:
+
+    python bpm_calculator.py delays --from 60 --to 200 --step 0.01 [-o delays.csv] [--decimals 3]
+
+A DelayTable holds only the sweep and the columns' rhythm IDs. Rows are
+computed on request, a window at a time, with one broadcast of the batch
+engine, so the GUI can show a 14,000-row table by filling just the rows on
+screen, and CSV export streams the whole sweep in blocks.
+
+Row BPMs are start + row * step rounded to the decimal places of the start
+and step, so a 0.01 sweep gives exactly the BPMs one would type (120.07, not
+120.07000000000001).
+"""
+
+import argparse
+from decimal import Decimal
+import os
+import sys
+
+from compute_executor import Superseded, raise_if_superseded
+from note_registry import describe
+from timing_engine import MODIFIERS, NOTE_VALUES, note_durations_ms, note_id, require_numpy, rhythm_multipliers
+
+DEFAULT_START_BPM = 60.0
+DEFAULT_STOP_BPM = 200.0
+DEFAULT_STEP = 0.01
+
+# Decimal places of the milliseconds written to CSV
+DEFAULT_DECIMALS = 3
+
+# Rows computed and written per block when exporting
+EXPORT_BLOCK_ROWS = 4096
+
+# Sweeps beyond this many rows are almost certainly a typo in the step
+MAX_ROWS = 10_000_000
+
+# Every note value with every modifier, in note order
+COLUMNS = tuple((note_value, modifier) for note_value in NOTE_VALUES for modifier in MODIFIERS)
+
+
+def column_label(note_value, modifier):
+    """Short heading for a column: "1/8", "1/8 dotted", "1/8 triplet" """
+    return describe(note_id(note_value, modifier))
+
+
+def _decimal_places(value):
+    """Decimal places in the shortest form of a float: 0.01 -> 2, 100.5 -> 1"""
+    return max(0, -Decimal(repr(float(value))).normalize().as_tuple().exponent)
+
+
+class DelayTable:
+    """Durations of the given (note value, modifier) columns over a BPM sweep"""
+
+    def __init__(self, start_bpm=DEFAULT_START_BPM, stop_bpm=DEFAULT_STOP_BPM, step=DEFAULT_STEP,
+                 columns=COLUMNS):
+        if not (start_bpm > 0 and stop_bpm >= start_bpm and step > 0):
+            raise ValueError(f"Invalid BPM sweep {start_bpm}-{stop_bpm} in steps of {step}")
+        # Rows stop at the last step that does not overshoot stop_bpm (allowing for float error)
+        rows = int((stop_bpm - start_bpm) / step + 1e-9) + 1
+        if rows > MAX_ROWS:
+            raise ValueError(f"A sweep of {rows} rows is too long (at most {MAX_ROWS})")
+        self.start_bpm = start_bpm
+        self.step = step
+        self.row_count = rows
+        # Enough places for both the start and the step, so every row is exactly start + k * step
+        self.decimals = max(_decimal_places(start_bpm), _decimal_places(step))
+        self.columns = tuple(columns)
+        self.rhythm_ids = [note_id(*column) for column in self.columns]
+        self.labels = [describe(rid) for rid in self.rhythm_ids]
+
+    def __len__(self):
+        return self.row_count
+
+    def bpms(self, first, stop):
+        """BPMs of rows first..stop-1 (clipped to the table)"""
+        np = require_numpy()
+        first, stop = max(0, first), min(stop, self.row_count)
+        rows = np.arange(first, max(first, stop), dtype=np.float64)
+        return np.round(self.start_bpm + rows * self.step, self.decimals)
+
+    def rows(self, first, stop):
+        """(bpms, durations) for rows first..stop-1; durations has one column per table column"""
+        bpms = self.bpms(first, stop)
+        return bpms, note_durations_ms(bpms[:, None], rhythm_multipliers(self.rhythm_ids)[None, :])
+
+    def write_csv(self, out, first=0, stop=None, decimals=DEFAULT_DECIMALS):
+        """Write rows first..stop-1 as CSV (bpm, then one column per note); returns the row count"""
+        stop = self.row_count if stop is None else min(stop, self.row_count)
+        out.write(",".join(["bpm"] + self.labels) + "\n")
+        row = ",".join([f"{{:.{self.decimals}f}}"] + [f"{{:.{decimals}f}}"] * len(self.columns)) + "\n"
+        count = 0
+        for block in range(max(0, first), stop, EXPORT_BLOCK_ROWS):
+            raise_if_superseded()  # A GUI export replaced by a newer one stops here
+            bpms, durations = self.rows(block, min(block + EXPORT_BLOCK_ROWS, stop))
+            values = [bpms.tolist()] + durations.T.tolist()
+            out.write("".join(map(row.format, *values)))
+            count += len(bpms)
+        return count
+
+    def save_csv(self, path, decimals=DEFAULT_DECIMALS):
+        """Write the whole table to a CSV file; returns the row count"""
+        try:
+            with open(path, "w", encoding="utf-8", newline="") as out:
+                return self.write_csv(out, decimals=decimals)
+        except Superseded:
+            os.remove(path)  # Don't leave half a table behind
+            raise
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py delays`"""
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py delays",
+                                     description="Write note durations for every note value over a BPM sweep")
+    parser.add_argument("--from", dest="start", type=float, default=DEFAULT_START_BPM)
+    parser.add_argument("--to", dest="stop", type=float, default=DEFAULT_STOP_BPM)
+    parser.add_argument("--step", type=float, default=DEFAULT_STEP)
+    parser.add_argument("--decimals", type=int, default=DEFAULT_DECIMALS)
+    parser.add_argument("-o", "--output", help="CSV file; stdout if omitted")
+    args = parser.parse_args(argv)
+
+    try:
+        table = DelayTable(args.start, args.stop, args.step)
+        if not args.output:
+            table.write_csv(sys.stdout, decimals=args.decimals)
+            return 0
+        count = table.save_csv(args.output, args.decimals)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{count} rows written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Font Cache
+Remembers which musical font to use between launches, shared by the BPM
+calculator and the font helper. Enumerating installed fonts is slow on
+systems with many fonts, so the result is stored on disk and reused until
+the system font configuration changes.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+# Fonts that support musical symbols, in order of preference
+# Prioritizing fonts with proper musical notation over basic Unicode fonts
+MUSICAL_FONTS = [
+    "Bravura",             # Professional music engraving font
+    "Noto Music",          # Google's dedicated musical notation font
+    "Petaluma",            # Steinberg's handwritten music font
+    "MuseJazz",            # MuseScore's jazz font
+    "Leland",              # Steinberg's music font
+    "Sebastian",           # Legacy Sibelius font
+    "Opus",                # Legacy Finale font
+    "Maestro",             # Legacy music font
+    "Musical Symbols",     # Generic musical font name
+    "Segoe UI Symbol",     # Windows - actually works well for basic musical symbols
+    "Symbola",             # Cross-platform Unicode font with better musical symbols
+    "DejaVu Sans",         # Linux/cross-platform
+    "Apple Symbols",       # macOS
+    "Arial Unicode MS",    # Has issues with some musical symbols
+]
+
+FALLBACK_FONT = "Arial"
+
+# Bump when the cache layout changes so old files are ignored
+CACHE_VERSION = 2
+
+
+def cache_path():
+    """Location of the font cache file"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "bpm-calculator", "fonts.json")
+
+
+def font_directories():
+    """Directories whose modification times reflect installed fonts"""
+    home = os.path.expanduser("~")
+    if sys.platform == "win32":
+        windir = os.environ.get("WINDIR", r"C:\Windows")
+        local = os.environ.get("LOCALAPPDATA", home)
+        return [os.path.join(windir, "Fonts"),
+                os.path.join(local, "Microsoft", "Windows", "Fonts")]
+    if sys.platform == "darwin":
+        return ["/System/Library/Fonts", "/Library/Fonts",
+                os.path.join(home, "Library", "Fonts")]
+    return ["/usr/share/fonts", "/usr/local/share/fonts",
+            os.path.join(home, ".fonts"), os.path.join(home, ".local", "share", "fonts"),
+            # fontconfig rewrites its caches whenever fc-cache picks up new fonts
+            "/var/cache/fontconfig", os.path.join(home, ".cache", "fontconfig")]
+
+
+def font_fingerprint():
+    """Cheap hash of the system font configuration (directory mtimes, no font enumeration)"""
+    digest = hashlib.sha1(f"{CACHE_VERSION}|{sys.platform}|{'|'.join(MUSICAL_FONTS)}".encode())
+    for directory in font_directories():
+        try:
+            entries = [directory] + [entry.path for entry in os.scandir(directory) if entry.is_dir()]
+        except OSError:
+            continue  # Directory doesn't exist on this system
+        for path in sorted(entries):
+            try:
+                digest.update(f"{path}:{os.stat(path).st_mtime_ns}".encode())
+            except OSError:
+                pass
+    return digest.hexdigest()
+
+
+def load_cache():
+    """Read the cache file, or None if it is missing or unreadable"""
+    try:
+        with open(cache_path(), encoding="utf-8") as f:
+            entry = json.load(f)
+        return entry if entry.get("version") == CACHE_VERSION else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def save_cache(entry):
+    """Write the cache file atomically, ignoring failures (the cache is optional)"""
+    path = cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+def scan_fonts(root=None, fingerprint=None):
+    """Find installed musical fonts, pick the best one and update the cache
+
+    The choice is based on the glyphs each font file really contains. If no
+    font files can be read (unknown font locations), Tk's family list is
+    used instead; the note glyphs cannot be checked then, so the text
+    fallback symbols are used.
+    """
+    fingerprint = fingerprint or font_fingerprint()
+    return scan_font_files(fingerprint) or scan_tk_families(root, fingerprint)
+
+
+def scan_font_files(fingerprint):
+    """scan_fonts from the font files alone, or None if none could be read
+
+    Does not touch Tk, so it can run on a worker thread.
+    """
+    import glyph_index
+
+    families = glyph_index.build_index().families()
+    if not families:
+        return None
+    installed = [name for name in MUSICAL_FONTS if name in families]
+    musical_font, use_unicode_symbols = glyph_index.pick_font(families, MUSICAL_FONTS)
+    coverage = {name: {"symbols": sum(glyph_index.covers(families[name], [symbol])
+                                      for symbol in glyph_index.NOTE_SYMBOLS),
+                       "smufl": families[name]["smufl"]}
+                for name in installed}
+    return _save_entry(fingerprint, installed, coverage, musical_font, use_unicode_symbols)
+
+
+def scan_tk_families(root, fingerprint):
+    """scan_fonts from Tk's family list (main thread only); the glyphs are not checked"""
+    from tkinter import font
+
+    available_fonts = set(font.families(root))
+    installed = [name for name in MUSICAL_FONTS if name in available_fonts]
+    return _save_entry(fingerprint, installed, {}, installed[0] if installed else None, False)
+
+
+def _save_entry(fingerprint, installed, coverage, musical_font, use_unicode_symbols):
+    entry = {
+        "version": CACHE_VERSION,
+        "fingerprint": fingerprint,
+        "installed": installed,
+        "coverage": coverage,
+        "musical_font": musical_font or FALLBACK_FONT,
+        "use_unicode_symbols": use_unicode_symbols,
+    }
+    save_cache(entry)
+    return entry
+
+
+def resolve_musical_font(root, executor):
+    """Pick the musical font, using the on-disk cache when it is current
+
+    Returns (cache entry, info) where info reports the "source" ("cache",
+    "stale-cache" or "scan") and "elapsed_ms". A stale cache is used as-is
+    for this launch and rebuilt on one of the executor's worker threads
+    (a ComputeExecutor), so new fonts are picked up on the next start
+    without slowing this one down.
+    """
+    start = time.perf_counter()
+    fingerprint = font_fingerprint()
+    entry = load_cache()
+
+    if entry and entry.get("fingerprint") == fingerprint:
+        source = "cache"
+    elif entry:
+        source = "stale-cache"
+        # Font files are parsed on the worker; Tk's family list is only read back on the main loop
+        executor.submit("font-scan", scan_font_files, fingerprint,
+                        on_result=lambda scanned: scanned or scan_tk_families(root, fingerprint))
+    else:
+        source = "scan"
+        entry = scan_fonts(root, fingerprint)
+
+    return entry, {"source": source, "elapsed_ms": (time.perf_counter() - start) * 1000.0}
+
+
+def current_entry(root=None):
+    """The font cache entry, rescanning first if the font configuration changed"""
+    fingerprint = font_fingerprint()
+    entry = load_cache()
+    if not entry or entry.get("fingerprint") != fingerprint:
+        entry = scan_fonts(root, fingerprint)
+    return entry
+
+
+def installed_musical_fonts(root=None):
+    """Musical fonts installed on this system, refreshing the cache if it is stale"""
+    return current_entry(root)["installed"]
@@ -9,6 +9,9 @@ from tkinter import ttk, messagebox
 import webbrowser
 import os
 
+import font_cache
+import glyph_index
+
 
 def open_font_download_links():
     """Open browser tabs with musical font download links"""
@@ -52,38 +55,24 @@ def open_font_download_links():
 
 def check_current_fonts():
     """Check what fonts are currently available"""
-    import tkinter.font as font
-    available_fonts = list(font.families())
-    
-    musical_fonts = [
-        "Noto Music",
-        "Bravura", 
-        "Petaluma",
-        "MuseJazz",
-        "Leland",
-        "Sebastian",
-        "Opus",
-        "Maestro",
-        "Musical Symbols",
-        "Symbola",
-        "DejaVu Sans",
-        "Apple Symbols",
-        "Arial Unicode MS",
-        "Segoe UI Symbol"
-    ]
-    
-    found_fonts = []
-    missing_fonts = []
-    
-    for music_font in musical_fonts:
-        if music_font in available_fonts:
-            found_fonts.append(music_font)
-        else:
-            missing_fonts.append(music_font)
+    # Shares the BPM calculator's font cache, so fonts are only enumerated when they change
+    entry = font_cache.current_entry()
+    found_fonts = entry["installed"]
+    missing_fonts = [name for name in font_cache.MUSICAL_FONTS if name not in found_fonts]
     
     message = "INSTALLED MUSICAL FONTS:\n"
     for font_name in found_fonts:
-        message += f"✓ {font_name}\n"
+        message += f"✓ {font_name}"
+        coverage = entry["coverage"].get(font_name)
+        if coverage:
+            # Real glyph coverage read from the font files
+            message += f" ({coverage['symbols']}/{len(glyph_index.NOTE_SYMBOLS)} note symbols"
+            if coverage["smufl"]:
+                message += f", {coverage['smufl']} SMuFL glyphs"
+            message += ")"
+        message += "\n"
+    
+    message += f"\nBPM calculator will use: {entry['musical_font']}\n"
     
     message += "\nMISSING FONTS:\n"
     for font_name in missing_fonts:
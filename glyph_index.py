@@ -0,0 +1,291 @@
+"""
+Glyph Index
+Records which musical symbols each installed font family really contains,
+by reading the cmap tables of local TrueType/OpenType files. Files are
+memory-mapped and parsed in place with struct.unpack_from, and the index is
+persisted so only files whose size or modification time changed are read
+again.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+import font_cache
+
+# Symbols shown on the note buttons (the half note is a two code point sequence)
+NOTE_SYMBOLS = ["𝅝", "𝅗𝅥", "♩", "♪", "♬", "♫"]
+
+# The whole and half notes have text fallbacks ("W"/"H"); these decide whether Unicode symbols are used
+FALLBACK_SYMBOLS = ["𝅝", "𝅗𝅥"]
+
+NEEDED_CODE_POINTS = sorted({ord(c) for symbol in NOTE_SYMBOLS for c in symbol})
+
+# Standard Music Font Layout glyphs live in this part of the Private Use Area
+SMUFL_RANGE = (0xE000, 0xF3FF)
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc", ".otc")
+
+# Bump when the index layout changes so old files are ignored
+INDEX_VERSION = 1
+
+
+def index_path():
+    """Location of the persisted glyph index"""
+    return os.path.join(os.path.dirname(font_cache.cache_path()), "glyphs.json")
+
+
+def font_files(directories=None):
+    """Yield every font file below the font directories"""
+    for directory in directories or font_cache.font_directories():
+        for dirpath, _dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.lower().endswith(FONT_EXTENSIONS):
+                    yield os.path.join(dirpath, filename)
+
+
+# === SFNT PARSING ===
+
+def read_font_faces(path):
+    """Family name and symbol coverage for each face in a font file
+
+    Returns a list of {"family", "code_points", "smufl"} dicts, where
+    code_points are the NEEDED_CODE_POINTS the face maps and smufl is the
+    number of code points it maps in SMUFL_RANGE.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < 12:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            try:
+                if view[:4] == b"ttcf":
+                    # Font collection: a list of offsets to individual faces
+                    count = struct.unpack_from(">I", view, 8)[0]
+                    offsets = struct.unpack_from(f">{count}I", view, 12)
+                else:
+                    offsets = (0,)
+                return [face for face in (_read_face(view, offset) for offset in offsets) if face]
+            finally:
+                view.release()
+
+
+def _read_face(view, offset):
+    """Parse one sfnt face starting at offset"""
+    num_tables = struct.unpack_from(">H", view, offset + 4)[0]
+    tables = {}
+    for i in range(num_tables):
+        tag, _checksum, table_offset, length = struct.unpack_from(">4sIII", view, offset + 12 + 16 * i)
+        tables[tag] = (table_offset, length)
+
+    if b"name" not in tables or b"cmap" not in tables:
+        return None
+    family = _family_name(view, tables[b"name"][0])
+    if not family:
+        return None
+
+    lookup, smufl = _cmap_coverage(view, tables[b"cmap"][0])
+    return {
+        "family": family,
+        "code_points": [cp for cp in NEEDED_CODE_POINTS if lookup(cp)],
+        "smufl": smufl,
+    }
+
+
+def _family_name(view, offset):
+    """Font family (name ID 1), preferring the Windows English record"""
+    _format, count, string_offset = struct.unpack_from(">HHH", view, offset)
+    best = None
+    for i in range(count):
+        platform, encoding, language, name_id, length, name_offset = \
+            struct.unpack_from(">HHHHHH", view, offset + 6 + 12 * i)
+        if name_id != 1:
+            continue
+        start = offset + string_offset + name_offset
+        raw = bytes(view[start:start + length])
+        if platform == 3 or platform == 0:
+            name = raw.decode("utf-16-be", errors="replace")
+            if platform == 3 and language == 0x409:
+                return name
+        elif platform == 1 and encoding == 0:
+            name = raw.decode("mac_roman", errors="replace")
+        else:
+            continue
+        best = best or name
+    return best
+
+
+def _cmap_coverage(view, offset):
+    """Build a code point lookup from the best Unicode cmap subtable
+
+    Returns (lookup(code_point) -> bool, number of SMuFL code points mapped).
+    """
+    count = struct.unpack_from(">H", view, offset + 2)[0]
+    subtables = {}
+    for i in range(count):
+        platform, encoding, sub_offset = struct.unpack_from(">HHI", view, offset + 4 + 8 * i)
+        subtables[(platform, encoding)] = offset + sub_offset
+
+    # Full-repertoire tables first (format 12), then BMP-only ones (format 4)
+    for key in ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0)):
+        if key in subtables:
+            sub_offset = subtables[key]
+            table_format = struct.unpack_from(">H", view, sub_offset)[0]
+            if table_format == 12:
+                return _format12_coverage(view, sub_offset)
+            if table_format == 4:
+                return _format4_coverage(view, sub_offset)
+    return (lambda code_point: False), 0
+
+
+def _format12_coverage(view, offset):
+    """Coverage from a segmented (format 12) cmap"""
+    groups_count = struct.unpack_from(">I", view, offset + 12)[0]
+    groups = [struct.unpack_from(">III", view, offset + 16 + 12 * i)[:2] for i in range(groups_count)]
+    return _range_coverage(groups)
+
+
+def _format4_coverage(view, offset):
+    """Coverage from a BMP segment-mapping (format 4) cmap"""
+    seg_count = struct.unpack_from(">H", view, offset + 6)[0] // 2
+    ends = struct.unpack_from(f">{seg_count}H", view, offset + 14)
+    starts_offset = offset + 16 + 2 * seg_count
+    starts = struct.unpack_from(f">{seg_count}H", view, starts_offset)
+    deltas = struct.unpack_from(f">{seg_count}h", view, starts_offset + 2 * seg_count)
+    range_offsets_at = starts_offset + 4 * seg_count
+    range_offsets = struct.unpack_from(f">{seg_count}H", view, range_offsets_at)
+
+    def glyph_id(segment, code_point):
+        if range_offsets[segment] == 0:
+            return (code_point + deltas[segment]) & 0xFFFF
+        address = (range_offsets_at + 2 * segment + range_offsets[segment]
+                   + 2 * (code_point - starts[segment]))
+        glyph = struct.unpack_from(">H", view, address)[0]
+        return (glyph + deltas[segment]) & 0xFFFF if glyph else 0
+
+    # The final 0xFFFF segment is a required terminator, not a real mapping
+    ranges = [(start, end) for start, end in zip(starts, ends) if start != 0xFFFF]
+    range_lookup, smufl = _range_coverage(ranges)
+
+    def lookup(code_point):
+        if not range_lookup(code_point):
+            return False
+        segment = next(i for i, end in enumerate(ends) if end >= code_point)
+        return glyph_id(segment, code_point) != 0
+
+    return lookup, smufl
+
+
+def _range_coverage(ranges):
+    """Lookup over (start, end) code point ranges plus the SMuFL count they cover"""
+    low, high = SMUFL_RANGE
+    smufl = sum(max(0, min(end, high) - max(start, low) + 1) for start, end in ranges)
+
+    def lookup(code_point):
+        return any(start <= code_point <= end for start, end in ranges)
+
+    return lookup, smufl
+
+
+# === PERSISTED INDEX ===
+
+class GlyphIndex:
+    """Per-file glyph coverage, refreshed incrementally by size and mtime"""
+
+    def __init__(self, files=None):
+        self.files = files or {}
+
+    @classmethod
+    def load(cls):
+        """Read the persisted index (empty if missing or unreadable)"""
+        try:
+            with open(index_path(), encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                return cls(data["files"])
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        return cls()
+
+    def save(self):
+        """Write the index atomically, ignoring failures (the index is optional)"""
+        path = index_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "files": self.files}, f)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def refresh(self, directories=None):
+        """Rescan new or changed font files and forget deleted ones
+
+        Returns the number of files that were parsed or forgotten (0 when
+        the index is unchanged).
+        """
+        seen = set()
+        parsed = 0
+        for path in font_files(directories):
+            seen.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            record = self.files.get(path)
+            if record and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+                continue
+
+            try:
+                faces = read_font_faces(path)
+            except (OSError, ValueError, struct.error):
+                faces = []  # Unreadable or malformed font
+            self.files[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "faces": faces}
+            parsed += 1
+
+        removed = set(self.files) - seen
+        for path in removed:
+            del self.files[path]
+        return parsed + len(removed)
+
+    def families(self):
+        """Combined coverage per family: {family: {"code_points": set, "smufl": int}}"""
+        families = {}
+        for record in self.files.values():
+            for face in record["faces"]:
+                coverage = families.setdefault(face["family"], {"code_points": set(), "smufl": 0})
+                coverage["code_points"].update(face["code_points"])
+                coverage["smufl"] = max(coverage["smufl"], face["smufl"])
+        return families
+
+
+def build_index(directories=None):
+    """Load the persisted index, rescan changed files and save it if anything changed"""
+    index = GlyphIndex.load()
+    if index.refresh(directories) or not os.path.exists(index_path()):
+        index.save()
+    return index
+
+
+def covers(coverage, symbols):
+    """True if a family's coverage includes every code point of the symbols"""
+    return all(ord(c) in coverage["code_points"] for symbol in symbols for c in symbol)
+
+
+def pick_font(families, candidates):
+    """Best family among candidates by real symbol coverage
+
+    Prefers the first candidate (in preference order) covering every note
+    symbol, then the one covering the most. Returns (family or None,
+    use_unicode_symbols).
+    """
+    installed = [name for name in candidates if name in families]
+    if not installed:
+        return None, False
+
+    best = max(installed, key=lambda name: (covers(families[name], NOTE_SYMBOLS),
+                                            len(families[name]["code_points"]),
+                                            -installed.index(name)))
+    return best, covers(families[best], FALLBACK_SYMBOLS)
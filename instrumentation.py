@@ -0,0 +1,246 @@
+"""
+Instrumentation
+Switchable latency timers for the hot paths (GUI recalculation, font setup
+and the batch engine), with per-call-site histograms exported as JSON or
+Prometheus text, plus an optional profiler.
+
+Modules register their hot functions with instrument(). While timing is
+off the original functions stay in place, so there is no overhead at all;
+enable() swaps in timing wrappers and disable() puts the originals back.
+
+Environment variables:
+
+    BPM_CALC_METRICS=1               enable timing
+    BPM_CALC_METRICS=metrics.json    enable timing and write JSON at exit
+    BPM_CALC_METRICS=metrics.prom    ... or Prometheus text
+    BPM_CALC_PROFILE=cprofile:out.prof   cProfile the whole run (pstats file)
+    BPM_CALC_PROFILE=sample:stacks.txt   sample the main thread every 5 ms
+                                         (collapsed stacks for flame graphs)
+"""
+
+import atexit
+import bisect
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+METRICS_ENV = "BPM_CALC_METRICS"
+PROFILE_ENV = "BPM_CALC_PROFILE"
+
+# Histogram bucket upper bounds in microseconds (the last bucket is unbounded)
+BUCKET_BOUNDS_US = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 1000000)
+_BOUNDS_NS = tuple(bound * 1000 for bound in BUCKET_BOUNDS_US)
+
+SAMPLE_INTERVAL = 0.005
+
+
+class Histogram:
+    """Call count, total/max time and bucketed latencies for one call site"""
+
+    __slots__ = ("count", "total_ns", "max_ns", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * (len(_BOUNDS_NS) + 1)
+
+    def observe(self, elapsed_ns):
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.buckets[bisect.bisect_left(_BOUNDS_NS, elapsed_ns)] += 1
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(BUCKET_BOUNDS_US + ("+Inf",), self.buckets):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "total_ms": self.total_ns / 1e6,
+            "mean_ms": self.total_ns / 1e6 / self.count if self.count else 0.0,
+            "max_ms": self.max_ns / 1e6,
+            "buckets_us": buckets,
+        }
+
+
+histograms = collections.defaultdict(Histogram)
+
+# (owner, attribute, call site, original function) for every registered hot path
+_sites = []
+_enabled = False
+
+
+def _timed(func, site):
+    histogram = histograms[site]
+    clock = time.perf_counter_ns
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(clock() - start)
+
+    return wrapper
+
+
+def instrument(owner, *names, prefix):
+    """Register functions of a module or class as call sites named "prefix.name"
+
+    Call at the end of the defining module. Code must reach these functions
+    through the owner (module.func or self.method) for the switch to apply.
+    """
+    for name in names:
+        original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+        site = f"{prefix}.{name}"
+        _sites.append((owner, name, site, original))
+        if _enabled:
+            setattr(owner, name, _timed(original, site))
+
+
+def enable():
+    """Swap timing wrappers in for every registered call site"""
+    global _enabled
+    if not _enabled:
+        _enabled = True
+        for owner, name, site, original in _sites:
+            setattr(owner, name, _timed(original, site))
+
+
+def disable():
+    """Restore the original functions"""
+    global _enabled
+    if _enabled:
+        _enabled = False
+        for owner, name, _site, original in _sites:
+            setattr(owner, name, original)
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    histograms.clear()
+    if _enabled:
+        # Wrappers hold their histogram, so rebuild them
+        disable()
+        enable()
+
+
+# === EXPORT ===
+
+def to_json():
+    """All call sites as a JSON-serializable dict"""
+    return {site: histogram.to_dict() for site, histogram in sorted(histograms.items()) if histogram.count}
+
+
+def to_prometheus():
+    """All call sites in the Prometheus text exposition format"""
+    name = "bpm_calc_call_duration_seconds"
+    lines = [f"# HELP {name} Latency of instrumented call sites.", f"# TYPE {name} histogram"]
+    for site, histogram in sorted(histograms.items()):
+        if not histogram.count:
+            continue
+        cumulative = 0
+        for bound, count in zip(BUCKET_BOUNDS_US + (None,), histogram.buckets):
+            cumulative += count
+            le = "+Inf" if bound is None else repr(bound / 1e6)
+            lines.append(f'{name}_bucket{{site="{site}",le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{site="{site}"}} {histogram.total_ns / 1e9!r}')
+        lines.append(f'{name}_count{{site="{site}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def write(path):
+    """Write metrics to path, as Prometheus text for .prom/.txt files and JSON otherwise"""
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith((".prom", ".txt")):
+            f.write(to_prometheus())
+        else:
+            json.dump(to_json(), f, indent=2)
+
+
+# === PROFILING ===
+
+class StackSampler:
+    """Background thread recording the main thread's stack at a fixed interval"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.thread_id = threading.main_thread().ident
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        """Collapsed stacks ("frame;frame;frame count"), the input format of flamegraph tools"""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def start_profiling(spec):
+    """Start "cprofile:PATH" or "sample:PATH" profiling, written out at exit"""
+    kind, _, path = spec.partition(":")
+    if kind == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def finish():
+            profiler.disable()
+            profiler.dump_stats(path or "bpm_calc.prof")
+    elif kind == "sample":
+        sampler = StackSampler()
+        sampler.start()
+
+        def finish():
+            sampler.stop()
+            sampler.write(path or "bpm_calc.stacks")
+    else:
+        print(f"Ignoring {PROFILE_ENV}={spec!r} (use cprofile:PATH or sample:PATH)", file=sys.stderr)
+        return
+    atexit.register(finish)
+
+
+def configure_from_environment():
+    """Apply BPM_CALC_METRICS and BPM_CALC_PROFILE"""
+    metrics = os.environ.get(METRICS_ENV, "")
+    if metrics and metrics != "0":
+        enable()
+        if metrics != "1":
+            atexit.register(write, metrics)
+    profile = os.environ.get(PROFILE_ENV)
+    if profile:
+        start_profiling(profile)
+
+
+configure_from_environment()
@@ -0,0 +1,187 @@
+"""
+Metronome
+Sample-accurate click tracks rendered straight to WAV:
+
+    python bpm_calculator.py metronome --bpm 120 --time-signature 7/8 --bars 1-400 \\
+        [--note 1/16 --modifier triplet] [--sample-rate 96000] [--bits 24] -o click.wav
+
+Every bar starts with an accented downbeat, every other beat of the
+numerator gets a normal click, and with --note the grid points of that
+note value and modifier in between get a quiet subdivision click. Click
+times come from ClickGrid's exact sample offsets, so a click lands on the
+same sample however long the track is.
+
+Audio is made a block at a time: the click sounds are synthesized once,
+each block only mixes the clicks that start in or ring into it (one
+bincount per sound), and silent blocks are written from a shared buffer of
+zeros. Blocks go straight to the file through the standard library's wave
+module, so memory use does not depend on the length of the track.
+"""
+
+import argparse
+import sys
+import wave
+
+from click_grid import BEAT, DOWNBEAT, SUBDIVISION, ClickGrid, parse_bar_range
+from note_registry import NOTE_DENOMINATORS, parse_modifier
+from sample_grid import SampleGrid
+from tempo_map import TempoMap
+from timing_engine import require_numpy
+
+DEFAULT_SAMPLE_RATE = 48000
+DEFAULT_BITS = 16
+
+# Frames synthesized and written per block
+BLOCK_FRAMES = 1 << 16
+
+# Click sounds: (frequency Hz, peak level) per grid level; each is a sine with an exponential decay
+CLICK_SOUNDS = {
+    DOWNBEAT: (1760.0, 0.9),
+    BEAT: (1320.0, 0.6),
+    SUBDIVISION: (880.0, 0.3),
+}
+CLICK_LENGTH_S = 0.03
+CLICK_DECAY_S = 0.006
+
+# Grid points fetched from the click grid at a time
+GRID_CHUNK_SIZE = 1 << 16
+
+
+def click_sound(np, sample_rate, frequency, level):
+    """One click as float32 samples in -1..1"""
+    t = np.arange(int(CLICK_LENGTH_S * sample_rate)) / sample_rate
+    return (level * np.sin(2 * np.pi * frequency * t) * np.exp(-t / CLICK_DECAY_S)).astype(np.float32)
+
+
+class _ClickStream:
+    """Click start samples of one grid, pulled in chunks as rendering moves forward"""
+
+    def __init__(self, np, grid, first_bar, last_bar, sample_rate, origin, levels):
+        self.np = np
+        self.chunks = grid.iter_chunks(first_bar, last_bar, sample_rate, GRID_CHUNK_SIZE)
+        self.origin = origin
+        self.levels = levels
+        self.starts = {level: np.empty(0, dtype=np.int64) for level in levels}
+        self.horizon = -1  # Last sample pulled from the grid so far
+
+    def window(self, level, start, stop, length):
+        """Start samples of clicks of a level that sound in [start, stop)"""
+        np = self.np
+        while self.horizon < stop:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.horizon = float("inf")
+                break
+            samples = chunk["sample"] - self.origin
+            self.horizon = samples[-1]
+            for grid_level in self.levels:
+                fresh = samples[chunk["level"] == grid_level]
+                self.starts[grid_level] = np.concatenate([self.starts[grid_level], fresh])
+        starts = self.starts[level]
+        # Clicks that ended before this block can never sound again
+        starts = self.starts[level] = starts[np.searchsorted(starts, start - length, side="right"):]
+        return starts[:np.searchsorted(starts, stop, side="left")]
+
+
+def render(path, tempo_map, first_bar, last_bar, note_value=None, modifier="Normal",
+           sample_rate=DEFAULT_SAMPLE_RATE, bits=DEFAULT_BITS):
+    """Write a mono click track of bars first_bar..last_bar to a WAV file; returns the frame count
+
+    Beats follow the time signature of each bar (a beat is one 1/denominator
+    note). With note_value, grid points of that note value and modifier
+    that are not beats get a subdivision click.
+    """
+    np = require_numpy()
+    if bits not in (16, 24):
+        raise ValueError(f"Unsupported sample size {bits} bits (use 16 or 24)")
+    if first_bar < 1 or last_bar < first_bar:
+        raise ValueError(f"Invalid bar range {first_bar}-{last_bar}")
+
+    samples = SampleGrid(tempo_map, sample_rate)
+    origin = samples.sample_offset(first_bar, 1)
+    sounds = {level: click_sound(np, sample_rate, *CLICK_SOUNDS[level]) for level in CLICK_SOUNDS}
+    length = len(sounds[DOWNBEAT])
+    # The track ends at the bar line after last_bar, plus room for the last click to ring out
+    frames = samples.sample_offset(last_bar + 1, 1) - origin + length
+
+    # Beats come from a grid of the shortest beat in the map, keeping only the points on beats
+    denominator = max(segment.denominator for segment in tempo_map)
+    beat_note = next((name for name, value in NOTE_DENOMINATORS.items() if value == denominator), None)
+    if beat_note is None:
+        raise ValueError(f"Unsupported time signature denominator {denominator}")
+    streams = [_ClickStream(np, ClickGrid(tempo_map, beat_note), first_bar, last_bar, sample_rate, origin,
+                            (DOWNBEAT, BEAT))]
+    if note_value is not None:
+        grid = ClickGrid(tempo_map, note_value, modifier)
+        streams.append(_ClickStream(np, grid, first_bar, last_bar, sample_rate, origin, (SUBDIVISION,)))
+
+    scale, dtype = (32767, "<i2") if bits == 16 else (8388607, "<i4")
+    silence = bytes(BLOCK_FRAMES * bits // 8)
+    with open(path, "wb") as f, wave.open(f, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(bits // 8)
+        out.setframerate(sample_rate)
+        for start in range(0, frames, BLOCK_FRAMES):
+            stop = min(start + BLOCK_FRAMES, frames)
+            block = None
+            for stream in streams:
+                for level in stream.levels:
+                    starts = stream.window(level, start, stop, length)
+                    if len(starts):
+                        block = _mix(np, block, starts - start, sounds[level], stop - start)
+            if block is None:
+                out.writeframesraw(silence[:(stop - start) * bits // 8])
+                continue
+            pcm = np.rint(np.clip(block, -1.0, 1.0) * scale).astype(dtype)
+            if bits == 24:
+                pcm = pcm.view(np.uint8).reshape(-1, 4)[:, :3]
+            out.writeframesraw(pcm.tobytes())
+    return frames
+
+
+def _mix(np, block, offsets, sound, size):
+    """Add a sound at each offset (relative to the block, may be negative) into a float64 block"""
+    positions = (offsets[:, None] + np.arange(len(sound))).ravel()
+    inside = (positions >= 0) & (positions < size)
+    weights = np.broadcast_to(sound, (len(offsets), len(sound))).ravel()[inside]
+    mixed = np.bincount(positions[inside], weights, minlength=size)
+    return mixed if block is None else block + mixed
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py metronome`"""
+    import batch_mode
+
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py metronome",
+                                     description="Render a click track to a WAV file")
+    parser.add_argument("--bpm", type=float, required=True)
+    parser.add_argument("--time-signature", default="4/4")
+    parser.add_argument("--bars", default="1-8", help="bar range, e.g. 1-400")
+    parser.add_argument("--note", help="also click this note value between beats (1/8, eighth, quaver, ...)")
+    parser.add_argument("--modifier", default="Normal", help="Normal, Dotted, Triplet, 5:4, ...")
+    parser.add_argument("--sample-rate", type=int, default=DEFAULT_SAMPLE_RATE)
+    parser.add_argument("--bits", type=int, default=DEFAULT_BITS, choices=(16, 24))
+    parser.add_argument("-o", "--output", required=True, help="WAV file to write")
+    args = parser.parse_args(argv)
+
+    numerator, denominator = batch_mode.parse_time_signature(args.time_signature)
+    note_value = batch_mode.NOTE_ALIASES.get(args.note.strip().lower()) if args.note else None
+    try:
+        if numerator is None or numerator <= 0 or denominator <= 0:
+            raise ValueError(f"Invalid time signature {args.time_signature!r}")
+        if args.note and note_value is None:
+            raise ValueError(f"Unknown note value {args.note!r}")
+        parse_modifier(args.modifier)  # ValueError for unknown spellings
+        first_bar, last_bar = parse_bar_range(args.bars)
+        tempo_map = TempoMap.constant(args.bpm, numerator, denominator)
+        frames = render(args.output, tempo_map, first_bar, last_bar, note_value, args.modifier.strip(),
+                        args.sample_rate, args.bits)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{frames / args.sample_rate:.1f} s of clicks written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,479 @@
+"""
+MIDI File
+Standard MIDI File reader for tempo maps and note timings:
+
+    python bpm_calculator.py midi song.mid [-o notes.csv] [--workers N]
+
+The file is memory-mapped and each track is scanned once. Tempo (FF 51)
+and time signature (FF 58) meta events are kept. Note events are recorded
+as a tick and a file offset only, and their keys, velocities and channels
+are read from the mapped file afterwards with NumPy. Milliseconds and
+bar/beat positions of all notes are then computed in one vectorized pass,
+with the same bar/beat semantics as the calculator (beat 1 starts the bar;
+one beat is a 1/denominator note).
+"""
+
+import argparse
+import mmap
+import re
+import struct
+import sys
+
+from tempo_map import TempoMap
+from timing_engine import require_numpy
+
+# Microseconds per quarter note until the first tempo event (120 BPM)
+DEFAULT_TEMPO = 500000
+
+NOTE_COLUMNS = ("track", "channel", "key", "velocity", "on", "tick", "ms", "bar", "beat")
+
+CSV_CHUNK = 65536
+
+
+class MidiFile:
+    """Header and track layout of a Standard MIDI File, memory-mapped"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_layout()
+        except (struct.error, ValueError):
+            self.close()
+            raise
+
+    def _read_layout(self):
+        data = self._map
+        if data[:4] != b"MThd":
+            raise ValueError(f"{self.path} is not a Standard MIDI File")
+        header_length, self.format, _declared_tracks, division = struct.unpack_from(">IHHH", data, 4)
+        if division & 0x8000:
+            raise ValueError("SMPTE time division is not supported (only ticks per quarter note)")
+        if self.format == 2:
+            raise ValueError("Format 2 (independent sequences) is not supported")
+        self.division = division
+
+        # (start, end) byte range of each MTrk chunk; other chunk types are skipped
+        self.tracks = []
+        offset = 8 + header_length
+        while offset + 8 <= len(data):
+            chunk_type, length = struct.unpack_from(">4sI", data, offset)
+            start = offset + 8
+            if chunk_type == b"MTrk":
+                self.tracks.append((start, min(start + length, len(data))))
+            offset = start + length
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, workers=1):
+        """Scan every track and return a MidiData"""
+        tasks = [(self.path, track, start, end) for track, (start, end) in enumerate(self.tracks)]
+        if workers == 1 or len(tasks) < 2:
+            scans = [scan_track(self._map, *task[1:]) for task in tasks]
+        else:
+            import parallel_batch
+            with parallel_batch.process_pool(min(workers or parallel_batch.default_workers(), len(tasks))) as pool:
+                scans = pool.map(_scan_track_task, tasks)
+        return MidiData(self.division, scans, self._map)
+
+
+def _scan_track_task(task):
+    path, track, start, end = task
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return scan_track(data, track, start, end)
+
+
+# One event's delta time: up to three continuation bytes and a final byte
+_DELTA = rb"[\x80-\xff]{0,3}[\x00-\x7f]"
+
+# Channel messages by data byte count: note off/on, aftertouch, control
+# change and pitch bend carry two, program change and channel pressure one
+_STATUS = {2: rb"[\x80-\xbf\xe0-\xef]", 1: rb"[\xc0-\xdf]"}
+
+# Runs of channel events with the same data byte count, each with or
+# without its own status byte. _RUN may start with running status, _START
+# begins with a status byte. The parse is unambiguous, so the quantifiers
+# are possessive where the re module supports it (Python 3.11+) to skip
+# backtracking bookkeeping.
+_POSSESSIVE = b"+" if sys.version_info >= (3, 11) else b""
+
+
+def _run_pattern(count, running):
+    status = _STATUS[count]
+    optional_status = status + b"?" + _POSSESSIVE
+    data = rb"[\x00-\x7f]{%d}" % count
+    first = _DELTA + (optional_status if running else status) + data
+    return re.compile(first + rb"(?:" + _DELTA + optional_status + data + rb")*" + _POSSESSIVE)
+
+
+_RUN = {count: _run_pattern(count, True) for count in _STATUS}
+_START = {count: _run_pattern(count, False) for count in _STATUS}
+
+# Bytes of channel events decoded by NumPy at a time
+DECODE_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def scan_track(data, track, start, end):
+    """Read one track's events
+
+    Returns (track, note_ticks, note_refs, tempos, meters). note_refs pack
+    each note event's data byte offset and status byte as offset << 8 | status.
+    tempos are (tick, microseconds per quarter) and meters (tick, numerator,
+    denominator).
+
+    The regular expressions above find runs of channel events in C. Python
+    only sees one match per run plus each meta/sysex event, and ticks are
+    assigned to whole chunks of events at once by _decode_chunk.
+    """
+    np = require_numpy()
+    raw = np.frombuffer(data, dtype=np.uint8)
+    chunk = _Chunk(start)
+    notes = ([], [])
+    tempos = []
+    meters = []
+    tick = 0
+    status = 0
+    count = 0
+    position = start
+
+    try:
+        while position < end:
+            # Running status continues the previous run's kind of message
+            match = _RUN[count].match(data, position, end) if count else None
+            if match is None:
+                for kind, pattern in _START.items():
+                    match = pattern.match(data, position, end)
+                    if match is not None:
+                        count = kind
+                        break
+            if match is not None:
+                chunk.runs.append((position, match.end(), count))
+                position = match.end()
+                if position - chunk.start >= DECODE_CHUNK_BYTES:
+                    tick, status = _decode_chunk(np, raw, chunk, tick, status, notes, tempos, meters)
+                    chunk = _Chunk(position)
+                continue
+
+            # Meta or sysex event (or a malformed one): read it here, timed with its chunk
+            event_start = position
+            delta, position = _read_variable_length(data, position)
+            event_type = data[position]
+            position += 1
+            if event_type not in (0xFF, 0xF0, 0xF7):
+                raise ValueError(f"Track {track}: unexpected byte {event_type:#04x} at offset {position - 1}")
+            meta_type = None
+            if event_type == 0xFF:
+                meta_type = data[position]
+                position += 1
+            length, position = _read_variable_length(data, position)
+            if meta_type == 0x51 and length >= 3:
+                chunk.metas.append((event_start, delta, tempos, (int.from_bytes(data[position:position + 3], "big"),)))
+            elif meta_type == 0x58 and length >= 2:
+                chunk.metas.append((event_start, delta, meters, (data[position], 1 << data[position + 1])))
+            else:
+                chunk.metas.append((event_start, delta, None, None))
+            if meta_type == 0x2F:
+                break
+            position += length
+    except IndexError:
+        pass  # Truncated final event: keep what was read
+    _decode_chunk(np, raw, chunk, tick, status, notes, tempos, meters)
+
+    empty = np.zeros(0, dtype=np.int64)
+    note_ticks, note_refs = notes
+    return (track, np.concatenate(note_ticks) if note_ticks else empty,
+            np.concatenate(note_refs) if note_refs else empty, tempos, meters)
+
+
+class _Chunk:
+    """Events read since start and not yet given ticks"""
+
+    __slots__ = ("start", "runs", "metas")
+
+    def __init__(self, start):
+        self.start = start
+        self.runs = []   # (start, end, data bytes per event)
+        self.metas = []  # (position, delta, list to append to or None, values)
+
+
+def _read_variable_length(data, position):
+    """Decode a variable-length quantity; returns (value, next position)"""
+    byte = data[position]
+    position += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+    return value, position
+
+
+def _decode_chunk(np, raw, chunk, tick, status, notes, tempos, meters):
+    """Give every event of a chunk its tick; collect notes, tempos and meters
+
+    Inside a run every byte below 0x80 is either the last byte of a delta
+    time or a data byte, in groups of one delta byte plus the run's data
+    byte count; every other byte is a status or a delta continuation. status
+    is the running status before the chunk. Returns the tick and running
+    status after the last event.
+    """
+    runs = chunk.runs
+    first = chunk.start
+    deltas = delta_ends = event_statuses = first_data = np.zeros(0, dtype=np.int64)
+    if runs:
+        data = raw[first:runs[-1][1]]
+        starts = np.array([run[0] for run in runs], dtype=np.int64) - first
+        ends = np.array([run[1] for run in runs], dtype=np.int64) - first
+
+        low = data < 0x80
+        high = ~low
+        if chunk.metas:
+            # Meta and sysex bytes between runs are masked out
+            inside = np.zeros(len(data) + 1, dtype=np.int8)
+            np.add.at(inside, starts, 1)
+            np.add.at(inside, ends, -1)
+            inside = np.cumsum(inside[:-1], dtype=np.int8).astype(bool)
+            low &= inside
+            high &= inside
+        low = np.flatnonzero(low)
+
+        # Runs hold whole events, so with a single data byte count the
+        # roles simply repeat through the chunk's low bytes
+        counts = {run[2] for run in runs}
+        if len(counts) == 1:
+            step = counts.pop() + 1
+            delta_ends = low[::step]
+            first_data = low[1::step]
+        else:
+            data_bytes = np.array([run[2] for run in runs], dtype=np.int64)
+            low_runs = np.searchsorted(starts, low, side="right") - 1
+            rank = np.arange(len(low)) - np.searchsorted(low, starts)[low_runs]
+            role = rank % (data_bytes[low_runs] + 1)
+            delta_ends = low[role == 0]
+            first_data = low[role == 1]
+
+        # A status byte directly follows its delta time; events without one
+        # take the previous event's status
+        status_bytes = data[delta_ends + 1]
+        explicit = status_bytes >= 0x80
+        event_statuses = np.where(explicit, status_bytes.astype(np.int64), -1)
+        if event_statuses[0] < 0:
+            event_statuses[0] = status
+        filled = np.where(event_statuses >= 0, np.arange(len(event_statuses)), 0)
+        event_statuses = event_statuses[np.maximum.accumulate(filled)]
+        status = int(event_statuses[-1])
+
+        # Up to three continuation bytes directly precede a delta's last byte
+        deltas = (data[delta_ends] & 0x7F).astype(np.int64)
+        high[delta_ends[explicit] + 1] = False
+        events = np.arange(len(delta_ends))
+        position = delta_ends
+        for shift in (7, 14, 21):
+            position = position - 1
+            longer = (position >= 0) & high[position]
+            events, position = events[longer], position[longer]
+            if not len(events):
+                break
+            deltas[events] += (data[position] & 0x7F).astype(np.int64) << shift
+
+    # Channel and meta events in file order share one running tick count:
+    # each event's tick adds up the deltas of both kinds before it
+    metas = chunk.metas
+    channel_ticks = np.cumsum(deltas)
+    end_tick = tick + (int(channel_ticks[-1]) if len(channel_ticks) else 0)
+    if metas:
+        meta_positions = np.array([meta[0] for meta in metas], dtype=np.int64) - first
+        meta_ticks = np.cumsum(np.array([meta[1] for meta in metas], dtype=np.int64))
+        end_tick += int(meta_ticks[-1])
+        channel_before = np.concatenate(([0], channel_ticks))[np.searchsorted(delta_ends, meta_positions)]
+        channel_ticks += np.concatenate(([0], meta_ticks))[np.searchsorted(meta_positions, delta_ends)]
+        for meta, meta_tick in zip(metas, (meta_ticks + channel_before + tick).tolist()):
+            if meta[2] is not None:
+                meta[2].append((meta_tick,) + meta[3])
+    channel_ticks += tick
+
+    is_note = (event_statuses & 0xE0) == 0x80
+    notes[0].append(channel_ticks[is_note])
+    notes[1].append((first_data[is_note] + first) << 8 | event_statuses[is_note])
+    return end_tick, status
+
+
+class MidiData:
+    """Tempo, meter and note events of a scanned file"""
+
+    def __init__(self, division, scans, data):
+        np = require_numpy()
+        self.division = division
+
+        # Meta events from any track apply to the whole file. The sort is stable and on
+        # tick only, so at a shared tick the last event in track and file order wins
+        tempos = sorted((event for scan in scans for event in scan[3]), key=lambda event: event[0])
+        meters = sorted((event for scan in scans for event in scan[4]), key=lambda event: event[0])
+        self.tempos = _last_per_tick([(0, DEFAULT_TEMPO)] + tempos)
+        self.meters = _last_per_tick([(0, 4, 4)] + meters)
+
+        counts = [len(scan[1]) for scan in scans]
+        ticks = np.concatenate([scan[1] for scan in scans] or [np.zeros(0, np.int64)])
+        refs = np.concatenate([scan[2] for scan in scans] or [np.zeros(0, np.int64)])
+        raw = np.frombuffer(data, dtype=np.uint8)
+        offsets = refs >> 8
+        status = (refs & 0xFF).astype(np.uint8)
+        # A note cut off by the end of the file reads its missing bytes from the last byte
+        keys = raw[np.minimum(offsets, len(raw) - 1)]
+        velocities = raw[np.minimum(offsets + 1, len(raw) - 1)]
+
+        # Notes in time order (stable, so simultaneous events keep track order)
+        order = np.argsort(ticks, kind="stable")
+        self.notes = {
+            "track": np.repeat(np.arange(len(scans), dtype=np.uint16), counts)[order],
+            "channel": (status & 0x0F)[order],
+            "key": keys[order],
+            "velocity": velocities[order],
+            # A note-on with velocity 0 is a note-off
+            "on": ((status & 0xF0 == 0x90) & (velocities > 0))[order],
+            "tick": ticks[order],
+        }
+
+    def __len__(self):
+        return len(self.notes["tick"])
+
+    # === TEMPO AND METER ===
+
+    def _tempo_table(self):
+        """Start tick, microseconds per quarter and start time of each tempo
+
+        Start times are kept in exact integer units of 1 / division
+        microseconds, so each note's time is rounded only once.
+        """
+        np = require_numpy()
+        ticks = np.array([tick for tick, _ in self.tempos], dtype=np.int64)
+        tempos = np.array([value for _, value in self.tempos], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(np.diff(ticks) * tempos[:-1])))
+        return ticks, tempos, starts
+
+    def _meter_table(self):
+        """Start tick, first bar number, numerator and denominator of each time signature
+
+        A time signature that arrives mid-bar starts a new bar.
+        """
+        bars = []
+        bar = 1
+        previous = None
+        for tick, numerator, denominator in self.meters:
+            if previous is not None:
+                previous_tick, previous_numerator, previous_denominator = previous
+                scaled_ticks_per_bar = self.division * 4 * previous_numerator
+                bar += -(-(tick - previous_tick) * previous_denominator // scaled_ticks_per_bar)
+            bars.append(bar)
+            previous = (tick, numerator, denominator)
+        return bars
+
+    def positions(self, ticks):
+        """Milliseconds, bars and (fractional) beats of tick positions"""
+        np = require_numpy()
+        ticks = np.asarray(ticks, dtype=np.int64)
+
+        tempo_ticks, tempos, starts = self._tempo_table()
+        index = np.searchsorted(tempo_ticks, ticks, side="right") - 1
+        milliseconds = (starts[index] + (ticks - tempo_ticks[index]) * tempos[index]) / (1000.0 * self.division)
+
+        meter_ticks = np.array([tick for tick, _, _ in self.meters], dtype=np.int64)
+        numerators = np.array([num for _, num, _ in self.meters], dtype=np.int64)
+        denominators = np.array([den for _, _, den in self.meters], dtype=np.int64)
+        first_bars = np.array(self._meter_table(), dtype=np.int64)
+        index = np.searchsorted(meter_ticks, ticks, side="right") - 1
+
+        # Beats counted in ticks * denominator so 4 * division ticks per beat stays integral
+        scaled = (ticks - meter_ticks[index]) * denominators[index]
+        beats, remainder = np.divmod(scaled, 4 * self.division)
+        bars = first_bars[index] + beats // numerators[index]
+        beat = beats % numerators[index] + 1 + remainder / (4.0 * self.division)
+        return milliseconds, bars, beat
+
+    def changes(self):
+        """(tick, bar, beat, bpm, numerator, denominator) at every tempo or time signature change"""
+        ticks = sorted({tick for tick, _ in self.tempos} | {tick for tick, _, _ in self.meters})
+        _ms, bars, beats = self.positions(ticks)
+
+        changes = []
+        tempo_index = meter_index = 0
+        for tick, bar, beat in zip(ticks, bars.tolist(), beats.tolist()):
+            while tempo_index + 1 < len(self.tempos) and self.tempos[tempo_index + 1][0] <= tick:
+                tempo_index += 1
+            while meter_index + 1 < len(self.meters) and self.meters[meter_index + 1][0] <= tick:
+                meter_index += 1
+            _tick, numerator, denominator = self.meters[meter_index]
+            bpm = 60_000_000 / self.tempos[tempo_index][1]
+            changes.append((tick, bar, beat, bpm, numerator, denominator))
+        return changes
+
+    def tempo_map(self):
+        """TempoMap with a segment at every tempo or time signature change
+
+        Raises ValueError when a tempo changes after the start of a bar's
+        last beat, which the calculator's positions cannot express.
+        """
+        return TempoMap([change[1:] for change in self.changes()])
+
+    def note_positions(self):
+        """All notes with ms, bar and beat added, in time order"""
+        milliseconds, bars, beats = self.positions(self.notes["tick"])
+        return dict(self.notes, ms=milliseconds, bar=bars, beat=beats)
+
+
+def _last_per_tick(events):
+    """Keep the last event at each tick (events sorted by tick)"""
+    kept = {}
+    for event in events:
+        kept[event[0]] = event
+    return list(kept.values())
+
+
+def read_midi(path, workers=1):
+    """Scan a MIDI file into a MidiData"""
+    with MidiFile(path) as midi:
+        return midi.read(workers)
+
+
+def write_notes_csv(notes, out, chunk_size=CSV_CHUNK):
+    """Write note_positions() output as CSV, a chunk at a time"""
+    out.write(",".join(NOTE_COLUMNS) + "\n")
+    total = len(notes["tick"])
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        columns = [notes[name][start:stop].tolist() for name in NOTE_COLUMNS]
+        columns[4] = ["on" if on else "off" for on in columns[4]]
+        out.write("".join(map("{},{},{},{},{},{},{!r},{},{!r}\n".format, *columns)))
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py midi`"""
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py midi",
+                                     description="Read tempo changes and note timings from a Standard MIDI File")
+    parser.add_argument("input", help="MIDI file")
+    parser.add_argument("-o", "--output", help="write every note with ms, bar and beat to this CSV file")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="worker processes (0 = one per core)")
+    args = parser.parse_args(argv)
+
+    try:
+        with MidiFile(args.input) as midi:
+            data = midi.read(args.workers)
+            print(f"{len(midi.tracks)} tracks, {midi.division} ticks per quarter note, {len(data)} note events")
+            for _tick, bar, beat, bpm, numerator, denominator in data.changes():
+                print(f"  Bar {bar}, Beat {beat:g}: {bpm:.3f} BPM {numerator}/{denominator}")
+            if args.output:
+                with open(args.output, "w", encoding="utf-8", newline="") as out:
+                    write_notes_csv(data.note_positions(), out)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,166 @@
+"""
+Note Registry
+Every rhythm the engines time (a note value with any dots and tuplets) is
+compiled once into an exact rational multiplier of a quarter note and
+given a small integer ID. Scalar code looks multipliers up by ID, batch
+code gathers a whole array of IDs from the float table in one step (see
+timing_engine.rhythm_multipliers), and display names are only used to find
+an ID when a rhythm is picked.
+
+    rid = rhythm_id("Eighth Note (1/8)", "Double dotted")
+    multiplier(rid)                              # 0.875
+    exact_multiplier(rid)                        # Fraction(7, 8)
+    compile_rhythm(16, tuplets=((3, 2), (5, 4))) # 5:4 nested inside a triplet
+    describe(rid)                                # "1/8 double dotted"
+
+Modifier spellings are "Normal", "Dotted", "Double dotted", "Triple dotted",
+"Triplet" or a tuplet ratio "n:m" (n notes in the time of m), after any
+dots and nested outermost first: "dotted 3:2 5:4". Spellings are not case
+sensitive.
+
+IDs are handed out in order of compilation. The note values with the
+GUI's three modifiers are compiled at import in a fixed order, so those
+IDs are the same in every process; IDs compiled later are local to it.
+"""
+
+from array import array
+from fractions import Fraction
+
+# Note values by display name, as the denominator of the note (4 is a quarter note)
+NOTE_DENOMINATORS = {
+    "Whole Note (1/1)": 1,
+    "Half Note (1/2)": 2,
+    "Quarter Note (1/4)": 4,
+    "Eighth Note (1/8)": 8,
+    "Sixteenth Note (1/16)": 16,
+    "Thirty-second Note (1/32)": 32,
+    "Sixty-fourth Note (1/64)": 64,
+    "Hundred twenty-eighth Note (1/128)": 128,
+}
+
+# Named modifiers as (dots, tuplets); the first three are the GUI's buttons
+MODIFIER_SPECS = {
+    "Normal": (0, ()),
+    "Dotted": (1, ()),
+    "Triplet": (0, ((3, 2),)),
+    "Double dotted": (2, ()),
+    "Triple dotted": (3, ()),
+}
+
+DOT_WORDS = {"dotted": 1, "double": 2, "triple": 3}
+
+MAX_DOTS = 3
+
+# Multiplier table index that never holds a rhythm (the batch table maps it to NaN)
+INVALID_ID = -1
+
+# Name lookups remembered per (note value, modifier) spelling; beyond this many, spellings
+# (say, from a CSV with free-text modifiers) are still compiled but no longer remembered
+MAX_NAMED = 4096
+
+_keys = []               # (denominator, dots, tuplets) per ID
+_fractions = []          # exact multiplier per ID
+_multipliers = array('d')  # float multiplier per ID
+_ids = {}                # (denominator, dots, tuplets) -> ID
+_named = {}              # (note value name, modifier spelling) -> ID
+
+
+def parse_modifier(text):
+    """(dots, tuplets) for a modifier spelling; ValueError if it is not one"""
+    spec = MODIFIER_SPECS.get(text)
+    if spec is not None:
+        return spec
+    words = str(text).lower().replace("-", " ").replace(",", " ").split()
+    dots = 0
+    tuplets = []
+    pending = None
+    for word in words:
+        if word in ("double", "triple") and pending is None and not tuplets:
+            pending = DOT_WORDS[word]
+        elif word == "dotted" and not tuplets:
+            dots += pending or 1
+            pending = None
+        elif word == "normal" and not dots and not tuplets and len(words) == 1:
+            pass
+        elif word == "triplet" and pending is None:
+            tuplets.append((3, 2))
+        elif ":" in word and pending is None:
+            count, _, time_of = word.partition(":")
+            if not (count.isdigit() and time_of.isdigit() and int(count) > 0 and int(time_of) > 0):
+                raise ValueError(f"Invalid tuplet {word!r} (use n:m, e.g. 5:4)")
+            tuplets.append((int(count), int(time_of)))
+        else:
+            raise ValueError(f"Unknown modifier {text!r}")
+    if pending is not None or not words or dots > MAX_DOTS:
+        raise ValueError(f"Unknown modifier {text!r}")
+    return dots, tuple(tuplets)
+
+
+def compile_rhythm(denominator, dots=0, tuplets=()):
+    """ID of a 1/denominator note with dots and nested tuplets, compiling it on first use"""
+    key = (denominator, dots, tuple(tuplets))
+    rid = _ids.get(key)
+    if rid is not None:
+        return rid
+    if not (isinstance(denominator, int) and denominator > 0 and 0 <= dots <= MAX_DOTS):
+        raise ValueError(f"Invalid rhythm 1/{denominator} with {dots} dots")
+
+    # Each dot adds half of the previous one: 1.5, 1.75, 1.875 times the plain note
+    exact = Fraction(4, denominator) * (2 - Fraction(1, 2 ** dots))
+    for count, time_of in key[2]:
+        exact *= Fraction(time_of, count)
+
+    rid = len(_keys)
+    _keys.append(key)
+    _fractions.append(exact)
+    _multipliers.append(float(exact))
+    _ids[key] = rid
+    return rid
+
+
+def rhythm_id(note_value, modifier="Normal"):
+    """ID for a note value name and modifier spelling; ValueError if either is unknown"""
+    rid = _named.get((note_value, modifier))
+    if rid is not None:
+        return rid
+    denominator = NOTE_DENOMINATORS.get(note_value)
+    if denominator is None:
+        raise ValueError(f"Unknown note value {note_value!r}")
+    rid = compile_rhythm(denominator, *parse_modifier(modifier))
+    if len(_named) < MAX_NAMED:
+        _named[note_value, modifier] = rid
+    return rid
+
+
+def multiplier(rid):
+    """Multiplier of a rhythm relative to a quarter note"""
+    return _multipliers[rid]
+
+
+def exact_multiplier(rid):
+    """Multiplier of a rhythm as an exact Fraction"""
+    return _fractions[rid]
+
+
+def multiplier_table():
+    """Float multipliers indexed by ID (grows as rhythms are compiled; do not modify)"""
+    return _multipliers
+
+
+def describe(rid):
+    """Short display name: "1/8", "1/8 dotted", "1/16 triplet", "1/16 3:2 5:4" """
+    denominator, dots, tuplets = _keys[rid]
+    words = [f"1/{denominator}"]
+    if dots:
+        words.append(("dotted", "double dotted", "triple dotted")[dots - 1])
+    if tuplets == ((3, 2),):
+        words.append("triplet")
+    else:
+        words.extend(f"{count}:{time_of}" for count, time_of in tuplets)
+    return " ".join(words)
+
+
+# The note values with the GUI's modifiers get the first IDs, in this order, in every process
+for _note_value in NOTE_DENOMINATORS:
+    for _modifier in ("Normal", "Dotted", "Triplet"):
+        rhythm_id(_note_value, _modifier)
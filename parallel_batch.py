@@ -0,0 +1,225 @@
+"""
+Parallel Batch
+Multi-process versions of the batch conversions for jobs too large for one
+core. Array inputs and outputs live in shared memory, and sharded file
+conversions hand their output text back through shared memory, so no
+bulk data is pickled between processes.
+"""
+
+import collections
+import gc
+import multiprocessing
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import batch_mode
+import timing_engine
+
+# Byte size of one file shard handed to a worker
+DEFAULT_SHARD_BYTES = 8 * 1024 * 1024
+
+# Array elements handed to a worker at a time
+DEFAULT_ARRAY_CHUNK = 1 << 20
+
+
+def default_workers():
+    """Worker count used when none is given: one per available core"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def process_pool(workers):
+    """Process pool whose workers share this process's shared memory tracker
+
+    Starting the tracker first means blocks created or attached by workers
+    are tracked in one place and released when the parent unlinks them,
+    instead of each worker's own tracker "cleaning up" blocks still in use.
+    """
+    resource_tracker.ensure_running()
+    # Workers run with cyclic GC off for the same reason as batch_mode.process_stream
+    return multiprocessing.Pool(workers, initializer=gc.disable)
+
+
+# === SHARED ARRAYS ===
+
+class SharedArrays:
+    """A set of equally long float64 arrays in one shared memory block"""
+
+    def __init__(self, names, length, shm_name=None):
+        np = timing_engine.require_numpy()
+        self.names = list(names)
+        self.length = length
+        size = max(8 * length * len(self.names), 1)
+        if shm_name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=shm_name)
+        self.arrays = {
+            name: np.ndarray((length,), dtype=np.float64, buffer=self.shm.buf, offset=8 * length * i)
+            for i, name in enumerate(self.names)
+        }
+
+    def spec(self):
+        """Picklable description used by workers to attach"""
+        return (self.names, self.length, self.shm.name)
+
+    @classmethod
+    def attach(cls, spec):
+        names, length, shm_name = spec
+        return cls(names, length, shm_name)
+
+    def close(self, unlink=False):
+        self.arrays = {}  # Views must go before the buffer can be released
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _array_worker(task):
+    """Compute one index range of a shared-memory job in place"""
+    spec, kind, start, stop = task
+    shared = SharedArrays.attach(spec)
+    try:
+        a = {name: array[start:stop] for name, array in shared.arrays.items()}
+        if kind == "positions":
+            a["milliseconds"][:], a["beats_elapsed"][:] = timing_engine.calculate_positions(
+                a["bpms"], a["numerators"], a["denominators"], a["bars"], a["beats"])
+        else:
+            a["milliseconds"][:] = timing_engine.note_durations_ms(a["bpms"], a["multipliers"])
+        del a
+    finally:
+        shared.close()
+    return stop - start
+
+
+def _run_array_job(kind, inputs, outputs, workers, chunk_size):
+    """Copy inputs into shared memory, fan index ranges out to a pool, copy outputs back"""
+    np = timing_engine.require_numpy()
+    inputs = dict(zip(inputs, np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in inputs.values()))))
+    shape = next(iter(inputs.values())).shape
+    length = int(np.prod(shape))
+
+    shared = SharedArrays(list(inputs) + list(outputs), length)
+    try:
+        for name, values in inputs.items():
+            shared.arrays[name][:] = values.ravel()
+        tasks = [(shared.spec(), kind, start, min(start + chunk_size, length))
+                 for start in range(0, length, chunk_size)]
+
+        workers = workers or default_workers()
+        if workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                _array_worker(task)
+        else:
+            with process_pool(min(workers, len(tasks))) as pool:
+                pool.map(_array_worker, tasks)
+
+        return tuple(shared.arrays[name].reshape(shape).copy() for name in outputs)
+    finally:
+        shared.close(unlink=True)
+
+
+def parallel_calculate_positions(bpms, numerators, denominators, bars, beats, workers=None,
+                                 chunk_size=DEFAULT_ARRAY_CHUNK):
+    """calculate_positions spread over a process pool
+
+    Returns (milliseconds, beats_elapsed) exactly as calculate_positions.
+    """
+    inputs = {"bpms": bpms, "numerators": numerators, "denominators": denominators,
+              "bars": bars, "beats": beats}
+    return _run_array_job("positions", inputs, ["milliseconds", "beats_elapsed"], workers, chunk_size)
+
+
+def parallel_note_durations_ms(bpms, note_multiplier=1.0, workers=None, chunk_size=DEFAULT_ARRAY_CHUNK):
+    """note_durations_ms spread over a process pool"""
+    inputs = {"bpms": bpms, "multipliers": note_multiplier}
+    return _run_array_job("durations", inputs, ["milliseconds"], workers, chunk_size)[0]
+
+
+# === SHARDED FILES ===
+
+def shard_file(path, shard_bytes=DEFAULT_SHARD_BYTES, start=0):
+    """Split a file from start on into (start, end) byte ranges that end on line boundaries"""
+    size = os.path.getsize(path)
+    shards = []
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + shard_bytes, size))
+            f.readline()  # Move to the end of the line the cut falls in
+            end = min(f.tell(), size)
+            shards.append((start, end))
+            start = end
+    return shards
+
+
+def _file_worker(task):
+    """Convert one byte range of the input and leave the output text in shared memory"""
+    path, start, end, input_format, header_line = task
+    with open(path, "rb") as f:
+        f.seek(start)
+        lines = [line for line in f.read(end - start).decode("utf-8").splitlines(keepends=True)
+                 if line.strip()]
+    if not lines:
+        return None, 0, 0
+
+    rows = batch_mode.CSVRows(header_line) if input_format == "csv" else batch_mode.JSONLRows()
+    durations, positions = batch_mode.convert_rows_vectorized(rows.columns(lines), len(lines))
+    text = rows.format_chunk(lines, durations, positions).encode("utf-8")
+
+    shm = shared_memory.SharedMemory(create=True, size=max(len(text), 1))
+    shm.buf[:len(text)] = text
+    name = shm.name
+    shm.close()  # The parent unlinks the block once it has written it out
+    return name, len(text), len(lines)
+
+
+def convert_file_parallel(path, out, input_format=None, workers=None, shard_bytes=DEFAULT_SHARD_BYTES):
+    """Convert a CSV/JSON Lines file on a process pool, writing rows to out in input order
+
+    At most two shards per worker are in flight, so memory stays bounded
+    however large the file is. Returns the number of rows converted.
+    """
+    with open(path, "rb") as f:
+        first_line = f.readline()
+    first_text = first_line.decode("utf-8")
+
+    if input_format is None:
+        input_format = "jsonl" if first_text.lstrip().startswith("{") else "csv"
+    header_line = None
+    data_start = 0
+    if input_format == "csv":
+        # The header stays with the parent; workers get it alongside their byte range
+        header_line = first_text
+        out.write(batch_mode.CSVRows(header_line).output_header(header_line))
+        data_start = len(first_line)
+
+    tasks = ((path, start, end, input_format, header_line)
+             for start, end in shard_file(path, shard_bytes, data_start))
+
+    total = 0
+    workers = workers or default_workers()
+    with process_pool(workers) as pool:
+        in_flight = collections.deque()
+        for task in tasks:
+            in_flight.append(pool.apply_async(_file_worker, (task,)))
+            if len(in_flight) >= 2 * workers:
+                total += _write_shard(in_flight.popleft().get(), out)
+        while in_flight:
+            total += _write_shard(in_flight.popleft().get(), out)
+    return total
+
+
+def _write_shard(result, out):
+    """Write one worker's output text and release its shared memory"""
+    name, size, count = result
+    if name is None:
+        return 0
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        out.write(bytes(shm.buf[:size]).decode("utf-8"))
+    finally:
+        shm.close()
+        shm.unlink()
+    return count
@@ -0,0 +1,374 @@
+"""
+Quantize
+Groove and swing quantization of event timestamps to a note-value grid:
+
+    python bpm_calculator.py quantize takes.npy --bpm 96 --note 1/16 --swing 58 \\
+        [--strength 80] [--window 0.5] [--groove mpc.csv] [-o quantized.npy]
+
+The grid is the click grid of a note value and modifier (see click_grid.py):
+it restarts at every bar line, and the bar line itself is always a target.
+Swing delays every second grid point: at 50% the grid is straight, at 66.7%
+an even pair is played as a triplet. A groove template then shifts each
+grid point of the bar by its own offset (in grid steps) and scales the
+velocity of events snapped to it; templates repeat across the bar.
+
+Each event moves toward the nearest grid point by `strength` (1 snaps
+fully, 0.5 halves the distance), but only if it is within `window` grid
+steps of it. Events are converted to positions within their bar through
+the tempo map, so tempo and time signature changes are followed exactly.
+
+The work is a fixed number of NumPy passes per block of events. Files are
+read a block at a time from a memory map (.npy, raw float64 .f64) or a CSV
+stream, so inputs larger than memory are fine. QuantizeStats accumulates
+the error of every event (signed ms from its grid point, late is positive)
+across blocks.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import sys
+
+from note_registry import exact_multiplier, parse_modifier
+from tempo_map import TempoMap
+from timing_engine import note_id, require_numpy
+
+# Events per block when streaming files
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Sub-beat resolution when locating events in their bar (about 0.03 us at 120 BPM)
+LOCATE_TICKS_PER_BEAT = 1 << 24
+
+STRAIGHT_SWING = 50.0
+
+MIDI_VELOCITY_RANGE = (1, 127)
+
+
+class Groove:
+    """Per-grid-point timing offsets (in grid steps) and velocity scales, repeating every len(offsets) points"""
+
+    def __init__(self, offsets, velocities=None):
+        offsets = [float(offset) for offset in offsets]
+        if not offsets or any(abs(offset) >= 1 for offset in offsets):
+            raise ValueError("A groove needs at least one offset, each less than one grid step")
+        if velocities is not None:
+            velocities = [float(scale) for scale in velocities]
+            if len(velocities) != len(offsets) or any(scale < 0 for scale in velocities):
+                raise ValueError("Groove velocity scales must be non-negative, one per offset")
+        self.offsets = offsets
+        self.velocities = velocities
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        """Read a groove CSV with an `offset` column and an optional `velocity` column"""
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        try:
+            offsets = [row["offset"] for row in rows]
+            velocities = [row["velocity"] for row in rows] if rows and "velocity" in rows[0] else None
+            return cls(offsets, velocities)
+        except (KeyError, TypeError):
+            raise ValueError(f"{path}: a groove needs an 'offset' column")
+
+
+class QuantizeStats:
+    """Running error statistics over every event passed to a Quantizer"""
+
+    __slots__ = ("count", "moved", "total_ms", "total_abs_ms", "total_sq_ms", "max_abs_ms")
+
+    def __init__(self):
+        self.count = 0
+        self.moved = 0
+        self.total_ms = 0.0
+        self.total_abs_ms = 0.0
+        self.total_sq_ms = 0.0
+        self.max_abs_ms = 0.0
+
+    def update(self, np, errors, moved):
+        """Add one block of signed errors (NaN for events off the grid) and the mask of events moved"""
+        errors = errors[~np.isnan(errors)]
+        if len(errors):
+            magnitudes = np.abs(errors)
+            self.count += len(errors)
+            self.total_ms += float(errors.sum())
+            self.total_abs_ms += float(magnitudes.sum())
+            self.total_sq_ms += float(np.dot(errors, errors))
+            self.max_abs_ms = max(self.max_abs_ms, float(magnitudes.max()))
+        self.moved += int(np.count_nonzero(moved))
+
+    def to_dict(self):
+        count = self.count or 1
+        return {
+            "events": self.count,
+            "moved": self.moved,
+            "mean_ms": self.total_ms / count,
+            "mean_abs_ms": self.total_abs_ms / count,
+            "rms_ms": math.sqrt(self.total_sq_ms / count),
+            "max_abs_ms": self.max_abs_ms,
+        }
+
+
+class Quantizer:
+    """Snap event timestamps toward a swung, grooved note-value grid over a tempo map"""
+
+    def __init__(self, tempo_map=None, note_value="Sixteenth Note (1/16)", modifier="Normal",
+                 strength=1.0, swing=STRAIGHT_SWING, window=1.0, groove=None):
+        if not 0 <= strength <= 1:
+            raise ValueError(f"Strength {strength} is outside 0-1")
+        if not 0 < swing < 100:
+            raise ValueError(f"Swing {swing}% is outside 0-100")
+        if window <= 0:
+            raise ValueError(f"Window {window} must be positive")
+        self.tempo_map = tempo_map if tempo_map is not None else TempoMap()
+        # Grid step in quarter notes, exact so bar lengths divide cleanly
+        self.step = exact_multiplier(note_id(note_value, modifier))
+        self.strength = strength
+        self.swing = swing
+        self.window = window
+        self.groove = groove
+        self.stats = QuantizeStats()
+
+    @classmethod
+    def constant(cls, bpm, numerator=4, denominator=4, note_value="Sixteenth Note (1/16)", modifier="Normal",
+                 **options):
+        """Quantizer over a single tempo and time signature"""
+        return cls(TempoMap.constant(bpm, numerator, denominator), note_value, modifier, **options)
+
+    def quantize(self, milliseconds, velocities=None):
+        """Quantize one block of event times; returns (ms, velocities) as new arrays
+
+        Velocities are only changed by a groove with velocity scales, and
+        keep their dtype (integers are rounded and clipped to 1-127).
+        Events before the first bar are left alone and not counted.
+        """
+        np = require_numpy()
+        milliseconds = np.asarray(milliseconds, dtype=np.float64)
+        targets, index = self.targets(milliseconds)
+
+        errors = milliseconds - targets
+        step_ms = self._step_ms(np, milliseconds)
+        moved = np.abs(errors) <= self.window * step_ms  # NaN targets compare False
+        quantized = milliseconds.copy()
+        quantized[moved] -= self.strength * errors[moved]
+        self.stats.update(np, errors, moved)
+
+        if velocities is not None:
+            velocities = np.array(velocities, copy=True)
+            groove = self.groove
+            if groove is not None and groove.velocities is not None:
+                scales = np.asarray(groove.velocities)[index[moved] % len(groove)]
+                original = velocities[moved].astype(np.float64)
+                scaled = original + self.strength * (original * scales - original)
+                if np.issubdtype(velocities.dtype, np.integer):
+                    scaled = np.clip(np.rint(scaled), *MIDI_VELOCITY_RANGE)
+                velocities[moved] = scaled
+        return quantized, velocities
+
+    def quantize_chunks(self, chunks):
+        """Quantize an iterable of ms blocks or (ms, velocities) blocks, yielding (ms, velocities) per block"""
+        for chunk in chunks:
+            if isinstance(chunk, tuple):
+                yield self.quantize(*chunk)
+            else:
+                yield self.quantize(chunk)
+
+    # === GRID ===
+
+    def targets(self, milliseconds):
+        """(nearest grid point in ms, grid index within its bar) for each timestamp
+
+        Targets are NaN (and indexes -1) for events before the first bar.
+        The bar line that ends a bar is index len(grid points), so it maps
+        to the next bar's downbeat.
+        """
+        np = require_numpy()
+        milliseconds = np.asarray(milliseconds, dtype=np.float64)
+        bars, beats, ticks = self.tempo_map.locate_many(milliseconds, LOCATE_TICKS_PER_BEAT)
+        numerators, quarters_per_beat = self._meters(np, bars)
+        offsets = (beats - 1) + ticks / LOCATE_TICKS_PER_BEAT
+
+        # Nearest of the three grid points around the straight nearest one
+        step = float(self.step) / quarters_per_beat
+        nearest = np.rint(offsets / step).astype(np.int64)
+        best = best_distance = None
+        for shift in (-1, 0, 1):
+            index = nearest + shift
+            positions = self._grid_offsets(np, index, step, numerators)
+            distance = np.abs(positions - offsets)
+            if best is None:
+                best, best_distance, best_offsets = index, distance, positions
+            else:
+                closer = distance < best_distance
+                best = np.where(closer, index, best)
+                best_distance = np.where(closer, distance, best_distance)
+                best_offsets = np.where(closer, positions, best_offsets)
+
+        targets = self._bar_offsets_ms(np, bars, best_offsets, numerators)
+        outside = bars < 1
+        targets[outside] = np.nan
+        best[outside] = -1
+        return targets, best
+
+    def _grid_offsets(self, np, index, step, numerators):
+        """Beat offsets from the bar line of grid points (index -1 and below are unreachable)"""
+        pairs = index // 2
+        offsets = (pairs * 2 + (index % 2) * (self.swing / STRAIGHT_SWING)) * step
+        groove = self.groove
+        if groove is not None:
+            offsets = offsets + np.asarray(groove.offsets)[index % len(groove)] * step
+        # Points from the bar line on are the next downbeat
+        offsets = np.where(index * step >= numerators - 1e-9, numerators, np.minimum(offsets, numerators))
+        return np.where(index < 0, -np.inf, offsets)
+
+    def _meters(self, np, bars):
+        """Numerator and quarter notes per beat of each event's bar"""
+        changes = {segment.bar: segment for segment in self.tempo_map}
+        starts = np.array(sorted(changes), dtype=np.int64)
+        numerators = np.array([changes[bar].numerator for bar in starts.tolist()], dtype=np.float64)
+        quarters = np.array([4.0 / changes[bar].denominator for bar in starts.tolist()])
+        index = np.clip(np.searchsorted(starts, bars, side="right") - 1, 0, None)
+        return numerators[index], quarters[index]
+
+    def _step_ms(self, np, milliseconds):
+        """Grid step in ms at each timestamp (for the window test)"""
+        segments = list(self.tempo_map)
+        starts = np.array([self.tempo_map.position_ms(s.bar, s.beat) for s in segments])
+        ms_per_quarter = np.array([60000.0 / s.bpm for s in segments])
+        index = np.clip(np.searchsorted(starts, milliseconds, side="right") - 1, 0, None)
+        return ms_per_quarter[index] * float(self.step)
+
+    def _bar_offsets_ms(self, np, bars, offsets, numerators):
+        """Milliseconds of beat offsets from the bar line, including the bar's last beat"""
+        positions_ms = self.tempo_map.positions_ms
+        next_bar = offsets >= numerators
+        bars = np.where(next_bar, bars + 1, bars)
+        beats = np.where(next_bar, 1.0, offsets + 1)
+        milliseconds = positions_ms(bars, beats)
+        # The calculator stops at beat == numerator, so the last beat is timed
+        # between that beat and the next bar line (no tempo change can start in between)
+        last_beat = np.flatnonzero(np.isnan(milliseconds) & (bars >= 1))
+        if len(last_beat):
+            bars, beats = bars[last_beat], beats[last_beat]
+            whole = np.floor(beats)
+            start = positions_ms(bars, whole)
+            milliseconds[last_beat] = start + (beats - whole) * (positions_ms(bars + 1, 1) - start)
+        return milliseconds
+
+
+# === FILES ===
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield blocks of ms (and velocities, for CSV with a velocity column) from .npy, .f64 or .csv"""
+    np = require_numpy()
+    lower = path.lower()
+    if lower.endswith((".npy", ".f64")):
+        if lower.endswith(".npy"):
+            values = np.load(path, mmap_mode="r")
+        else:
+            values = np.memmap(path, dtype="<f8", mode="r")
+        for start in range(0, len(values), chunk_size):
+            yield np.array(values[start:start + chunk_size], dtype=np.float64)
+        return
+
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        if "ms" not in header:
+            raise ValueError(f"{path}: CSV input needs an 'ms' column")
+        ms_column = header.index("ms")
+        velocity_column = header.index("velocity") if "velocity" in header else None
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                return
+            milliseconds = np.array([row[ms_column] for row in rows], dtype=np.float64)
+            if velocity_column is None:
+                yield milliseconds
+            else:
+                yield milliseconds, np.array([row[velocity_column] for row in rows], dtype=np.int64)
+
+
+def write_chunks(path, blocks):
+    """Write quantized (ms, velocities) blocks to .npy/.f64 (ms only) or CSV; returns the event count"""
+    np = require_numpy()
+    lower = path.lower()
+    written = 0
+    if lower.endswith((".npy", ".f64")):
+        with open(path, "wb") as f:
+            if lower.endswith(".npy"):
+                # The count is only known at the end; the header is the same size for any count
+                np.lib.format.write_array_header_1_0(f, {"descr": "<f8", "fortran_order": False, "shape": (0,)})
+            for milliseconds, _ in blocks:
+                f.write(milliseconds.astype("<f8", copy=False).tobytes())
+                written += len(milliseconds)
+            if lower.endswith(".npy"):
+                f.seek(0)
+                np.lib.format.write_array_header_1_0(f, {"descr": "<f8", "fortran_order": False,
+                                                         "shape": (written,)})
+        return written
+
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        header_written = False
+        for milliseconds, velocities in blocks:
+            if not header_written:
+                out.write("ms,velocity\n" if velocities is not None else "ms\n")
+                header_written = True
+            if velocities is None:
+                out.write("".join(map("{!r}\n".format, milliseconds.tolist())))
+            else:
+                out.write("".join(map("{!r},{}\n".format, milliseconds.tolist(), velocities.tolist())))
+            written += len(milliseconds)
+    return written
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py quantize`"""
+    import batch_mode
+
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py quantize",
+                                     description="Quantize event timestamps (ms) to a swung note-value grid")
+    parser.add_argument("input", help=".npy or .f64 (float64 ms) or .csv with 'ms' and optional 'velocity' columns")
+    parser.add_argument("--bpm", type=float, required=True)
+    parser.add_argument("--time-signature", default="4/4")
+    parser.add_argument("--note", default="1/16", help="grid note value (1/8, eighth, quaver, ...)")
+    parser.add_argument("--modifier", default="Normal", help="Normal, Dotted, Triplet, 5:4, ...")
+    parser.add_argument("--strength", type=float, default=100.0, help="percent of the distance moved (default 100)")
+    parser.add_argument("--swing", type=float, default=STRAIGHT_SWING, help="percent (50 is straight)")
+    parser.add_argument("--window", type=float, default=1.0, help="only move events within this many grid steps")
+    parser.add_argument("--groove", help="groove CSV with 'offset' (grid steps) and optional 'velocity' columns")
+    parser.add_argument("-o", "--output", help="output file (same formats as the input); statistics only if omitted")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    numerator, denominator = batch_mode.parse_time_signature(args.time_signature)
+    note_value = batch_mode.NOTE_ALIASES.get(args.note.strip().lower())
+    try:
+        if numerator is None or numerator <= 0 or denominator <= 0:
+            raise ValueError(f"Invalid time signature {args.time_signature!r}")
+        if note_value is None:
+            raise ValueError(f"Unknown note value {args.note!r}")
+        parse_modifier(args.modifier)  # ValueError for unknown spellings
+        groove = Groove.load(args.groove) if args.groove else None
+        quantizer = Quantizer.constant(args.bpm, numerator, denominator, note_value, args.modifier.strip(),
+                                       strength=args.strength / 100.0, swing=args.swing, window=args.window,
+                                       groove=groove)
+        blocks = quantizer.quantize_chunks(read_chunks(args.input, args.chunk_size))
+        if args.output:
+            write_chunks(args.output, blocks)
+        else:
+            for _ in blocks:
+                pass
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(quantizer.stats.to_dict()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+Sample Grid
+Drift-free bar/beat to sample offset conversion for long timelines.
+
+Positions are counted in exact integer ticks (PPQ, ticks per quarter note)
+and tempos are exact rationals, so the only rounding is the final one to
+the nearest sample (ties to even, like numpy.rint). The batch path does
+this with int64 arithmetic only; where the float path's result is exact,
+both give the same sample.
+
+    grid = SampleGrid(tempo_map, sample_rate=48000)
+    grid.sample_offset(50000, 3)                    # int
+    grid.sample_offsets(bars, beats, out=buffer)    # int64 array or array('q')
+
+A grid is a snapshot of its tempo map; build a new one after editing the map.
+"""
+
+from bisect import bisect_right
+from fractions import Fraction
+import math
+
+from tempo_map import TempoMap
+from note_registry import exact_multiplier
+from timing_engine import note_id, require_numpy
+
+DEFAULT_SAMPLE_RATE = 48000
+
+# Divisible by 3 (triplets) and by 2**6, so every note value with the GUI's modifiers is a whole number of ticks
+DEFAULT_PPQ = 960
+
+# Decimal places kept when a float BPM is read as an exact tempo (120.125 -> 961/8)
+BPM_DENOMINATOR_LIMIT = 10 ** 6
+
+_INT64_MAX = 2 ** 63 - 1
+
+
+def exact_bpm(bpm):
+    """A BPM as an exact Fraction, reading floats by their shortest decimal form"""
+    if isinstance(bpm, (int, Fraction)):
+        return Fraction(bpm)
+    return Fraction(repr(float(bpm))).limit_denominator(BPM_DENOMINATOR_LIMIT)
+
+
+def note_ticks(note_value, modifier="Normal", ppq=DEFAULT_PPQ):
+    """Length of a note value in ticks; ValueError if it is not a whole number of ticks"""
+    ticks = exact_multiplier(note_id(note_value, modifier)) * ppq
+    if ticks.denominator != 1:
+        raise ValueError(f"{modifier} {note_value} is not a whole number of ticks at {ppq} PPQ")
+    return int(ticks)
+
+
+class SampleGrid:
+    """Exact tick and sample positions over a tempo map"""
+
+    def __init__(self, tempo_map=None, sample_rate=DEFAULT_SAMPLE_RATE, ppq=DEFAULT_PPQ):
+        self.tempo_map = tempo_map if tempo_map is not None else TempoMap()
+        self.sample_rate = int(sample_rate)
+        self.ppq = int(ppq)
+        if self.sample_rate <= 0 or self.ppq <= 0:
+            raise ValueError("Sample rate and PPQ must be positive")
+
+        self.segments = list(self.tempo_map)
+        self._bars = [segment.bar for segment in self.segments]
+        self._ticks_per_beat = []
+        self._start_ticks = []
+        self._start_samples = []
+        self._samples_per_tick = []
+        for i, segment in enumerate(self.segments):
+            ticks_per_beat = Fraction(4 * self.ppq, segment.denominator)
+            if ticks_per_beat.denominator != 1:
+                raise ValueError(f"PPQ {self.ppq} does not divide a 1/{segment.denominator} beat into whole ticks")
+            self._ticks_per_beat.append(int(ticks_per_beat))
+            # One tick lasts 60 * sample_rate / (bpm * ppq) samples
+            self._samples_per_tick.append(Fraction(60 * self.sample_rate) / (exact_bpm(segment.bpm) * self.ppq))
+
+            if i == 0:
+                self._start_ticks.append(0)
+                self._start_samples.append(Fraction(0))
+            else:
+                previous = self.segments[i - 1]
+                beats = (segment.bar - previous.bar) * previous.numerator + (segment.beat - previous.beat)
+                ticks = _whole(beats) * self._ticks_per_beat[i - 1]
+                self._start_ticks.append(self._start_ticks[-1] + ticks)
+                self._start_samples.append(self._start_samples[-1] + ticks * self._samples_per_tick[i - 1])
+        self._tables = None
+
+    @classmethod
+    def constant(cls, bpm, numerator=4, denominator=4, sample_rate=DEFAULT_SAMPLE_RATE, ppq=DEFAULT_PPQ):
+        """Grid with a single tempo and time signature"""
+        return cls(TempoMap.constant(bpm, numerator, denominator), sample_rate, ppq)
+
+    # === SCALAR API ===
+
+    def tick_position(self, bar, beat, tick=0):
+        """Absolute tick of bar/beat plus tick, or None if it is out of range"""
+        bar, beat, tick = _whole(bar), _whole(beat), _whole(tick)
+        if bar <= 0 or beat <= 0 or tick < 0:
+            return None
+        # Meter changes start on beat 1, so the bar's meter comes from the last segment starting in or before it
+        index = max(bisect_right(self._bars, bar) - 1, 0)
+        segment = self.segments[index]
+        ticks_per_beat = self._ticks_per_beat[index]
+        if beat > segment.numerator or tick >= ticks_per_beat:
+            return None
+        beats = (bar - segment.bar) * segment.numerator + (beat - segment.beat)
+        return self._start_ticks[index] + beats * ticks_per_beat + tick
+
+    def sample_at_tick(self, ticks):
+        """Nearest sample to an absolute tick (ties to even)"""
+        index = max(bisect_right(self._start_ticks, ticks) - 1, 0)
+        return round(self._start_samples[index] + (ticks - self._start_ticks[index]) * self._samples_per_tick[index])
+
+    def sample_offset(self, bar, beat, tick=0):
+        """Nearest sample to bar/beat plus tick, or None if it is out of range"""
+        ticks = self.tick_position(bar, beat, tick)
+        return None if ticks is None else self.sample_at_tick(ticks)
+
+    # === BATCH API ===
+
+    def _segment_tables(self):
+        """Per-segment integer constants for the int64 batch path
+
+        Each segment's start is split into whole samples plus a fraction f,
+        and its samples per tick into N/D. Adding f and the remainder r/D of
+        a position's offset then only needs comparisons of r against the
+        points where f + r/D crosses 1/2 and 3/2.
+        """
+        if self._tables is None:
+            np = require_numpy()
+            columns = {name: [] for name in ("start_ticks", "tick_bars", "numerators", "ticks_per_beat",
+                                             "whole_start", "N", "D", "above_half", "tie_half",
+                                             "above_three_halves", "tie_three_halves")}
+            for i, segment in enumerate(self.segments):
+                samples_per_tick = self._samples_per_tick[i]
+                N, D = samples_per_tick.numerator, samples_per_tick.denominator
+                if N * D > _INT64_MAX:
+                    raise ValueError(f"Tempo {segment.bpm} at {self.sample_rate} Hz and {self.ppq} PPQ "
+                                     f"is too fine-grained for int64 arithmetic")
+                start = self._start_samples[i]
+                whole_start = math.floor(start)
+                fraction = start - whole_start
+                for name, crossing in (("half", Fraction(1, 2)), ("three_halves", Fraction(3, 2))):
+                    point = (crossing - fraction) * D
+                    columns[f"above_{name}"].append(math.floor(point) + 1)
+                    columns[f"tie_{name}"].append(int(point) if point.denominator == 1 else -1)
+
+                columns["start_ticks"].append(self._start_ticks[i])
+                # Tick of beat 1 of the segment's first bar, for bar/beat to tick conversion
+                columns["tick_bars"].append(self._start_ticks[i] - (_whole(segment.beat) - 1) * self._ticks_per_beat[i])
+                columns["numerators"].append(segment.numerator)
+                columns["ticks_per_beat"].append(self._ticks_per_beat[i])
+                columns["whole_start"].append(whole_start)
+                columns["N"].append(N)
+                columns["D"].append(D)
+
+            self._tables = {name: np.array(values, dtype=np.int64) for name, values in columns.items()}
+            self._tables["bars"] = np.array(self._bars, dtype=np.int64)
+        return self._tables
+
+    def tick_positions(self, bars, beats, ticks=0):
+        """Vectorized tick_position as an int64 array; ValueError if any position is out of range"""
+        np = require_numpy()
+        tables = self._segment_tables()
+        bars, beats, ticks = (_int64_array(np, values) for values in (bars, beats, ticks))
+
+        positions = self._sorted_tick_positions(np, bars, beats, ticks)
+        if positions is not None:
+            return positions
+
+        bars, beats, ticks = np.broadcast_arrays(bars, beats, ticks)
+        index = np.maximum(np.searchsorted(tables["bars"], bars, side="right") - 1, 0)
+        numerators = tables["numerators"][index]
+        ticks_per_beat = tables["ticks_per_beat"][index]
+
+        invalid = (bars <= 0) | (beats <= 0) | (beats > numerators) | (ticks < 0) | (ticks >= ticks_per_beat)
+        if invalid.any():
+            raise ValueError("Some positions are outside their bar")
+        return (tables["tick_bars"][index]
+                + ((bars - tables["bars"][index]) * numerators + (beats - 1)) * ticks_per_beat + ticks)
+
+    def _sorted_tick_positions(self, np, bars, beats, ticks):
+        """tick_positions one meter run at a time with scalar constants
+
+        Applies to single-segment grids and to ascending bars; returns None
+        otherwise. Range checks are reductions rather than masks.
+        """
+        shape = np.broadcast_shapes(bars.shape, beats.shape, ticks.shape)
+        size = math.prod(shape)
+        # Single values stay scalars instead of being expanded to full arrays
+        bars, beats, ticks = (values if values.ndim == 0 else np.broadcast_to(values, shape).ravel()
+                              for values in (bars, beats, ticks))
+        if len(self.segments) == 1:
+            bounds = [0, size]
+        else:
+            if bars.ndim == 0 or (size > 1 and not (bars[1:] >= bars[:-1]).all()):
+                return None
+            bounds = [0, *np.searchsorted(bars, self._bars[1:], side="left").tolist(), size]
+
+        tables = self._segment_tables()
+        positions = np.empty(size, dtype=np.int64)
+        for i, (start, stop) in enumerate(zip(bounds, bounds[1:])):
+            if start >= stop:
+                continue
+            run_bars, run_beats, run_ticks = (values if values.ndim == 0 else values[start:stop]
+                                              for values in (bars, beats, ticks))
+            numerator, ticks_per_beat = self.segments[i].numerator, self._ticks_per_beat[i]
+            if (run_bars.min() <= 0 or run_beats.min() <= 0 or run_beats.max() > numerator
+                    or run_ticks.min() < 0 or run_ticks.max() >= ticks_per_beat):
+                raise ValueError("Some positions are outside their bar")
+            run = positions[start:stop]
+            np.multiply(run_bars, numerator * ticks_per_beat, out=run)
+            run += run_beats * ticks_per_beat
+            if run_ticks.ndim or run_ticks:
+                run += run_ticks
+            run += int(tables["tick_bars"][i]) - (self._bars[i] * numerator + 1) * ticks_per_beat
+        return positions.reshape(shape)
+
+    def samples_at_ticks(self, ticks, out=None):
+        """Vectorized sample_at_tick on int64 arrays
+
+        out may be any writable int64 buffer (a NumPy array or an
+        array('q')); results are written into it and it is returned.
+        """
+        np = require_numpy()
+        ticks = _int64_array(np, ticks)
+        if ticks.min(initial=0) < 0:
+            raise ValueError("Tick positions must not be negative")
+
+        samples = self._sorted_samples(np, ticks)
+        if samples is None:
+            samples = self._segment_samples(np, ticks)
+
+        if out is None:
+            return samples
+        target = out if isinstance(out, np.ndarray) else np.frombuffer(out, dtype=np.int64)
+        target.reshape(samples.shape)[...] = samples
+        return out
+
+    def _sorted_samples(self, np, ticks):
+        """Samples computed one segment run at a time with scalar constants
+
+        Applies to single-segment grids and to ascending ticks (where each
+        segment's ticks are one contiguous run). Returns None when neither
+        holds or int64 could overflow.
+        """
+        if len(self.segments) == 1:
+            bounds = [0, ticks.size]
+        else:
+            flat = ticks.ravel()
+            if flat.size > 1 and not (flat[1:] >= flat[:-1]).all():
+                return None
+            bounds = [0, *np.searchsorted(flat, self._start_ticks[1:], side="left").tolist(), flat.size]
+
+        runs = []
+        for i, (start, stop) in enumerate(zip(bounds, bounds[1:])):
+            if start < stop:
+                run = self._run_samples(np, ticks.ravel()[start:stop], i)
+                if run is None:
+                    return None
+                runs.append(run)
+        if len(runs) == 1:
+            return runs[0].reshape(ticks.shape)
+        return np.concatenate(runs).reshape(ticks.shape) if runs else np.zeros(ticks.shape, dtype=np.int64)
+
+    def _run_samples(self, np, ticks, index):
+        """Samples for ticks inside one segment, or None if int64 could overflow
+
+        The segment start's fraction of a sample and the samples per tick
+        share a denominator L, giving start + local * spt = whole + (A + B * local) / L.
+        Rounding that is floor((2 * (A + B * local) + L) / 2L), with exact
+        ties (only possible for even L) moved back to the even neighbour.
+        """
+        start = self._start_samples[index]
+        whole_start = math.floor(start)
+        fraction = start - whole_start
+        samples_per_tick = self._samples_per_tick[index]
+        L = fraction.denominator * samples_per_tick.denominator // math.gcd(fraction.denominator,
+                                                                          samples_per_tick.denominator)
+        A = int(fraction * L)
+        B = int(samples_per_tick * L)
+        first_tick = self._start_ticks[index]
+        # A sorted run's largest tick is its last; single-segment runs may be in any order
+        largest = int(ticks[-1]) if len(self.segments) > 1 else int(ticks.max())
+        if (largest - first_tick) * 2 * B + 2 * A + L > _INT64_MAX:
+            return None
+
+        numerators = (ticks - first_tick if first_tick else ticks) * (2 * B)
+        numerators += 2 * A + L
+        samples = numerators // (2 * L)
+        if L % 2 == 0:
+            numerators -= samples * (2 * L)
+            # Parity of the final sample, which includes whole_start
+            samples -= (numerators == 0) & ((samples + whole_start) & 1 == 1)
+        if whole_start:
+            samples += whole_start
+        return samples
+
+    def _segment_samples(self, np, ticks):
+        """Samples over any tempo map and tick order, with per-element segment constants"""
+        tables = self._segment_tables()
+        index = np.searchsorted(tables["start_ticks"], ticks, side="right") - 1
+        local_ticks = ticks - tables["start_ticks"][index]
+        N, D = tables["N"][index], tables["D"][index]
+
+        # local_ticks * N / D without overflowing: split off whole multiples of D first
+        quotient, remainder = np.divmod(local_ticks, D)
+        carry, remainder = np.divmod(remainder * N, D)
+        base = tables["whole_start"][index] + quotient * N + carry
+
+        # Round start fraction + remainder / D to nearest, ties to even
+        odd = base & 1
+        return (base + (remainder >= tables["above_half"][index])
+                + (remainder >= tables["above_three_halves"][index])
+                + ((remainder == tables["tie_half"][index]) & (odd == 1))
+                + ((remainder == tables["tie_three_halves"][index]) & (odd == 0)))
+
+    def sample_offsets(self, bars, beats, ticks=0, out=None):
+        """Vectorized sample_offset; see samples_at_ticks for out"""
+        return self.samples_at_ticks(self.tick_positions(bars, beats, ticks), out=out)
+
+
+def _whole(value):
+    """An integer-valued number as int"""
+    if value != int(value):
+        raise ValueError(f"{value!r} is not a whole number")
+    return int(value)
+
+
+def _int64_array(np, values):
+    array = np.asarray(values)
+    if array.dtype.kind == "f":
+        if not np.array_equal(array, np.floor(array)):
+            raise ValueError("Bars, beats and ticks must be whole numbers")
+    return array.astype(np.int64, copy=False)
@@ -0,0 +1,156 @@
+"""
+Tap Tempo
+Tempo and beat phase from tapped beats, updated in constant time per tap.
+
+Each tap is numbered with the beat it falls on and the estimate is the
+least-squares line through (beat number, time) over the last few taps.
+The line's slope is the beat period and its intercept gives the phase.
+The fit is kept as running integer sums, so adding a tap (and dropping the
+oldest one from the window) is O(1). Integer nanoseconds keep the sums exact.
+
+    taps = TapTempo()
+    taps.tap()            # None until there are two taps
+    bpm = taps.tap()      # float BPM
+    taps.next_beat_ns()   # perf_counter_ns() time of the next predicted beat
+
+Taps that do not fit the current tempo are rejected: a tap much too early
+is a double trigger and is ignored, and a tap one or two beats late counts
+as a skipped beat. Two rejected taps in a row mean the tempo has changed,
+and the estimate restarts from them. A pause longer than TIMEOUT_NS starts
+a new run.
+"""
+
+import collections
+import time
+
+# Taps in the rolling fit
+DEFAULT_WINDOW = 16
+
+# A tap is accepted if it lands within this fraction of a beat of the prediction
+DEFAULT_TOLERANCE = 0.15
+
+# A pause this long (or longer than MAX_BEAT_GAP beats) starts a new run
+TIMEOUT_NS = 2_000_000_000
+
+# Accepted tap intervals in beats: 1, or 2 when a beat was skipped
+MAX_BEAT_GAP = 2
+
+# Taps closer together than this are contact bounce or key repeat (1000 BPM)
+MIN_INTERVAL_NS = 60_000_000
+
+
+class TapTempo:
+    """Rolling least-squares tempo and phase estimate from tap timestamps"""
+
+    def __init__(self, window=DEFAULT_WINDOW, tolerance=DEFAULT_TOLERANCE, timeout_ns=TIMEOUT_NS):
+        if window < 2:
+            raise ValueError("The tap window must hold at least 2 taps")
+        self.window = window
+        self.tolerance = tolerance
+        self.timeout_ns = timeout_ns
+        self.reset()
+
+    def reset(self):
+        """Forget all taps"""
+        self._taps = collections.deque()   # (beat number, ns since origin)
+        self._origin = None
+        self._last_ns = None
+        self._rejected = None
+        self._n = self._sk = self._skk = self._st = self._skt = 0
+        self.period_ns = None
+
+    @property
+    def count(self):
+        """Number of taps in the current fit"""
+        return self._n
+
+    @property
+    def bpm(self):
+        """Current tempo estimate, or None before the second tap"""
+        return None if self.period_ns is None else 60e9 / self.period_ns
+
+    def tap(self, now_ns=None):
+        """Record a tap at now_ns (default: time.perf_counter_ns()) and return the BPM estimate"""
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        last_ns = self._last_ns
+        if last_ns is None or now_ns - last_ns > self.timeout_ns:
+            self._restart(now_ns)
+            return None
+        interval = now_ns - last_ns
+        if interval < MIN_INTERVAL_NS:
+            return self.bpm
+
+        period = self.period_ns
+        if period is None:
+            beats = 1
+        else:
+            beats = round(interval / period)
+            if beats > MAX_BEAT_GAP:
+                self._restart(now_ns)
+                return None
+            if beats == 0 or abs(interval - beats * period) > self.tolerance * period:
+                return self._reject(now_ns)
+
+        self._rejected = None
+        self._add(self._taps[-1][0] + beats, now_ns)
+        return self.bpm
+
+    def beat_ns(self, beat):
+        """perf_counter_ns() time of a beat number on the fitted line"""
+        n, sk, st = self._n, self._sk, self._st
+        # Intercept of the least-squares line: mean time minus slope times mean beat
+        return self._origin + (st - self.period_ns * sk) / n + self.period_ns * beat
+
+    def phase_ns(self):
+        """Fitted time of the most recent tapped beat, or None before the second tap"""
+        if self.period_ns is None:
+            return None
+        return self.beat_ns(self._taps[-1][0])
+
+    def next_beat_ns(self, now_ns=None):
+        """Predicted time of the first beat after now_ns, or None before the second tap"""
+        if self.period_ns is None:
+            return None
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        latest = self.phase_ns()
+        beats = max(0, (now_ns - latest) // self.period_ns + 1)
+        return latest + beats * self.period_ns
+
+    def _restart(self, now_ns, first_ns=None):
+        """Start a new run at now_ns, optionally preceded by a tap at first_ns"""
+        self.reset()
+        self._origin = now_ns if first_ns is None else first_ns
+        if first_ns is not None:
+            self._add(0, first_ns)
+        self._add(self._n, now_ns)
+
+    def _reject(self, now_ns):
+        """Handle a tap that does not fit; a second one in a row restarts at the new tempo"""
+        rejected, self._rejected = self._rejected, now_ns
+        if rejected is not None:
+            self._restart(now_ns, rejected)
+        return self.bpm
+
+    def _add(self, beat, now_ns):
+        """Add a tap to the running sums, dropping the oldest one when the window is full"""
+        t = now_ns - self._origin
+        self._taps.append((beat, t))
+        self._n += 1
+        self._sk += beat
+        self._skk += beat * beat
+        self._st += t
+        self._skt += beat * t
+        if self._n > self.window:
+            old_beat, old_t = self._taps.popleft()
+            self._n -= 1
+            self._sk -= old_beat
+            self._skk -= old_beat * old_beat
+            self._st -= old_t
+            self._skt -= old_beat * old_t
+        self._last_ns = now_ns
+
+        n = self._n
+        if n >= 2:
+            self.period_ns = (n * self._skt - self._sk * self._st) / (n * self._skk - self._sk * self._sk)
@@ -0,0 +1,381 @@
+"""
+Tempo Map
+Bar/beat to millisecond lookup across tempo and time signature changes.
+
+A tempo map is an ordered list of segments, each starting at a bar/beat with
+its own BPM and time signature. Cumulative milliseconds and quarter notes are
+precomputed per segment so a position query is a binary search plus one
+multiply-add, using the same beat semantics as calculate_position. The
+inverse queries turn millisecond (or sample) timestamps back into bar, beat
+and sub-beat tick.
+"""
+
+from bisect import bisect_right
+import math
+
+import instrumentation
+from timing_engine import require_numpy
+
+
+# Sub-beat resolution used by the inverse queries
+DEFAULT_TICKS_PER_BEAT = 960
+
+
+class TempoSegment:
+    """One tempo/meter region starting at a bar and beat"""
+
+    __slots__ = ('bar', 'beat', 'bpm', 'numerator', 'denominator')
+
+    def __init__(self, bar, beat, bpm, numerator, denominator):
+        self.bar = bar
+        self.beat = beat
+        self.bpm = bpm
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def __repr__(self):
+        return (f"TempoSegment(bar={self.bar}, beat={self.beat}, bpm={self.bpm}, "
+                f"time_signature={self.numerator}/{self.denominator})")
+
+    @property
+    def ms_per_beat(self):
+        """Milliseconds per beat of this segment's time signature"""
+        return ((60.0 / self.bpm) * 1000.0) * (4.0 / self.denominator)
+
+
+class TempoMap:
+    """Ordered tempo/meter segments with prefix sums for O(log n) lookup"""
+
+    def __init__(self, segments=None):
+        """Create a tempo map from (bar, beat, bpm, numerator, denominator) tuples
+
+        Defaults to a single 120 BPM 4/4 segment. The first segment must
+        start at bar 1, beat 1.
+        """
+        self._segments = []
+        for segment in segments or [(1, 1, 120.0, 4, 4)]:
+            self._segments.append(self._validated(TempoSegment(*segment)))
+        self._segments.sort(key=lambda s: (s.bar, s.beat))
+
+        for i in range(len(self._segments)):
+            self._check_neighbours(i)
+
+        # Prefix sums are recomputed lazily from the first dirty segment onwards
+        self._keys = []
+        self._bars = []
+        self._start_ms = []
+        self._start_quarters = []
+        self._dirty_from = 0
+        self._arrays = None
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __iter__(self):
+        return iter(self._segments)
+
+    def __getitem__(self, index):
+        return self._segments[index]
+
+    @classmethod
+    def constant(cls, bpm, numerator=4, denominator=4):
+        """Tempo map with a single tempo and time signature"""
+        return cls([(1, 1, bpm, numerator, denominator)])
+
+    # === EDITING ===
+
+    def insert(self, bar, beat, bpm, numerator=None, denominator=None):
+        """Insert (or replace) a change at bar/beat and return its index
+
+        Missing time signature values are inherited from the segment in
+        effect at that position.
+        """
+        previous = self._segments[self.segment_index(bar, 1) if bar >= 1 else 0]
+        numerator = previous.numerator if numerator is None else numerator
+        denominator = previous.denominator if denominator is None else denominator
+        segment = self._validated(TempoSegment(bar, beat, bpm, numerator, denominator))
+
+        position = (bar, beat)
+        index = bisect_right([(s.bar, s.beat) for s in self._segments], position)
+        if index and (self._segments[index - 1].bar, self._segments[index - 1].beat) == position:
+            index -= 1
+            replaced = self._segments[index]
+            self._segments[index] = segment
+        else:
+            replaced = None
+            self._segments.insert(index, segment)
+
+        try:
+            self._check_neighbours(index)
+        except ValueError:
+            if replaced is None:
+                del self._segments[index]
+            else:
+                self._segments[index] = replaced
+            raise
+        self._invalidate(index)
+        return index
+
+    def update(self, index, bpm=None, numerator=None, denominator=None):
+        """Change the tempo and/or time signature of an existing segment"""
+        old = self._segments[index]
+        segment = self._validated(TempoSegment(
+            old.bar, old.beat,
+            old.bpm if bpm is None else bpm,
+            old.numerator if numerator is None else numerator,
+            old.denominator if denominator is None else denominator))
+        self._segments[index] = segment
+        try:
+            self._check_neighbours(index)
+        except ValueError:
+            self._segments[index] = old
+            raise
+        self._invalidate(index)
+
+    def remove(self, index):
+        """Remove a segment (the first segment cannot be removed)"""
+        if index == 0 or index == -len(self._segments):
+            raise ValueError("The first tempo segment cannot be removed")
+        if index < 0:
+            index += len(self._segments)
+        removed = self._segments.pop(index)
+        try:
+            if index < len(self._segments):
+                self._check_neighbours(index)
+        except ValueError:
+            self._segments.insert(index, removed)
+            raise
+        self._invalidate(index)
+
+    def _validated(self, segment):
+        """Raise ValueError for segments calculate_position would reject"""
+        if (segment.numerator <= 0 or segment.denominator <= 0 or segment.bar <= 0
+                or segment.beat <= 0 or segment.bpm <= 0):
+            raise ValueError(f"Invalid tempo segment: {segment!r}")
+        if segment.beat > segment.numerator:
+            raise ValueError(f"Beat {segment.beat} is outside a {segment.numerator}-beat bar")
+        return segment
+
+    def _check_neighbours(self, index):
+        """Check the segment at index against the segments either side of it"""
+        segments = self._segments
+        if index == 0 and (segments[0].bar, segments[0].beat) != (1, 1):
+            raise ValueError("The first tempo segment must start at bar 1, beat 1")
+
+        for i in (index, index + 1):
+            if 0 < i < len(segments):
+                previous, segment = segments[i - 1], segments[i]
+                if (previous.bar, previous.beat) == (segment.bar, segment.beat):
+                    raise ValueError(f"Duplicate tempo segment at bar {segment.bar}, beat {segment.beat}")
+                # A bar has one time signature, so meter changes start on beat 1
+                if (segment.bar == previous.bar or segment.beat != 1) and \
+                        (segment.numerator, segment.denominator) != (previous.numerator, previous.denominator):
+                    raise ValueError(f"Time signature change at bar {segment.bar}, beat {segment.beat} "
+                                     f"must start on beat 1")
+
+    def _invalidate(self, index):
+        """Mark prefix sums from index onwards as stale"""
+        self._dirty_from = min(self._dirty_from, index)
+        self._arrays = None
+
+    def _refresh(self):
+        """Recompute prefix sums downstream of the first changed segment"""
+        start = self._dirty_from
+        count = len(self._segments)
+        if start >= count and len(self._keys) == count:
+            return
+
+        del self._keys[start:], self._bars[start:], self._start_ms[start:], self._start_quarters[start:]
+        for i in range(start, count):
+            segment = self._segments[i]
+            if i == 0:
+                start_ms = 0.0
+                start_quarters = 0.0
+            else:
+                previous = self._segments[i - 1]
+                beats = (segment.bar - previous.bar) * previous.numerator + (segment.beat - previous.beat)
+                start_ms = self._start_ms[i - 1] + beats * previous.ms_per_beat
+                start_quarters = self._start_quarters[i - 1] + beats * (4.0 / previous.denominator)
+
+            self._keys.append(segment.bar + (segment.beat - 1) / segment.numerator)
+            self._bars.append(segment.bar)
+            self._start_ms.append(start_ms)
+            self._start_quarters.append(start_quarters)
+
+        self._dirty_from = count
+
+    def _segment_arrays(self):
+        """NumPy copies of the segment tables for the batch paths"""
+        self._refresh()
+        if self._arrays is None:
+            np = require_numpy()
+            segments = self._segments
+            self._arrays = {
+                'bars': np.array(self._bars, dtype=np.float64),
+                'beats': np.array([s.beat for s in segments], dtype=np.float64),
+                'keys': np.array(self._keys, dtype=np.float64),
+                'numerators': np.array([s.numerator for s in segments], dtype=np.float64),
+                'ms_per_beat': np.array([s.ms_per_beat for s in segments], dtype=np.float64),
+                'start_ms': np.array(self._start_ms, dtype=np.float64),
+            }
+        return self._arrays
+
+    # === QUERIES ===
+
+    def segment_index(self, bar, beat):
+        """Index of the segment in effect at bar/beat"""
+        self._refresh()
+        # The bar's time signature comes from the last segment starting at or before it
+        numerator = self._segments[max(bisect_right(self._bars, bar) - 1, 0)].numerator
+        return max(bisect_right(self._keys, bar + (beat - 1) / numerator) - 1, 0)
+
+    def position_ms(self, bar, beat):
+        """Millisecond position of bar/beat, or None if it is out of range"""
+        if bar <= 0 or beat <= 0:
+            return None
+        index = self.segment_index(bar, beat)
+        segment = self._segments[index]
+        if beat > segment.numerator:
+            return None
+
+        beats = (bar - segment.bar) * segment.numerator + (beat - segment.beat)
+        return self._start_ms[index] + beats * segment.ms_per_beat
+
+    def positions_ms(self, bars, beats, assume_sorted=False):
+        """Vectorized position_ms; out-of-range positions are NaN
+
+        With assume_sorted=True the queries must be in ascending bar/beat
+        order, and segment boundaries are merged into them instead of
+        searching once per query.
+        """
+        np = require_numpy()
+        tables = self._segment_arrays()
+        bars, beats = np.broadcast_arrays(np.asarray(bars, dtype=np.float64),
+                                          np.asarray(beats, dtype=np.float64))
+        shape = bars.shape
+        bars = bars.ravel()
+        beats = beats.ravel()
+
+        if assume_sorted:
+            bar_index = _merge_index(bars, tables['bars'], np)
+        else:
+            bar_index = np.searchsorted(tables['bars'], bars, side='right') - 1
+        np.clip(bar_index, 0, None, out=bar_index)
+        numerators = tables['numerators'][bar_index]
+
+        # Clamp beats into the bar so keys stay ordered even for invalid queries
+        with np.errstate(divide='ignore', invalid='ignore'):
+            keys = bars + (np.clip(beats, 1, numerators) - 1) / numerators
+        if assume_sorted:
+            index = _merge_index(keys, tables['keys'], np)
+        else:
+            index = np.searchsorted(tables['keys'], keys, side='right') - 1
+        np.clip(index, 0, None, out=index)
+
+        numerators = tables['numerators'][index]
+        elapsed = (bars - tables['bars'][index]) * numerators + (beats - tables['beats'][index])
+        milliseconds = tables['start_ms'][index] + elapsed * tables['ms_per_beat'][index]
+
+        valid = (bars > 0) & (beats > 0) & (beats <= numerators)
+        return np.where(valid, milliseconds, np.nan).reshape(shape)
+
+    # === INVERSE QUERIES ===
+
+    def locate_ms(self, milliseconds, ticks_per_beat=DEFAULT_TICKS_PER_BEAT, sample_rate=None):
+        """Bar, beat and tick at a timestamp, or None for negative times
+
+        Timestamps are milliseconds, or samples when sample_rate is given.
+        The result is rounded to the nearest tick.
+        """
+        if sample_rate is not None:
+            milliseconds = milliseconds * 1000.0 / sample_rate
+        if milliseconds < 0:
+            return None
+
+        self._refresh()
+        index = max(bisect_right(self._start_ms, milliseconds) - 1, 0)
+        return self._locate_in_segment(index, milliseconds, ticks_per_beat)
+
+    def _locate_in_segment(self, index, milliseconds, ticks_per_beat):
+        """Split a timestamp inside a known segment into (bar, beat, tick)"""
+        segment = self._segments[index]
+        offset = (segment.beat - 1) + (milliseconds - self._start_ms[index]) / segment.ms_per_beat
+        ticks = math.floor(offset * ticks_per_beat + 0.5)
+
+        bars, ticks = divmod(ticks, segment.numerator * ticks_per_beat)
+        beats, ticks = divmod(ticks, ticks_per_beat)
+        return (segment.bar + int(bars), int(beats) + 1, int(ticks))
+
+    def locate_many(self, timestamps, ticks_per_beat=DEFAULT_TICKS_PER_BEAT, sample_rate=None,
+                    assume_sorted=False):
+        """Vectorized locate_ms returning (bars, beats, ticks) int64 arrays
+
+        Negative timestamps get bar 0. With assume_sorted=True the
+        timestamps must be ascending and segment starts are merged into them
+        instead of searching once per timestamp.
+        """
+        np = require_numpy()
+        tables = self._segment_arrays()
+        milliseconds = np.asarray(timestamps, dtype=np.float64)
+        if sample_rate is not None:
+            milliseconds = milliseconds * (1000.0 / sample_rate)
+        shape = milliseconds.shape
+        milliseconds = milliseconds.ravel()
+
+        if assume_sorted:
+            index = _merge_index(milliseconds, tables['start_ms'], np)
+        else:
+            index = np.searchsorted(tables['start_ms'], milliseconds, side='right') - 1
+        np.clip(index, 0, None, out=index)
+
+        offset = (tables['beats'][index] - 1) + (milliseconds - tables['start_ms'][index]) / tables['ms_per_beat'][index]
+        ticks = np.floor(offset * ticks_per_beat + 0.5).astype(np.int64)
+
+        bar_ticks = tables['numerators'][index].astype(np.int64) * ticks_per_beat
+        bars, ticks = np.divmod(ticks, bar_ticks)
+        beats, ticks = np.divmod(ticks, ticks_per_beat)
+        bars += tables['bars'][index].astype(np.int64)
+
+        bars[milliseconds < 0] = 0
+        return bars.reshape(shape), (beats + 1).reshape(shape), ticks.reshape(shape)
+
+    def iter_locate(self, timestamps, ticks_per_beat=DEFAULT_TICKS_PER_BEAT, sample_rate=None):
+        """Yield (bar, beat, tick) for each timestamp of an iterable
+
+        Uses constant memory. The current segment is carried from one
+        timestamp to the next, so ascending input is a single merge-style
+        walk; a timestamp that goes backwards falls back to a binary search.
+        Negative timestamps yield None.
+        """
+        self._refresh()
+        start_ms = self._start_ms
+        count = len(start_ms)
+        index = 0
+
+        for milliseconds in timestamps:
+            if sample_rate is not None:
+                milliseconds = milliseconds * 1000.0 / sample_rate
+            if milliseconds < 0:
+                yield None
+                continue
+
+            if milliseconds < start_ms[index]:
+                index = max(bisect_right(start_ms, milliseconds) - 1, 0)
+            else:
+                while index + 1 < count and start_ms[index + 1] <= milliseconds:
+                    index += 1
+            yield self._locate_in_segment(index, milliseconds, ticks_per_beat)
+
+
+def _merge_index(sorted_values, boundaries, np):
+    """Segment index per value for ascending values (merge of two sorted lists)
+
+    Equivalent to searchsorted(boundaries, values, 'right') - 1, but only
+    the few segment boundaries are searched for in the many values.
+    """
+    starts = np.searchsorted(sorted_values, boundaries, side='left')
+    counts = np.bincount(starts, minlength=len(sorted_values) + 1)[:len(sorted_values)]
+    return np.cumsum(counts) - 1
+
+
+instrumentation.instrument(TempoMap, "positions_ms", "locate_many", prefix="tempo_map")
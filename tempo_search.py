@@ -0,0 +1,242 @@
+"""
+Tempo Search
+Tempos whose note durations come out whole: whole milliseconds, whole
+samples at a sample rate or whole video frames.
+
+    python bpm_calculator.py search --from 20 --to 300 --step 0.001 \\
+        --notes 1/4,1/8,1/16 --modifiers normal,dotted,triplet --targets ms,48k,24fps [--top 20]
+    python bpm_calculator.py search --exact --from 60 --to 180 --notes 1/4,1/8 --targets 44.1k
+
+A sweep scores every BPM of a range by its worst miss: for each note value,
+modifier and target, how far the duration (as the calculator computes it)
+is from a whole number of target units, as a fraction of a unit (0 is
+exact, 0.5 is as far off as possible). It runs on DelayTable blocks, one
+broadcast per block, and keeps only the best candidates as it goes.
+
+The exact solve needs no sweep. A duration is 60000 * multiplier / bpm ms,
+so it is a whole number of units for every rhythm and target exactly when
+bpm = G / n for a positive integer n, where G is the rational GCD of the
+60000 * multiplier / unit constants. Those tempos are listed in order of
+how few decimal places they need.
+
+Targets are "ms", a sample rate ("48000", "48k", "44.1k") or a frame rate
+("24fps", "29.97fps"; the NTSC rates are read as their exact n*1000/1001).
+"""
+
+import argparse
+from fractions import Fraction
+import heapq
+import math
+import sys
+
+from delay_table import DEFAULT_STEP, DelayTable
+from note_registry import exact_multiplier, rhythm_id
+from sample_grid import exact_bpm
+from timing_engine import note_id, require_numpy
+
+DEFAULT_START_BPM = 20.0
+DEFAULT_STOP_BPM = 300.0
+DEFAULT_TARGETS = ("ms",)
+DEFAULT_TOP = 20
+
+# Rows scored per sweep block
+SEARCH_BLOCK_ROWS = 1 << 16
+
+# Misses below this (in units) are float rounding of an exact hit
+EXACT_TOLERANCE = 1e-9
+
+# Sort key of exact tempos whose decimals never terminate (after any that do)
+NON_TERMINATING = 10 ** 6
+
+# Frame rates that are really n * 1000/1001
+NTSC_RATES = {"23.976": Fraction(24000, 1001), "29.97": Fraction(30000, 1001),
+              "47.952": Fraction(48000, 1001), "59.94": Fraction(60000, 1001),
+              "119.88": Fraction(120000, 1001)}
+
+
+class Target:
+    """A unit durations should be whole multiples of, as an exact length in ms"""
+
+    __slots__ = ("name", "unit_ms")
+
+    def __init__(self, name, unit_ms):
+        self.name = name
+        self.unit_ms = unit_ms
+
+    def __repr__(self):
+        return f"Target({self.name!r}, {self.unit_ms})"
+
+    @classmethod
+    def parse(cls, text):
+        """Target for "ms", "48000", "48k", "44.1k", "24fps" or "29.97fps"; ValueError otherwise"""
+        spec = str(text).strip().lower().replace(" ", "")
+        try:
+            if spec == "ms":
+                return cls("ms", Fraction(1))
+            if spec.endswith("fps"):
+                rate = NTSC_RATES.get(spec[:-3]) or Fraction(spec[:-3])
+                return cls(f"{spec[:-3]} fps", 1000 / rate)
+            if spec.endswith("hz"):
+                spec = spec[:-2]
+            rate = Fraction(spec[:-1]) * 1000 if spec.endswith("k") else Fraction(spec)
+            if rate.denominator == 1:
+                return cls(f"{rate} Hz", 1000 / rate)
+        except (ValueError, ZeroDivisionError):
+            pass
+        raise ValueError(f"Unknown target {text!r} (use ms, a sample rate like 48k or a frame rate like 24fps)")
+
+
+def _constants(columns, targets):
+    """60000 * multiplier / unit for every (column, target) pair, as Fractions in column order"""
+    return [60000 * exact_multiplier(note_id(*column)) / target.unit_ms
+            for column in columns for target in targets]
+
+
+def search(start_bpm, stop_bpm, step, columns, targets, top=DEFAULT_TOP):
+    """Best BPMs of a sweep as (bpms, misses) arrays, best first
+
+    A BPM's miss is its worst distance from a whole number of units over
+    every column and target, as a fraction of a unit. Ties go to the
+    lower BPM.
+    """
+    np = require_numpy()
+    table = DelayTable(start_bpm, stop_bpm, step, columns)
+    units = np.array([float(target.unit_ms) for target in targets])
+    best_bpms = np.empty(0)
+    best_misses = np.empty(0)
+    for first in range(0, len(table), SEARCH_BLOCK_ROWS):
+        bpms, durations = table.rows(first, first + SEARCH_BLOCK_ROWS)
+        counts = durations[:, :, None] / units
+        misses = np.abs(counts - np.rint(counts)).reshape(len(bpms), -1).max(axis=1)
+        misses[misses < EXACT_TOLERANCE] = 0.0
+        # Rounded rows never leave the sweep, but a result outside the asked-for range is never wanted
+        inside = (bpms >= start_bpm) & (bpms <= stop_bpm)
+        if not inside.all():
+            bpms, misses = bpms[inside], misses[inside]
+        # Keep this block's best alongside the best so far, then cut back to top
+        if len(misses) > top:
+            keep = np.argpartition(misses, top - 1)[:top]
+            bpms, misses = bpms[keep], misses[keep]
+        best_bpms = np.concatenate([best_bpms, bpms])
+        best_misses = np.concatenate([best_misses, misses])
+        order = np.lexsort((best_bpms, best_misses))[:top]
+        best_bpms, best_misses = best_bpms[order], best_misses[order]
+    return best_bpms, best_misses
+
+
+def rational_gcd(values):
+    """Largest Fraction that divides every value a whole number of times"""
+    numerator = 0
+    denominator = 1
+    for value in values:
+        numerator = math.gcd(numerator, value.numerator)
+        denominator = denominator * value.denominator // math.gcd(denominator, value.denominator)
+    return Fraction(numerator, denominator)
+
+
+def decimal_places(value):
+    """Decimal places needed to write a Fraction exactly, or None if it does not terminate"""
+    return _places(value.denominator)
+
+
+def _places(denominator):
+    """Decimal places of 1/denominator: a denominator of 2**a * 5**b needs max(a, b)"""
+    twos = (denominator & -denominator).bit_length() - 1
+    denominator >>= twos
+    fives = 0
+    while denominator % 5 == 0:
+        denominator //= 5
+        fives += 1
+    return max(twos, fives) if denominator == 1 else None
+
+
+def exact_tempos(start_bpm, stop_bpm, columns, targets, max_decimals=None, top=None):
+    """BPMs in [start_bpm, stop_bpm] where every duration is exactly whole, as Fractions
+
+    Ordered by the decimal places they need (non-terminating last), then by
+    BPM. With max_decimals, tempos needing more places are left out.
+    """
+    if not (0 < start_bpm <= stop_bpm):
+        raise ValueError(f"Invalid BPM range {start_bpm}-{stop_bpm}")
+    base = rational_gcd(_constants(columns, targets))
+    p, q = base.numerator, base.denominator
+    # bpm = base / n = p / (q * n), so n runs over base / stop_bpm .. base / start_bpm
+    first = max(1, math.ceil(base / exact_bpm(stop_bpm)))
+    last = math.floor(base / exact_bpm(start_bpm))
+    # With max_decimals, bpm * 10**max_decimals must be whole, which rules most n out cheaply
+    scaled = None if max_decimals is None else p * 10 ** max_decimals
+    ranked = []
+    for n in range(first, last + 1):
+        divisor = q * n
+        if scaled is not None and scaled % divisor:
+            continue
+        places = _places(divisor // math.gcd(p, divisor))
+        ranked.append((NON_TERMINATING if places is None else places, Fraction(p, divisor)))
+    if top is not None:
+        return [bpm for _, bpm in heapq.nsmallest(top, ranked)]
+    ranked.sort()
+    return [bpm for _, bpm in ranked]
+
+
+def _columns(notes, modifiers):
+    """(note value, modifier) pairs for comma-separated note and modifier spellings"""
+    import batch_mode
+
+    columns = []
+    for note in notes.split(","):
+        name = batch_mode.NOTE_ALIASES.get(note.strip().lower())
+        if name is None:
+            raise ValueError(f"Unknown note value {note.strip()!r}")
+        for modifier in modifiers.split(","):
+            rhythm_id(name, modifier.strip())  # ValueError for unknown spellings
+            columns.append((name, modifier.strip()))
+    return columns
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py search`"""
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py search",
+                                     description="Find BPMs whose note durations are whole ms, samples or frames")
+    parser.add_argument("--from", dest="start", type=float, default=DEFAULT_START_BPM)
+    parser.add_argument("--to", dest="stop", type=float, default=DEFAULT_STOP_BPM)
+    parser.add_argument("--step", type=float, default=DEFAULT_STEP, help="sweep resolution in BPM")
+    parser.add_argument("--notes", default="1/4", help="comma-separated note values, e.g. 1/4,1/8,1/16")
+    parser.add_argument("--modifiers", default="Normal", help="comma-separated modifiers, e.g. normal,dotted,triplet")
+    parser.add_argument("--targets", default=",".join(DEFAULT_TARGETS),
+                        help="comma-separated targets: ms, sample rates (44.1k, 48000) or frame rates (24fps)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="number of results")
+    parser.add_argument("--exact", action="store_true",
+                        help="solve for exact tempos instead of sweeping (decimals limited by --from and --step)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.top <= 0:
+            raise ValueError(f"--top must be positive, not {args.top}")
+        columns = _columns(args.notes, args.modifiers)
+        targets = [Target.parse(text) for text in args.targets.split(",")]
+        # Printed (and, with --exact, allowed) decimals: enough for every start + k * step
+        places = [decimal_places(exact_bpm(value)) for value in (args.start, args.step)]
+        if args.step <= 0 or None in places:
+            raise ValueError(f"Invalid BPM sweep from {args.start} in steps of {args.step}")
+        decimals = max(places)
+        if args.exact:
+            bpms = exact_tempos(args.start, args.stop, columns, targets, decimals, args.top)
+            if not bpms:
+                print(f"No exact tempos with at most {decimals} decimal places "
+                      f"(try a smaller --step)", file=sys.stderr)
+            print("bpm,exact")
+            for bpm in bpms:
+                print(f"{float(bpm):.{decimals}f},{bpm}")
+            return 0
+        bpms, misses = search(args.start, args.stop, args.step, columns, targets, args.top)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print("bpm,miss")
+    for bpm, miss in zip(bpms.tolist(), misses.tolist()):
+        print(f"{bpm:.{decimals}f},{miss:.6f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
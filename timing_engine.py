@@ -0,0 +1,359 @@
+"""
+Timing Engine
+Headless note-duration and beat-position math shared by the calculator GUI
+and scripted tools. Scalar functions are pure Python; the batch functions
+take NumPy arrays (or anything array-like) and are evaluated in one pass.
+
+Positions come back as compact records: position() returns a Position
+(a __slots__ object) and position_records() a structured array with one
+36-byte row per position. Both name the time signature by an ID into a
+shared meter table instead of a string per result. calculate_position()
+still returns the GUI's dict.
+"""
+
+import json
+import math
+import os
+import sys
+
+import instrumentation
+import note_registry
+
+# NumPy is only needed by the batch functions, so it is imported on first use
+np = None
+
+# Multiplier relative to a quarter note (one beat at the given BPM)
+NOTE_MULTIPLIERS = {name: 4.0 / denominator for name, denominator in note_registry.NOTE_DENOMINATORS.items()}
+
+NOTE_VALUES = list(NOTE_MULTIPLIERS)
+
+# Rhythmic modifiers applied on top of the base note multiplier (the GUI's buttons;
+# note_registry also knows double and triple dots and arbitrary tuplets)
+MODIFIER_FACTORS = {
+    "Normal": 1.0,
+    "Dotted": 1.5,         # Adds 50% duration
+    "Triplet": 2.0 / 3.0   # 2/3 of normal duration
+}
+
+MODIFIERS = list(MODIFIER_FACTORS)
+
+# Note values that are not known are timed as quarter notes
+DEFAULT_NOTE_VALUE = "Quarter Note (1/4)"
+
+# Multiplier table for rhythm_multipliers: the registry's floats plus NaN at INVALID_ID (-1)
+_rhythm_table = None
+
+# Time signatures get IDs in order of first use; these come first, in this order, in every process
+COMMON_METERS = ((4, 4), (3, 4), (2, 4), (6, 8), (2, 2), (5, 4), (7, 8), (9, 8), (12, 8), (5, 8), (3, 8), (6, 4))
+
+# Meter ID of positions that calculate_position would reject
+INVALID_METER = -1
+
+# One row of position_records() (little-endian, as saved)
+POSITION_DTYPE = [("ms", "<f8"), ("bar", "<i8"), ("beat", "<f8"), ("beats_elapsed", "<f8"), ("meter", "<i4")]
+
+_meters = []        # (numerator, denominator) per meter ID
+_meter_names = []   # "7/8" per meter ID, shared by every Position
+_meter_ids = {}     # (numerator, denominator) -> meter ID
+
+
+def require_numpy():
+    """Import NumPy for the batch paths, with a helpful error if it is missing"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("NumPy is required for batch calculations (pip install numpy)")
+        np = numpy
+    return np
+
+
+# === SCALAR API ===
+
+def note_id(note_value, modifier="Normal"):
+    """note_registry ID for a note value name and modifier, with the calculator's fallbacks
+
+    Unknown note values are quarter notes and unknown modifiers behave like "Normal".
+    """
+    try:
+        return note_registry.rhythm_id(note_value, modifier)
+    except ValueError:
+        if note_value not in NOTE_MULTIPLIERS:
+            note_value = DEFAULT_NOTE_VALUE
+        try:
+            return note_registry.rhythm_id(note_value, modifier)
+        except ValueError:
+            return note_registry.rhythm_id(note_value)
+
+
+def get_note_multiplier(note_value, modifier="Normal"):
+    """Get the multiplier for a note value name and modifier"""
+    return note_registry.multiplier(note_id(note_value, modifier))
+
+
+def format_bpm(bpm):
+    """A BPM for the entry field: two decimals without trailing zeros"""
+    return f"{bpm:.2f}".rstrip("0").rstrip(".")
+
+
+def note_duration_ms(bpm, note_multiplier=1.0):
+    """Duration of one note in milliseconds, or None if the BPM is not positive"""
+    if bpm <= 0:
+        return None
+    # Formula: (60 seconds / BPM) * 1000 ms/second * note_multiplier
+    return (60.0 / bpm) * 1000.0 * note_multiplier
+
+
+def meter_id(numerator, denominator):
+    """ID of a time signature in the shared meter table, adding it on first use"""
+    mid = _meter_ids.get((numerator, denominator))
+    if mid is None:
+        # NaN keys never match themselves, so each one would add another row
+        if not (math.isfinite(numerator) and math.isfinite(denominator)):
+            raise ValueError(f"Invalid time signature {numerator}/{denominator}")
+        # Whole-number floats are stored as ints, so 7.0/8.0 is named "7/8" like 7/8
+        key = tuple(int(value) if float(value).is_integer() else value for value in (numerator, denominator))
+        mid = _meter_ids[key] = len(_meters)
+        _meters.append(key)
+        _meter_names.append(f"{key[0]}/{key[1]}")
+    return mid
+
+
+def meter(mid):
+    """(numerator, denominator) of a meter ID"""
+    return _meters[mid]
+
+
+def meter_name(mid):
+    """Display name of a meter ID: "7/8" """
+    return _meter_names[mid]
+
+
+class Position:
+    """A bar/beat position: milliseconds, the bar and beat, beats elapsed and a meter ID"""
+
+    __slots__ = ("ms", "bar", "beat", "beats_elapsed", "meter")
+
+    def __init__(self, ms, bar, beat, beats_elapsed, meter):
+        self.ms = ms
+        self.bar = bar
+        self.beat = beat
+        self.beats_elapsed = beats_elapsed
+        self.meter = meter
+
+    def __repr__(self):
+        return (f"Position(ms={self.ms!r}, bar={self.bar!r}, beat={self.beat!r}, "
+                f"beats_elapsed={self.beats_elapsed!r}, time_signature={self.time_signature!r})")
+
+    def __eq__(self, other):
+        if not isinstance(other, Position):
+            return NotImplemented
+        return (self.ms, self.bar, self.beat, self.beats_elapsed, self.meter) == (
+            other.ms, other.bar, other.beat, other.beats_elapsed, other.meter)
+
+    @property
+    def time_signature(self):
+        """The time signature as "7/8" (one shared string per meter)"""
+        return _meter_names[self.meter]
+
+    def to_dict(self):
+        """The result dict of calculate_position"""
+        return {
+            'milliseconds': self.ms,
+            'bars': self.bar,
+            'beats': self.beat,
+            'time_signature': _meter_names[self.meter],
+            'beats_elapsed': self.beats_elapsed
+        }
+
+
+def position(bpm, numerator, denominator, bar, beat):
+    """Calculate the millisecond position of a bar/beat in a time signature
+
+    Returns a Position, or None if the inputs are out of range or not finite.
+    """
+    if numerator <= 0 or denominator <= 0 or bar <= 0 or beat <= 0 or bpm <= 0:
+        return None
+
+    # One check for all five: the sum is NaN or infinite if any input is
+    if not math.isfinite(bpm + numerator + denominator + bar + beat):
+        return None
+
+    if beat > numerator:
+        return None
+
+    # Calculate milliseconds per quarter note
+    ms_per_quarter = (60.0 / bpm) * 1000.0
+
+    # Calculate the note value of one beat in this time signature
+    # In 4/4 time, one beat = quarter note
+    # In 2/2 time, one beat = half note, etc.
+    beat_note_value = 4.0 / denominator
+    ms_per_beat = ms_per_quarter * beat_note_value
+
+    # Calculate position in milliseconds
+    beats_elapsed = (bar - 1) * numerator + (beat - 1)
+    position_ms = beats_elapsed * ms_per_beat
+
+    return Position(position_ms, bar, beat, beats_elapsed, meter_id(numerator, denominator))
+
+
+def calculate_position(bpm, numerator, denominator, bar, beat):
+    """position() as the GUI's result dict, or None if the inputs are out of range"""
+    result = position(bpm, numerator, denominator, bar, beat)
+    return None if result is None else result.to_dict()
+
+
+# === BATCH API ===
+
+def rhythm_multipliers(rhythm_ids):
+    """Multipliers for an array of note_registry IDs, gathered in one step; INVALID_ID gives NaN"""
+    global _rhythm_table
+    np = require_numpy()
+    table = note_registry.multiplier_table()
+    if _rhythm_table is None or len(_rhythm_table) != len(table) + 1:
+        # Rebuilt only when new rhythms have been compiled since the last call
+        _rhythm_table = np.append(np.array(table, dtype=np.float64), np.nan)
+    return _rhythm_table[np.asarray(rhythm_ids, dtype=np.intp)]
+
+
+def note_ids(note_values, modifiers="Normal"):
+    """Vectorized note_id over arrays of note names and modifiers"""
+    np = require_numpy()
+    note_values, modifiers = np.broadcast_arrays(np.asarray(note_values, dtype=object),
+                                                 np.asarray(modifiers, dtype=object))
+
+    # Look up each distinct note and modifier pair once, then gather by position
+    notes, note_index = np.unique(note_values.astype(str), return_inverse=True)
+    names, name_index = np.unique(modifiers.astype(str), return_inverse=True)
+    ids = np.array([[note_id(note, name) for name in names.tolist()] for note in notes.tolist()], dtype=np.intp)
+    return ids[note_index.reshape(note_values.shape), name_index.reshape(modifiers.shape)]
+
+
+def note_multipliers(note_values, modifiers="Normal"):
+    """Vectorized get_note_multiplier over arrays of note names and modifiers"""
+    return rhythm_multipliers(note_ids(note_values, modifiers))
+
+
+def note_durations_ms(bpms, note_multiplier=1.0):
+    """Vectorized note_duration_ms; non-positive BPMs give NaN"""
+    np = require_numpy()
+    bpms = np.asarray(bpms, dtype=np.float64)
+    note_multiplier = np.asarray(note_multiplier, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        milliseconds = (60.0 / bpms) * 1000.0 * note_multiplier
+    return np.where(bpms > 0, milliseconds, np.nan)
+
+
+def calculate_positions(bpms, numerators, denominators, bars, beats):
+    """Vectorized calculate_position over broadcastable arrays
+
+    Returns (milliseconds, beats_elapsed) float64 arrays; positions that
+    calculate_position would reject are NaN in both.
+    """
+    np = require_numpy()
+    bpms, numerators, denominators, bars, beats = np.broadcast_arrays(
+        *(np.asarray(a, dtype=np.float64) for a in (bpms, numerators, denominators, bars, beats)))
+
+    valid = ((numerators > 0) & (denominators > 0) & (bars > 0) & (beats > 0) & (bpms > 0)
+             & (beats <= numerators))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Same operation order as calculate_position so results match exactly
+        ms_per_beat = ((60.0 / bpms) * 1000.0) * (4.0 / denominators)
+        beats_elapsed = (bars - 1) * numerators + (beats - 1)
+        position_ms = beats_elapsed * ms_per_beat
+
+    return (np.where(valid, position_ms, np.nan),
+            np.where(valid, beats_elapsed, np.nan))
+
+
+def position_records(bpms, numerators, denominators, bars, beats, out=None):
+    """calculate_positions as a structured array of POSITION_DTYPE rows
+
+    Bars must be whole numbers. Rejected positions have NaN ms and
+    beats_elapsed, bar 0 and meter INVALID_METER. Rows are written into out
+    (say, a memory map from open_positions) if given.
+    """
+    np = require_numpy()
+    bpms, numerators, denominators, bars, beats = np.broadcast_arrays(
+        *(np.asarray(a, dtype=np.float64) for a in (bpms, numerators, denominators, bars, beats)))
+    milliseconds, beats_elapsed = calculate_positions(bpms, numerators, denominators, bars, beats)
+    valid = ~np.isnan(milliseconds) & (bars == np.floor(bars))
+
+    records = np.empty(bpms.shape, dtype=POSITION_DTYPE) if out is None else out
+    records["ms"] = np.where(valid, milliseconds, np.nan)
+    records["bar"] = np.where(valid, bars, 0)
+    records["beat"] = beats
+    records["beats_elapsed"] = np.where(valid, beats_elapsed, np.nan)
+    records["meter"] = np.where(valid, _meter_ids_of(np, numerators, denominators, valid), INVALID_METER)
+    return records
+
+
+def _meter_ids_of(np, numerators, denominators, valid):
+    """Meter IDs for arrays of numerators and denominators (only valid entries are registered)"""
+    if numerators.strides == denominators.strides == (0,) * numerators.ndim:
+        # Broadcast scalars: one time signature for every row
+        if not valid.any():
+            return INVALID_METER
+        return meter_id(numerators.flat[0].item(), denominators.flat[0].item())
+    # Each pair as one complex number, so a 1-D unique finds the distinct meters
+    pairs, index = np.unique(numerators[valid] + 1j * denominators[valid], return_inverse=True)
+    ids = np.full(numerators.shape, INVALID_METER, dtype=np.int32)
+    ids[valid] = np.array([meter_id(pair.real, pair.imag) for pair in pairs.tolist()],
+                          dtype=np.int32)[index.ravel()]
+    return ids
+
+
+def open_positions(path, count):
+    """A writable .npy memory map of count position rows, to fill with position_records(out=...)
+
+    Finish with save_positions(path, records) so the meter table is saved alongside.
+    """
+    np = require_numpy()
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.dtype(POSITION_DTYPE), shape=(count,))
+
+
+def save_positions(path, records):
+    """Write position rows to a .npy file and the meter table to path + ".meters" (JSON)
+
+    A memory map from open_positions(path) is flushed in place rather than rewritten.
+    """
+    np = require_numpy()
+    if getattr(records, "filename", None) is not None and str(records.filename) == os.path.abspath(path):
+        records.flush()
+    else:
+        np.save(path, np.asarray(records, dtype=POSITION_DTYPE))
+    with open(f"{path}.meters", "w", encoding="utf-8") as f:
+        json.dump(_meters, f)
+
+
+def load_positions(path, mmap_mode="r"):
+    """Position rows saved by save_positions, memory-mapped unless mmap_mode is None
+
+    Meter IDs are translated to this process's table; rows are only copied
+    if the file's IDs differ from it.
+    """
+    np = require_numpy()
+    records = np.load(path, mmap_mode=mmap_mode)
+    try:
+        with open(f"{path}.meters", encoding="utf-8") as f:
+            saved = [meter_id(numerator, denominator) for numerator, denominator in json.load(f)]
+    except FileNotFoundError:
+        return records  # Written with this process's IDs (or with only COMMON_METERS)
+    if saved == list(range(len(saved))):
+        return records
+    records = np.array(records)
+    translate = np.append(np.array(saved, dtype=np.int32), INVALID_METER)
+    records["meter"] = translate[records["meter"]]
+    return records
+
+
+instrumentation.instrument(sys.modules[__name__], "note_multipliers", "rhythm_multipliers", "note_durations_ms",
+                           "calculate_positions", "position_records", prefix="engine")
+
+
+for _numerator, _denominator in COMMON_METERS:
+    meter_id(_numerator, _denominator)
@@ -0,0 +1,457 @@
+"""
+Timing Server
+Local asyncio HTTP/JSON service so other tools can query note durations,
+beat positions and timestamp locations from one process:
+
+    python bpm_calculator.py serve [--port 8765] [--unix PATH]
+
+Endpoints (POST, JSON body; every numeric field may be a number or a list):
+
+    /duration  {"bpm", "note", "modifier"}                    -> {"duration_ms"}
+    /position  {"bpm", "time_signature", "bar", "beat"}       -> {"position_ms"}
+               {"tempo_map": [[bar, beat, bpm, num, den], ...], "bar", "beat"}
+    /locate    {"bpm", "time_signature" | "tempo_map", "ms", "ticks_per_beat"}
+                                                             -> {"bar", "beat", "tick"}
+    GET /health                                              -> {"status": "ok"}
+    GET /metrics          call site latency histograms (Prometheus text, see instrumentation.py)
+
+Connections are HTTP/1.1 keep-alive and pipelined requests are answered in
+order. Requests arriving in the same event loop iteration are merged into
+one vectorized engine call.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import sys
+
+import batch_mode
+import instrumentation
+import timing_engine
+from tempo_map import DEFAULT_TICKS_PER_BEAT, TempoMap
+
+DEFAULT_PORT = 8765
+
+# Batches smaller than this use the scalar engine (NumPy call overhead dominates)
+VECTORIZE_THRESHOLD = 32
+
+# Tempo maps kept ready for reuse, most recently used last
+TEMPO_MAP_CACHE_SIZE = 128
+
+# Pipelined requests accepted ahead of their responses on one connection
+MAX_PIPELINE_DEPTH = 64
+
+IDLE_TIMEOUT = 60.0
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class RequestError(Exception):
+    """A client error reported as an HTTP status with a JSON message"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# === REQUEST BATCHING ===
+
+class RequestBatcher:
+    """Collect items submitted during one event loop iteration and process them together
+
+    run_batch(items) receives the list of submitted items and returns one
+    result per item.
+    """
+
+    def __init__(self, run_batch):
+        self.run_batch = run_batch
+        self.pending = []
+
+    def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) == 1:
+            loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        try:
+            results = self.run_batch([item for item, _future in pending])
+        except Exception:
+            # Rerun each item alone so a bad request only fails its own future
+            for item, future in pending:
+                try:
+                    result = self.run_batch([item])[0]
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+        for (_item, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def _split(values, lengths):
+    """Split a flat list back into per-request pieces"""
+    pieces = []
+    start = 0
+    for length in lengths:
+        pieces.append(values[start:start + length])
+        start += length
+    return pieces
+
+
+def _none_for_nan(values):
+    return [None if value is None or value != value else value for value in values]
+
+
+def _run_columns(items, scalar, vectorized):
+    """Concatenate per-request column lists, evaluate them once and split the results"""
+    lengths = [len(item[0]) for item in items]
+    columns = [sum((item[i] for item in items), []) for i in range(len(items[0]))]
+    if sum(lengths) < VECTORIZE_THRESHOLD:
+        results = [scalar(*row) for row in zip(*columns)]
+    else:
+        results = vectorized(*columns).tolist()
+    return _split(_none_for_nan(results), lengths)
+
+
+def _duration_batch(items):
+    return _run_columns(items, timing_engine.note_duration_ms, timing_engine.note_durations_ms)
+
+
+def _scalar_position(bpm, numerator, denominator, bar, beat):
+    result = timing_engine.position(bpm, numerator, denominator, bar, beat)
+    return result.ms if result else None
+
+
+def _position_batch(items):
+    return _run_columns(items, _scalar_position,
+                        lambda *columns: timing_engine.calculate_positions(*columns)[0])
+
+
+def _tempo_map_position_batch(items):
+    """Items are (tempo_map, bars, beats); one positions_ms call per distinct map"""
+    results = [None] * len(items)
+    for tempo_map, indices in _group_by_map(items).items():
+        group = [items[i] for i in indices]
+        lengths = [len(bars) for _map, bars, _beats in group]
+        if sum(lengths) < VECTORIZE_THRESHOLD:
+            flat = [tempo_map.position_ms(bar, beat) for _map, bars, beats in group
+                    for bar, beat in zip(bars, beats)]
+        else:
+            flat = tempo_map.positions_ms(sum((bars for _map, bars, _beats in group), []),
+                                          sum((beats for _map, _bars, beats in group), [])).tolist()
+        for i, piece in zip(indices, _split(_none_for_nan(flat), lengths)):
+            results[i] = piece
+    return results
+
+
+def _locate_batch(items):
+    """Items are (tempo_map, milliseconds, ticks_per_beat)"""
+    results = [None] * len(items)
+    groups = collections.defaultdict(list)
+    for i, (tempo_map, _ms, ticks_per_beat) in enumerate(items):
+        groups[(id(tempo_map), ticks_per_beat)].append(i)
+
+    for indices in groups.values():
+        tempo_map, _ms, ticks_per_beat = items[indices[0]]
+        timestamps = sum((items[i][1] for i in indices), [])
+        if len(timestamps) < VECTORIZE_THRESHOLD:
+            flat = [tempo_map.locate_ms(ms, ticks_per_beat) for ms in timestamps]
+        else:
+            bars, beats, ticks = tempo_map.locate_many(timestamps, ticks_per_beat)
+            flat = [None if bar == 0 else (bar, beat, tick)
+                    for bar, beat, tick in zip(bars.tolist(), beats.tolist(), ticks.tolist())]
+        for i, piece in zip(indices, _split(flat, [len(items[i][1]) for i in indices])):
+            results[i] = piece
+    return results
+
+
+def _group_by_map(items):
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(item[0], []).append(i)
+    return groups
+
+
+# === REQUEST HANDLING ===
+
+class TimingService:
+    """Endpoint handlers sharing batchers and a tempo map cache"""
+
+    def __init__(self, cache_size=TEMPO_MAP_CACHE_SIZE):
+        self.durations = RequestBatcher(_duration_batch)
+        self.positions = RequestBatcher(_position_batch)
+        self.map_positions = RequestBatcher(_tempo_map_position_batch)
+        self.locations = RequestBatcher(_locate_batch)
+        self.tempo_maps = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.routes = {
+            "/duration": self.duration,
+            "/position": self.position,
+            "/locate": self.locate,
+        }
+
+    def tempo_map(self, request):
+        """Tempo map for a request, from the LRU cache when the same map was used recently"""
+        if "tempo_map" in request:
+            key = tuple(tuple(segment) for segment in request["tempo_map"])
+        else:
+            numerators, denominators = _time_signature(request, 1)
+            key = ((1, 1, _number(request, "bpm"), int(numerators[0]), int(denominators[0])),)
+
+        tempo_map = self.tempo_maps.get(key)
+        if tempo_map is None:
+            try:
+                tempo_map = TempoMap(key)
+            except (TypeError, ValueError) as e:
+                raise RequestError(400, f"Invalid tempo map: {e}")
+            self.tempo_maps[key] = tempo_map
+            if len(self.tempo_maps) > self.cache_size:
+                self.tempo_maps.popitem(last=False)
+        else:
+            self.tempo_maps.move_to_end(key)
+        return tempo_map
+
+    async def duration(self, request):
+        bpms, scalar = _column(request, "bpm")
+        notes = _broadcast(request.get("note", ""), len(bpms))
+        modifiers = _broadcast(request.get("modifier", ""), len(bpms))
+        multipliers = [_nan_for_none(batch_mode.note_multiplier(n, m)) for n, m in zip(notes, modifiers)]
+        durations = await self.durations.submit((bpms, multipliers))
+        return {"duration_ms": durations[0] if scalar else durations}
+
+    async def position(self, request):
+        fields = {"bar": _column(request, "bar", 1), "beat": _column(request, "beat", 1)}
+        if "tempo_map" not in request:
+            fields["bpm"] = _column(request, "bpm")
+            if "time_signature" not in request:
+                fields["numerator"] = _column(request, "numerator", 4)
+                fields["denominator"] = _column(request, "denominator", 4)
+        scalar = all(is_scalar for _, is_scalar in fields.values())
+        count = max(len(values) for values, _ in fields.values())
+        columns = {name: _broadcast(values, count) for name, (values, _) in fields.items()}
+        if not all(math.isfinite(value) for values in columns.values() for value in values):
+            raise RequestError(400, f"{', '.join(fields)} must be finite numbers")
+        if "tempo_map" in request:
+            positions = await self.map_positions.submit((self.tempo_map(request), columns["bar"], columns["beat"]))
+        else:
+            numerators, denominators = _time_signature(request, count)
+            positions = await self.positions.submit(
+                (columns["bpm"], numerators, denominators, columns["bar"], columns["beat"]))
+        return {"position_ms": positions[0] if scalar else positions}
+
+    async def locate(self, request):
+        timestamps, scalar = _column(request, "ms")
+        if not all(math.isfinite(ms) for ms in timestamps):
+            raise RequestError(400, "ms must be finite numbers")
+        ticks_per_beat = int(request.get("ticks_per_beat", DEFAULT_TICKS_PER_BEAT))
+        if ticks_per_beat <= 0:
+            raise RequestError(400, "ticks_per_beat must be positive")
+        located = await self.locations.submit((self.tempo_map(request), timestamps, ticks_per_beat))
+        results = [None if item is None else {"bar": item[0], "beat": item[1], "tick": item[2]}
+                   for item in located]
+        return results[0] if scalar else {"locations": results}
+
+    async def handle(self, method, path, body):
+        """Dispatch one request; returns (status, JSON-serializable body or plain text)"""
+        if path == "/health":
+            return 200, {"status": "ok", "tempo_maps_cached": len(self.tempo_maps)}
+        if path == "/metrics":
+            return 200, instrumentation.to_prometheus()
+        handler = self.routes.get(path)
+        if handler is None:
+            return 404, {"error": f"Unknown endpoint {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST with a JSON body"}
+        try:
+            request = json.loads(body or b"{}")
+            if not isinstance(request, dict):
+                raise RequestError(400, "Request body must be a JSON object")
+            return 200, await handler(request)
+        except RequestError as e:
+            return e.status, {"error": str(e)}
+        except (ValueError, TypeError, KeyError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+
+def _column(request, name, default=None):
+    """Request field as a list of floats, plus whether it was given as a scalar"""
+    value = request.get(name, default)
+    if value is None:
+        raise RequestError(400, f"Missing field '{name}'")
+    scalar = not isinstance(value, list)
+    values = [value] if scalar else value
+    return [float("nan") if v is None else float(v) for v in values], scalar
+
+
+def _number(request, name):
+    return _column(request, name)[0][0]
+
+
+def _broadcast(values, count):
+    """Repeat a scalar or single-element list to count elements"""
+    if not isinstance(values, list):
+        values = [values]
+    if len(values) == 1:
+        return values * count
+    if len(values) != count:
+        raise RequestError(400, "List fields must all have the same length")
+    return values
+
+
+def _time_signature(request, count):
+    """Numerator and denominator lists from "time_signature" or separate fields"""
+    if "time_signature" in request:
+        numerator, denominator = batch_mode.parse_time_signature(request["time_signature"])
+        if numerator is None:
+            raise RequestError(400, "time_signature must look like \"7/8\"")
+        numerators, denominators = [float(numerator)], [float(denominator)]
+    else:
+        numerators = _column(request, "numerator", 4)[0]
+        denominators = _column(request, "denominator", 4)[0]
+    return _broadcast(numerators, count), _broadcast(denominators, count)
+
+
+def _nan_for_none(value):
+    return float("nan") if value is None else value
+
+
+# === HTTP ===
+
+async def _read_request(reader):
+    """Read one HTTP request; returns (method, path, body, keep_alive) or None at EOF"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise RequestError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0) or 0)
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return method, path.split("?", 1)[0], body, keep_alive
+
+
+def _response(status, body, keep_alive):
+    if isinstance(body, str):
+        payload = body.encode("utf-8")
+        content_type = "text/plain; version=0.0.4"
+    else:
+        payload = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        content_type = "application/json"
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + payload
+
+
+class TimingServer:
+    """HTTP/1.1 front end for a TimingService"""
+
+    def __init__(self, service=None):
+        self.service = service or TimingService()
+
+    async def handle_connection(self, reader, writer):
+        # Requests are read and dispatched as they arrive; responses are written in order
+        responses = asyncio.Queue(MAX_PIPELINE_DEPTH)
+        writer_task = asyncio.ensure_future(self._write_responses(responses, writer))
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), IDLE_TIMEOUT)
+                except RequestError as e:
+                    await responses.put((_completed((e.status, {"error": str(e)})), False))
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+                    break
+                if request is None:
+                    break
+                method, path, body, keep_alive = request
+                await responses.put((asyncio.ensure_future(self.service.handle(method, path, body)),
+                                     keep_alive))
+                if not keep_alive:
+                    break
+        finally:
+            await responses.put(None)
+            await writer_task
+
+    async def _write_responses(self, responses, writer):
+        try:
+            while True:
+                entry = await responses.get()
+                if entry is None:
+                    break
+                future, keep_alive = entry
+                status, body = await future
+                writer.write(_response(status, body, keep_alive))
+                # Flush when nothing else is ready so pipelined responses share writes
+                if responses.empty():
+                    await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            where = f"http://{host}:{port}"
+        print(f"Timing server listening on {where}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def _completed(result):
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+def main(argv=None):
+    """Command-line entry point for `bpm_calculator.py serve`"""
+    parser = argparse.ArgumentParser(prog="bpm_calculator.py serve",
+                                     description="Serve note duration and beat position queries over HTTP/JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(TimingServer().serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0